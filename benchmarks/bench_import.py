@@ -0,0 +1,68 @@
+#!/bin/python3
+'''
+Benchmark for the time taken to import each module in a fresh interpreter,
+and whether importing it loads selenium.
+
+python benchmarks/bench_import.py [--repeat N] [modules ...]
+'''
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    'm3u8_parser',
+    'common',
+    'crawler',
+    'downloader',
+    'download_files',
+    'browser',
+]
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'elapsed': elapsed,
+    'selenium': 'selenium' in sys.modules,
+    'requests': 'requests' in sys.modules,
+}}))
+'''
+
+
+def time_import(module):
+    res = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    args = parser.parse_args()
+
+    print(f'{"module":<16} {"median":>9} {"min":>9}  selenium  requests')
+    for module in args.modules:
+        results = [time_import(module) for _ in range(args.repeat)]
+        elapsed = [x['elapsed'] * 1000 for x in results]
+        print(
+            f'{module:<16} {statistics.median(elapsed):>7.1f}ms '
+            f'{min(elapsed):>7.1f}ms  '
+            f'{str(results[0]["selenium"]):<8}  {results[0]["requests"]}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/bin/python3
+'''
+Micro-benchmark for the M3U8 parser using large synthetic playlists.
+
+python benchmarks/bench_m3u8.py [--variants N] [--segments N] [--repeat N]
+'''
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from m3u8_parser import M3U8
+
+
+def make_master_playlist(n_variants, n_groups=10):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:6', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for group in range(n_groups):
+        for lang in ('en', 'zh', 'ms'):
+            lines.append(
+                f'#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="subs{group}",'
+                f'NAME="{lang}",LANGUAGE="{lang}",AUTOSELECT=YES,'
+                f'URI="subs/{group}/{lang}.m3u8?token=a,b,c"'
+            )
+    for i in range(n_variants):
+        lines.append(
+            f'#EXT-X-STREAM-INF:BANDWIDTH={(i * 7919) % 5000000 + 1000},'
+            f'AVERAGE-BANDWIDTH={i + 1000},'
+            'CODECS="avc1.4d401f,mp4a.40.2",RESOLUTION=1280x720,'
+            f'FRAME-RATE=29.970,SUBTITLES="subs{i % n_groups}"'
+        )
+        lines.append(f'video/{i}/index.m3u8')
+    return '\n'.join(lines) + '\n'
+
+
+def make_media_playlist(n_segments):
+    lines = [
+        '#EXTM3U', 
+        '#EXT-X-VERSION:4', 
+        '#EXT-X-TARGETDURATION:10',
+        '#EXT-X-MEDIA-SEQUENCE:1',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+    ]
+    for i in range(n_segments):
+        if i % 1000 == 0:
+            lines.append(
+                f'#EXT-X-KEY:METHOD=AES-128,URI="keys/{i}.key",'
+                f'IV=0x{i:032x}'
+            )
+        if i % 2:
+            lines.append('#EXTINF:9.984,')
+            lines.append('#EXT-X-BYTERANGE:522828')
+            lines.append('video/all.ts')
+        else:
+            lines.append('#EXTINF:10.000,')
+            lines.append(f'video/segment{i}.ts?token=abcdef')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def bench(name, text, repeat):
+    n_lines = text.count('\n')
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        M3U8.parse(text, base_url='https://example.com/hls/master.m3u8')
+        best = min(best, time.perf_counter() - start)
+    print(
+        f'{name}: {n_lines} lines, {len(text) / 1e6:.1f} MB, '
+        f'best of {repeat}: {best * 1000:.1f} ms '
+        f'({n_lines / best / 1e6:.2f}M lines/s)'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--variants', type=int, default=20000)
+    parser.add_argument('--segments', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    bench('master', make_master_playlist(args.variants), args.repeat)
+    bench('media', make_media_playlist(args.segments), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
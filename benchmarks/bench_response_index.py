@@ -0,0 +1,102 @@
+#!/bin/python3
+'''
+Benchmark for looking up .m3u8 responses among the network responses
+recorded from the browser, comparing a full scan of the history with
+ResponseIndex.
+
+python benchmarks/bench_response_index.py [--responses N] [--videos N]
+'''
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browser import ResponseIndex, M3U8_MIME_TYPES
+
+OTHER_MIME_TYPES = [
+    'text/html', 'application/javascript', 'text/css', 'image/png',
+    'application/json', 'video/mp2t', 'font/woff2', 'image/svg+xml',
+]
+
+
+def make_responses(n_responses, n_videos, start_time=0.0):
+    '''
+    Simulates a session in which each video page produces a burst of 
+    unrelated responses and a couple of .m3u8 responses
+    '''
+    rng = random.Random(0)
+    responses = []
+    t = start_time
+    per_video = n_responses // n_videos
+    for video in range(n_videos):
+        for i in range(per_video):
+            t += 0.001
+            if i in (per_video // 2, per_video // 2 + 1):
+                mimetype = M3U8_MIME_TYPES[i % 2]
+            else:
+                mimetype = rng.choice(OTHER_MIME_TYPES)
+            responses.append({
+                'request_id': f'{video}.{i}',
+                'url': f'https://example.com/{video}/{i}',
+                'mimeType': mimetype,
+                'status': 200,
+                'time': t,
+            })
+    return responses
+
+
+def scan(history, start):
+    return [
+        x for x in history 
+        if x['time'] >= start and x['mimeType'] in M3U8_MIME_TYPES
+    ]
+
+
+def run(name, responses, n_videos, polls, add, lookup):
+    per_video = len(responses) // n_videos
+    start = time.perf_counter()
+    found = 0
+    for video in range(n_videos):
+        batch = responses[video * per_video:(video + 1) * per_video]
+        video_start = batch[0]['time']
+        # responses arrive while the page is polled
+        step = max(len(batch) // polls, 1)
+        for i in range(0, len(batch), step):
+            for x in batch[i:i + step]:
+                add(x)
+            found += len(lookup(video_start))
+    elapsed = time.perf_counter() - start
+    print(f'{name}: {elapsed * 1000:.1f} ms ({found} matches)')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--responses', type=int, default=50000)
+    parser.add_argument('--videos', type=int, default=60)
+    parser.add_argument('--polls', type=int, default=4)
+    args = parser.parse_args()
+
+    responses = make_responses(args.responses, args.videos)
+    print(f'{len(responses)} responses, {args.videos} videos, '
+          f'{args.polls} polls per video')
+
+    history = []
+    t_scan = run(
+        'full scan', responses, args.videos, args.polls,
+        history.append, lambda start: scan(history, start),
+    )
+
+    index = ResponseIndex(max_per_type=len(responses))
+    t_index = run(
+        'ResponseIndex', responses, args.videos, args.polls,
+        index.add, lambda start: index.since(M3U8_MIME_TYPES, start),
+    )
+    print(f'speedup: {t_scan / t_index:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
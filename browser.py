@@ -0,0 +1,1021 @@
+#!/bin/python3
+'''
+Signs in to NTU Learn with a headless Chrome browser and extracts
+what is only available to the browser, such as video playlists.
+'''
+# ==================== IMPORTS ===========================
+import json
+import re
+import base64
+import time
+import getpass
+import os
+
+from queue import Queue
+from bisect import bisect_left, bisect_right
+from collections import deque
+from urllib.parse import urlparse
+from threading import Lock, Event, Condition as ThreadCondition
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# ==================== IMPORTS REQURING PIP INSTALL ===========================
+from selenium.common.exceptions import StaleElementReferenceException
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver import Chrome as ChromeWebDriver
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.common.by import By
+
+# =========== IMPORT FROM OTHER SCRIPT ==============
+from common import (
+    config, logger, clean_filename, cookies_to_dict, USER_AGENT,
+    BASE_URL, SSO_LOGIN_BASE_URL, COURSE_MEMBERSHIPS_URL,
+    COURSE_CONTENT_TREE_TEMPLATE, CURRENT_USER_URL,
+)
+from crawler import ContentCrawler
+from m3u8_parser import M3U8
+
+# ===================== OTHER CONSTANTS ==============
+WINDOW_W = 1920
+WINDOW_H = 1080
+
+# seconds between polls of the browser performance log
+LOG_POLL_INTERVAL = 0.2
+# performance log events used by NTULearnClient
+LOG_WATCHER_METHODS = (
+    '"Network.responseReceived"',
+    '"Page.frameNavigated"',
+)
+# number of events kept in memory (responses are kept per mimeType)
+RESPONSE_HISTORY_SIZE = 10000
+LINK_HISTORY_SIZE = 1000
+
+# ===================== CSS SELECTORS ==============
+SSO_FORM_SELECTOR = 'form[action*="https://login.microsoftonline.com"]'
+
+EMAIL_INPUT_SELECTOR = 'input[type="email"]'
+PASSWORD_INPUT_SELECTOR = 'input[type="password"]'
+NEXT_INPUT_SELECTOR = 'input[type="submit"][value="Next"]'
+SIGNIN_INPUT_SELECTOR = 'input[type="submit"][value="Sign in"]'
+YES_INPUT_SELECTOR = 'input[type="submit"][value="Yes"]'
+
+COURSE_LIST_MANAGEMENT_CONTAINER_SELECTOR = '.course-overview-management-container'
+COURSE_LIST_FILTER_DELETE_SELECTOR = '.course-overview-management-container [class*="makeStyleschipContainer"] button[aria-label="delete"]'
+COURSE_LIST_ITEMS_PER_PAGE_BUTTON_SELECTOR = '.course-overview-management-container button[aria-label*="items per page"]'
+COURSE_LIST_ITEM_PER_PAGE_OPTION = '.course-overview-management-container #page-selector-menu li[role="menuitem"]'
+COURSE_LIST_SELECTOR = '#main-content-inner'
+COURSE_CARD_ID_SELECTOR = '.course-id' 
+COURSE_CARD_TITLE_SELECTOR = '.course-title .js-course-title-element'
+COURSE_CARD_STATUS_SELECTOR = '.course-status'
+COURSE_CARD_SELECTOR = 'bb-base-course-card article'
+
+CONTENT_TREE_ITEM_SELECTOR = 'li[id*="Link$ReferredToType:CONTENT"]'
+CONTENT_TREE_ITEM_LINK_SELECTOR = 'a[href][title][target="content"]'
+CONTENT_FOLDER_ATTACHMENT_LINK_SELECTOR = 'a[href*="/bbcswebdav"]'
+
+# returns [{content_id, title, href, path, is_leaf}] for every content 
+# folder, path holds the titles of the folders containing it
+CONTENT_TREE_SCRIPT = '''
+const items = Array.from(document.querySelectorAll(arguments[0]));
+const infos = new Map();
+for (const li of items) {
+    const link = li.querySelector(arguments[1]);
+    infos.set(li, {
+        content_id: li.id.split(':::')[1],
+        title: link.getAttribute('title').trim(),
+        href: link.href,
+        path: [],
+        is_leaf: true,
+    });
+}
+for (const li of items) {
+    const info = infos.get(li);
+    for (let p = li.parentElement; p; p = p.parentElement) {
+        const parent = infos.get(p);
+        if (parent) {
+            parent.is_leaf = false;
+            info.path.unshift(parent.title);
+        }
+    }
+}
+return items.map(li => infos.get(li));
+'''
+
+# returns {ready, attachments: [{text, href}]} for a content folder page
+# ready is false until the page has loaded
+FOLDER_ATTACHMENTS_SCRIPT = '''
+const item = document.getElementById('contentListItem:' + arguments[0]);
+if (!item) {
+    return {ready: document.readyState === 'complete', attachments: []};
+}
+const attachments = Array.from(item.querySelectorAll('.attachments li'));
+return {
+    ready: true,
+    attachments: attachments.map(li => {
+        const link = li.querySelector(arguments[1]);
+        return {text: li.innerText, href: link ? link.href : null};
+    }),
+};
+'''
+
+IFRAME_SELECTOR_TEMPLATE = 'iframe[src*="{0}"]'
+
+CONTENT_TREE_COURSE_MEDIA_LINK_SELECTOR = (
+    'li[id*="Link$ReferredToType:TOOL"] '
+    'a[title="Course Media"][target="content"]'
+)
+COURSE_MEDIA_THUMBNAIL_SELECTOR = '#galleryGrid .thumbnail'
+COURSE_MEDIA_THUMBNAIL_NAME_SELECTOR = 'p.thumb_name_content'
+COURSE_MEDIA_THUMBNAIL_LINK_SELECTOR = 'a.item_link[href]'
+
+KALTURA_PLAYER_SELECTOR = '#kplayer'
+KALTURA_PLAY_BUTTON_SELECTOR = '#kplayer button[aria-label="Play"]'
+
+BODY_SELECTOR = 'body'
+
+M3U8_MIME_TYPES = (
+    'application/x-mpegurl',
+    'application/vnd.apple.mpegurl',
+)
+
+
+# ==================== CODE ===========================
+
+class Element:
+    @staticmethod
+    def get_bounding_rect(driver, elem):
+        rect = driver.execute_script('return arguments[0].getBoundingClientRect()', elem)
+        return rect
+
+    @staticmethod
+    def scroll_by(driver, elem, x=0, y=0):
+        driver.execute_script('arguments[0].scrollBy(arguments[1], arguments[2])', elem, x, y)
+
+    @staticmethod
+    def set_attribute(driver, elem, key: str, val: str):
+        driver.execute_script(
+            'arguments[0].setAttribute(arguments[1], arguments[2]);',
+            elem, key, str(val),
+        )
+
+    @staticmethod
+    def toggle_attribute(driver, elem, key: str, val: bool):
+        driver.execute_script(
+            'arguments[0].toggleAttribute(arguments[1], arguments[2]);',
+            elem, key, bool(val),
+        )
+
+    @staticmethod
+    def get_parent(driver, elem):
+        return driver.execute_script(
+            'return arguments[0].parentElement;',
+            elem
+        )
+
+    @staticmethod
+    def has_attribute(driver, elem, key: str):
+        return driver.execute_script(
+            'return arguments[0].hasAttribute(arguments[1]);',
+            elem, key
+        )
+
+class Condition:
+    @staticmethod
+    def url_is_any(*urls):
+        url_set = set(urls)
+        def condition(driver):
+            current_url = driver.current_url
+            if current_url in url_set:
+                return current_url
+        return condition
+
+    @staticmethod
+    def url_contains_any(*queries):
+        def condition(driver):
+            current_url = driver.current_url
+            for i, query in enumerate(queries):
+                if query in current_url:
+                    return current_url
+        return condition
+
+    @staticmethod
+    def contains_text(elem, text):
+        def condition(driver):
+            in_text = text in elem.text
+            return in_text
+        return condition
+    
+    @staticmethod
+    def course_cards_are_complete(course_cards):
+        incomplete_set = set(range(len(course_cards)))
+        def condition(driver):
+            values = list(incomplete_set)
+            for i in values:
+                card_info = NTULearnClient.course_card_to_info(
+                    course_cards[i]
+                )
+                is_complete = True
+                for v in card_info.values():
+                    if len(v.strip()) == 0:
+                        is_complete = False
+                        break
+                if is_complete:
+                    incomplete_set.remove(i)
+            return len(incomplete_set) == 0
+        return condition
+
+class Credentials:
+    def __init__(self, email=None, password=None, path=None):
+        self.email = email
+        self.password = password
+    
+    def get_email(self):
+        if self.email is None:
+            email = input("Enter NTU email: ")
+            return email
+        return self.email
+    
+    def get_password(self):
+        if self.password is None:
+            password = getpass.getpass('Enter NTU email password: ')
+            return password
+        return self.password
+
+class ResponseIndex:
+    '''
+    Network responses indexed by mimeType.
+    Responses of each mimeType are kept in time order so that the 
+    responses received after a given time can be found by bisection
+    instead of scanning the whole history.
+    '''
+    def __init__(self, max_per_type=RESPONSE_HISTORY_SIZE):
+        self.max_per_type = max_per_type
+        self._lock = Lock()
+        self._added = ThreadCondition(self._lock)
+        self._times = {}
+        self._responses = {}
+
+    def add(self, response):
+        mimetype = response['mimeType']
+        t = response['time']
+        with self._lock:
+            times = self._times.setdefault(mimetype, [])
+            responses = self._responses.setdefault(mimetype, [])
+            if times and t < times[-1]:
+                # out of order, rare
+                idx = bisect_right(times, t)
+                times.insert(idx, t)
+                responses.insert(idx, response)
+            else:
+                times.append(t)
+                responses.append(response)
+            # trim in batches to keep appends amortised O(1)
+            if len(times) > 2 * self.max_per_type:
+                del times[:-self.max_per_type]
+                del responses[:-self.max_per_type]
+            self._added.notify_all()
+
+    def since(self, mimetypes, start, end=float('inf')):
+        '''
+        Responses of the given mimeTypes received at or after start 
+        and before end, in time order
+        '''
+        with self._lock:
+            return self._since(mimetypes, start, end)
+
+    def _since(self, mimetypes, start, end=float('inf')):
+        # the lock must be held
+        results = []
+        for mimetype in mimetypes:
+            times = self._times.get(mimetype)
+            if not times:
+                continue
+            lo = bisect_left(times, start)
+            hi = bisect_left(times, end, lo)
+            results.extend(self._responses[mimetype][lo:hi])
+        if len(mimetypes) > 1:
+            results.sort(key=lambda x: x['time'])
+        return results
+
+    def wait_for(self, mimetypes, start, timeout, exclude=()):
+        '''
+        Same as since(), but blocks for up to timeout seconds 
+        until at least one matching response whose request_id 
+        is not in exclude has been received
+        '''
+        deadline = time.monotonic() + timeout
+        # checked and waited for under the same lock,
+        # so that a response added in between is not missed
+        with self._added:
+            while True:
+                results = [
+                    x for x in self._since(mimetypes, start)
+                    if x['request_id'] not in exclude
+                ]
+                remaining = deadline - time.monotonic()
+                if results or remaining <= 0:
+                    return results
+                self._added.wait(remaining)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(x) for x in self._times.values())
+
+class NTULearnClient:
+    BASE_URL = BASE_URL
+    SSO_LOGIN_BASE_URL = SSO_LOGIN_BASE_URL
+    
+    HOME_PAGE = BASE_URL + '/ultra/institution-page'
+    # static page used to set cookies for BASE_URL
+    COOKIE_PAGE = BASE_URL + '/favicon.ico'
+    COURSES_PAGE = BASE_URL + '/ultra/course'
+    CURRENT_USER_URL = CURRENT_USER_URL
+    COURSE_MEMBERSHIPS_URL = COURSE_MEMBERSHIPS_URL
+    COURSE_CONTENT_TREE_TEMPLATE = COURSE_CONTENT_TREE_TEMPLATE
+
+    def __init__(self, credentials, cookies=None):
+        self.credentials = credentials
+        # set when the browser was given cookies of a validated session
+        self.authenticated = False
+        options = Options()
+        options.add_argument('--headless=new')
+        options.add_argument(f"--window-size={WINDOW_W},{WINDOW_H}")
+        options.add_argument(f'user-agent={USER_AGENT}')
+        options.set_capability('goog:loggingPrefs', {
+            'performance': 'ALL',
+        })
+        self.driver = ChromeWebDriver(
+            options=options
+        )
+        self.driver.execute_cdp_cmd("Network.enable", {})
+        self.driver.execute_cdp_cmd("Page.enable", {})
+
+        # bounded so that long sessions do not grow without limit
+        self.link_history_lock = Lock()
+        self.link_history = deque(maxlen=LINK_HISTORY_SIZE)
+        
+        self.responses = ResponseIndex()
+
+        self.log_watcher_stop = Event()
+        self.log_thread_executor = ThreadPoolExecutor(max_workers=1)
+        self.log_thread_executor.submit(self.log_watcher_loop)
+
+        if cookies:
+            self.add_cookies(cookies)
+            self.authenticated = True
+
+    def log_watcher_loop(self):
+        while not self.log_watcher_stop.is_set():
+            try:
+                entries = self.driver.get_log('performance')
+            except Exception as e:
+                if not self.log_watcher_stop.is_set():
+                    logger.error(f'Log watcher failed:\n{e}')
+                return
+
+            for entry in entries:
+                # a malformed entry is skipped instead of 
+                # stopping the watcher for the rest of the session
+                try:
+                    self.handle_log_entry(entry)
+                except Exception as e:
+                    logger.error(
+                        f'Failed to parse log entry {str(entry)[:200]}:\n{e}'
+                    )
+
+            self.log_watcher_stop.wait(LOG_POLL_INTERVAL)
+
+    def handle_log_entry(self, entry):
+        raw_message = entry['message']
+        # most entries are irrelevant, skip them before parsing
+        if not any(x in raw_message for x in LOG_WATCHER_METHODS):
+            return
+        message = json.loads(raw_message)['message']
+        method = message['method']
+        # use the time the browser logged the event
+        # rather than the time it was polled
+        event_time = entry['timestamp'] / 1000
+        # track frame navigation log events
+        if method == 'Page.frameNavigated':
+            url = message['params']['frame']['url']
+            with self.link_history_lock:
+                self.link_history.append({
+                    'url': url,
+                    'time': event_time,
+                })
+            logger.debug(f'Navigated to: {url}')
+
+        elif method == 'Network.responseReceived':
+            resp = message['params']['response']
+            request_id = message['params']['requestId']
+            url = resp.get('url', '')
+            status = resp.get('status')
+            mimetype = resp.get('mimeType')
+            
+            self.responses.add({
+                'request_id': request_id,
+                'url': url,
+                'mimeType': mimetype,
+                'status': status,
+                'time': event_time,
+            })
+
+    def goto_home(self):
+        logger.info(f'Navigate to {self.HOME_PAGE}')
+        self.driver.get(self.HOME_PAGE)
+        self.wait_for_page_or_signin(self.HOME_PAGE)
+    
+    def signin(self):
+        email = self.credentials.get_email()
+        password = self.credentials.get_password()
+        print('Signing in with provided credentials')
+        self.wait_for_input_then_send_keys(
+                EMAIL_INPUT_SELECTOR, email)
+        self.wait_for_input_then_send_keys(
+                PASSWORD_INPUT_SELECTOR, password)
+        self.wait_for_button_presence_then_click(NEXT_INPUT_SELECTOR)
+        self.wait_for_button_presence_then_click(SIGNIN_INPUT_SELECTOR)
+        self.wait_for_button_presence_then_click(YES_INPUT_SELECTOR)
+
+    @staticmethod
+    def course_card_to_info(card):
+        course_id = card.get_attribute('id').split('-')[-1]
+        card_info = {'course_id': course_id}
+        
+        for key, selector in [
+            ('short_name', COURSE_CARD_ID_SELECTOR),
+            ('long_name', COURSE_CARD_TITLE_SELECTOR),
+            ('status', COURSE_CARD_STATUS_SELECTOR)
+        ]:
+            info_elem = card.find_element(By.CSS_SELECTOR, selector)
+            text = info_elem.get_attribute('textContent').strip()
+            card_info[key] = text
+
+        return card_info
+
+    @staticmethod
+    def course_cards_to_info(cards):
+        return [
+            NTULearnClient.course_card_to_info(card) 
+            for card in cards
+        ]
+    
+    def enumerate_course_media(self, course_info, timeout=10):
+        driver = self.driver
+        self.goto_course_content_tree(course_info)
+        
+        # get course media link
+        link = WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((
+                By.CSS_SELECTOR,
+                CONTENT_TREE_COURSE_MEDIA_LINK_SELECTOR
+            ))
+        )
+        href = link.get_attribute('href')
+        # navigate to course media
+        # this will open an iframe
+        driver.get(href)
+        iframe = WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((
+                By.CSS_SELECTOR,        
+                'iframe'
+                #IFRAME_SELECTOR_TEMPLATE.format(href)
+            ))
+        )
+        driver.switch_to.frame(iframe)
+
+        # find gallery thumbnails
+        thumbnails = WebDriverWait(driver, timeout).until(
+            EC.presence_of_all_elements_located((
+                By.CSS_SELECTOR,
+                COURSE_MEDIA_THUMBNAIL_SELECTOR
+            ))
+        )
+
+        media_infos = []
+        for thumbnail in thumbnails:
+            media_name = thumbnail.find_element(
+                By.CSS_SELECTOR,
+                COURSE_MEDIA_THUMBNAIL_NAME_SELECTOR
+            )
+            media_name = media_name.text.strip()
+            media_link = thumbnail.find_element(
+                By.CSS_SELECTOR,
+                COURSE_MEDIA_THUMBNAIL_LINK_SELECTOR
+            )
+            href = medi_link = media_link.get_attribute('href')
+            media_infos.append({
+                'short_name': course_info['short_name'],
+                'name': media_name,
+                'href': href
+            })
+        msg = f'Found {len(media_infos)} media items'
+        logger.info(msg)
+        driver.switch_to.default_content()
+        return media_infos
+    
+    def extract_playlists_from_media_infos(
+        self, 
+        media_infos, 
+        workers=config.MEDIA_EXTRACTION_WORKERS,
+    ):
+        return list(self.iter_playlists_from_media_infos(media_infos, workers))
+
+    def iter_playlists_from_media_infos(
+        self, 
+        media_infos, 
+        workers=config.MEDIA_EXTRACTION_WORKERS,
+    ):
+        '''
+        Yields each playlist as soon as it has been extracted
+        '''
+        media_infos = [x for x in media_infos if x is not None]
+        workers = max(1, min(workers, len(media_infos)))
+        if workers == 1:
+            playlists = map(self.extract_m3u8_playlist, media_infos)
+        else:
+            playlists = self.iter_playlists_with_pool(media_infos, workers)
+        for playlist in playlists:
+            if playlist is not None:
+                yield playlist
+
+    def iter_playlists_with_pool(self, media_infos, workers):
+        '''
+        Extract playlists concurrently using this client and 
+        (workers - 1) additional browsers signed in with its cookies.
+        Playlists are yielded in the order they are extracted.
+        '''
+        logger.info(f'Starting {workers - 1} additional browsers')
+        clients = Queue()
+        clients.put(self)
+        extra_clients = []
+        # read once, the driver is not shared between threads
+        cookies = self.driver.get_cookies()
+        with ThreadPoolExecutor(max_workers=workers - 1) as executor:
+            futures = [
+                executor.submit(self.spawn_worker, cookies) 
+                for _ in range(workers - 1)
+            ]
+            for future in futures:
+                try:
+                    client = future.result()
+                    extra_clients.append(client)
+                    clients.put(client)
+                except Exception as e:
+                    logger.error(f'Failed to start browser:\n{e}')
+
+        def extract(media_info):
+            client = clients.get()
+            try:
+                return client.extract_m3u8_playlist(media_info)
+            finally:
+                clients.put(client)
+
+        try:
+            n = len(extra_clients) + 1
+            with ThreadPoolExecutor(max_workers=n) as executor:
+                futures = [executor.submit(extract, x) for x in media_infos]
+                for future in as_completed(futures):
+                    yield future.result()
+        finally:
+            for client in extra_clients:
+                client.close()
+
+    def spawn_worker(self, cookies):
+        '''
+        Start another browser signed in with the cookies of this client
+        '''
+        client = NTULearnClient(self.credentials)
+        client.add_cookies(cookies)
+        return client
+
+    def add_cookies(self, cookies):
+        # cookies can only be set for the domain of the current page
+        self.driver.get(self.COOKIE_PAGE)
+        domain = urlparse(self.BASE_URL).hostname
+        for cookie in cookies:
+            if not domain.endswith(cookie.get('domain', '').lstrip('.')):
+                continue
+            try:
+                self.driver.add_cookie(cookie)
+            except Exception as e:
+                logger.debug(f'Unable to add cookie {cookie["name"]}: {e}')
+
+    def goto_courses(self):
+        logger.info(f'Navigate to {self.COURSES_PAGE}')
+        self.driver.get(self.COURSES_PAGE)
+        self.wait_for_page_or_signin(self.COURSES_PAGE)
+        self.authenticated = True
+
+    def enumerate_courses(self, timeout=10, use_api=True):
+        driver = self.driver
+        if use_api:
+            if not self.authenticated:
+                self.goto_courses()
+            crawler = ContentCrawler(self.get_cookies(), max_workers=1)
+            try:
+                return crawler.enumerate_courses()
+            except Exception as e:
+                logger.warning(
+                    'Course list request failed, '
+                    f'falling back to the browser:\n{e}'
+                )
+            finally:
+                crawler.close()
+
+        self.goto_courses()
+        # wait for presence of mangement container element
+        # this should indicate that the page has loaded
+        WebDriverWait(driver, timeout).until(
+            EC.visibility_of_element_located((
+                By.CSS_SELECTOR, 
+                COURSE_LIST_MANAGEMENT_CONTAINER_SELECTOR,
+            ))
+        )
+
+        print("Extracting course list")
+        self.show_maximum_course_cards()
+        self.disable_course_filters_if_any()
+        course_cards = self.wait_for_cards_to_load()
+        courses_info = NTULearnClient.course_cards_to_info(course_cards)
+        open_courses_info = list(filter(
+            lambda x: x['status'] == 'Open', 
+            courses_info
+        ))
+        return open_courses_info
+
+    def show_maximum_course_cards(self, timeout=5):
+        driver = self.driver
+
+        menu = driver.find_element(
+            By.CSS_SELECTOR, 
+            COURSE_LIST_ITEMS_PER_PAGE_BUTTON_SELECTOR
+        )
+        print(menu)
+        print(menu.is_displayed())
+        menu = WebDriverWait(driver, timeout).until(
+            #EC.element_to_be_clickable((
+            #EC.visibility_of_element_located((
+            EC.presence_of_element_located((
+                By.CSS_SELECTOR, 
+                COURSE_LIST_ITEMS_PER_PAGE_BUTTON_SELECTOR
+            ))
+        )
+        print(menu)
+        print(menu.is_displayed())
+        # click page item count menu to show dropdown
+        menu.click()
+        
+        # find option buttons
+        options = WebDriverWait(driver, timeout).until(
+            EC.visibility_of_all_elements_located((
+                By.CSS_SELECTOR, 
+                COURSE_LIST_ITEM_PER_PAGE_OPTION
+            ))
+        )
+
+        # find option with maximum value
+        max_count = 0
+        max_count_button = None
+        for option in options:
+            value = option.get_attribute("value");
+            try:
+                count = int(value)
+            except Exception as e:
+                logger.error(
+                    f"Found non-integer page item count option: {value}"
+                )
+                continue
+            if count > max_count:
+                max_count = count
+                max_count_button = option
+
+        # select maximum value option
+        if max_count > 0:
+            print(f"Setting page items to {max_count}")
+            max_count_button.click()
+
+    def disable_course_filters_if_any(self, timeout=5):
+        driver = self.driver
+        chips = driver.find_elements(
+            By.CSS_SELECTOR, 
+            COURSE_LIST_FILTER_DELETE_SELECTOR
+        )
+        print(f"Disabling {len(chips)}(?) filters")
+        disable_count = 0
+        for del_chip in chips:
+            try:
+                del_chip.click()
+                disable_count += 1
+            except StaleElementReferenceException:
+                # certain delete buttons cause other buttons to be removed
+                # e.g. the delete button in the text input area deletes the chips too 
+                pass
+        return disable_count
+
+    def wait_for_cards_to_load(self, timeout=10):
+        driver = self.driver
+        driver.implicitly_wait(1)
+        course_cards = driver.find_elements(
+            By.CSS_SELECTOR, 
+            COURSE_CARD_SELECTOR
+        )
+        scrollable_course_list = driver.find_element(
+            By.CSS_SELECTOR, 
+            COURSE_LIST_SELECTOR
+        )
+        container_rect = Element.get_bounding_rect(
+            driver,
+            scrollable_course_list
+        )
+
+        height = driver.execute_script('return window.innerHeight');
+        offset = 0
+        while offset < len(course_cards):
+            # count elements in viewport
+            n_in_viewport = 0
+            has_remaining = False
+            for course_card in course_cards[offset:]:
+                item_rect = Element.get_bounding_rect(driver, course_card)
+                is_in_viewport = (
+                    0 < item_rect['bottom'] < height
+                ) or (
+                    0 < item_rect['top'] < height
+                )
+                if is_in_viewport:
+                    n_in_viewport += 1
+                else:
+                    has_remaining = True
+                    break
+
+            cards_in_view = course_cards[offset:offset+n_in_viewport]
+            # course card needs to be in viewport for information to load
+            # wait for course info to be loaded
+            WebDriverWait(driver, timeout).until(
+                Condition.course_cards_are_complete(cards_in_view)
+            )
+            offset = offset + n_in_viewport
+            logger.info(f'Course cards loaded: {offset}/{len(course_cards)}')
+            
+            if has_remaining:
+                next_rect = Element.get_bounding_rect(
+                    driver, course_cards[offset]
+                )
+                scroll_h = next_rect['top']
+                Element.scroll_by(
+                    driver, scrollable_course_list, x=0, y=scroll_h
+                )
+
+        return course_cards
+
+    def wait_for_page(self, page, timeout=10):
+        driver = self.driver
+        res = WebDriverWait(driver, timeout).until(
+            Condition.url_is_any(page)
+        )
+        
+    def wait_for_page_or_signin(self, page, timeout=10):
+        driver = self.driver
+        res1 = WebDriverWait(driver, timeout).until(EC.any_of(
+            # returns element
+            EC.presence_of_element_located((By.CSS_SELECTOR, SSO_FORM_SELECTOR)),
+            # returns page url
+            Condition.url_is_any(page), 
+        ))
+        if not isinstance(res1, str):
+            self.signin()
+
+        res2 = WebDriverWait(driver, timeout).until(
+            Condition.url_is_any(page), 
+        )
+        if isinstance(res1, str):
+            print('Authenticated!')
+
+    def wait_for_input_then_send_keys(self, css_selector, keys, timeout=10):
+        driver = self.driver
+        input_el = WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, css_selector)))
+        input_el.send_keys(keys)
+
+    def wait_for_button_presence_then_click(self, css_selector, timeout=10):
+        driver = self.driver
+        btn_el = WebDriverWait(driver, timeout).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, css_selector)))
+        btn_el.click()
+
+    def goto_course_content_tree(self, course_info, timeout=10):
+        driver = self.driver
+        course_id = course_info['course_id']
+        path = NTULearnClient.COURSE_CONTENT_TREE_TEMPLATE.format(
+            course_id
+        )
+        driver.get(path)
+
+    def enumerate_content_folders(self, course_info, timeout=10):
+        self.goto_course_content_tree(course_info)
+
+        driver = self.driver
+        course_id = course_info['course_id']
+        WebDriverWait(driver, timeout).until(
+            EC.presence_of_all_elements_located((
+                By.CSS_SELECTOR, CONTENT_TREE_ITEM_SELECTOR 
+            ))
+        )
+        # extract the whole tree in a single round trip
+        tree = driver.execute_script(
+            CONTENT_TREE_SCRIPT,
+            CONTENT_TREE_ITEM_SELECTOR,
+            CONTENT_TREE_ITEM_LINK_SELECTOR,
+        )
+
+        leaf_folders = []
+        for item in tree:
+            if not item['is_leaf']:
+                continue
+            filename = clean_filename(item['title'])
+            path_parts = [clean_filename(x) for x in item['path']]
+            path_parts.append(filename)
+            leaf_folders.append({
+                'content_id': item['content_id'],
+                'course_id': course_id,
+                'course_short_name': course_info['short_name'],
+                'course_long_name': course_info['long_name'],
+                'filename': filename,
+                'href': item['href'],
+                'filepath': os.path.join(*path_parts),
+            })
+        return leaf_folders
+    
+    def enumerate_attachments_for_course(self, course_info):
+        folders = self.enumerate_content_folders(course_info)
+        attachments = self.enumerate_attachments_for_folders(folders)
+        return attachments
+
+    def enumerate_attachments_for_folders(self, folders, timeout=1):
+        all_attachments = list(
+            self.iter_attachments_for_folders(folders, timeout=timeout)
+        )
+        n = len(all_attachments)
+        logger.info(f"Found {n} attachments");
+        print(f'Found {n} attachments')
+        return all_attachments
+
+    def iter_attachments_for_folders(self, folders, timeout=1):
+        for folder in folders:
+            yield from self.enumerate_attachments_for_folder(
+                    folder, timeout=timeout)
+
+    def enumerate_attachments_for_folder(self, folder, timeout=5):
+        driver = self.driver
+        content_id = folder['content_id']
+        course_id = folder['course_id']
+        href = folder['href']
+
+        driver.get(href)
+        logger.debug(f'Extracting attachments of {content_id} from {href}')
+
+        def attachments_loaded(driver):
+            result = driver.execute_script(
+                FOLDER_ATTACHMENTS_SCRIPT,
+                content_id,
+                CONTENT_FOLDER_ATTACHMENT_LINK_SELECTOR,
+            )
+            if result['ready']:
+                return result
+            return False
+
+        try:
+            # returns as soon as the page has loaded,
+            # even if the folder has no attachments
+            result = WebDriverWait(driver, timeout=timeout).until(
+                attachments_loaded
+            )
+        except TimeoutException: 
+            logger.warning(
+                "Unable to locate any attachments "
+                f"for course:{course_id} content:{content_id} "
+            )
+            return []
+        
+        return NTULearnClient.parse_folder_attachments(
+            result['attachments'], folder
+        )
+
+    @staticmethod
+    def parse_folder_attachments(attachments, folder):
+        '''
+        Attachment infos from the [{text, href}] returned by 
+        FOLDER_ATTACHMENTS_SCRIPT
+        '''
+        content_id = folder['content_id']
+        course_id = folder['course_id']
+        attachment_infos = []
+        for a_idx, attachment in enumerate(attachments):
+            try:
+                href = attachment['href']
+                if not href:
+                    # e.g. an item without a /bbcswebdav link
+                    raise ValueError('no link to the attachment')
+                text = ' '.join(attachment['text'].split())
+                m = re.match(r'(.*?)\s+\(([^\)]+)\)', text)
+                displayed_filename, displayed_filesize = m.groups()
+                displayed_filename = displayed_filename.strip()
+                displayed_filesize = displayed_filesize.strip()
+                cleaned_filename = clean_filename(displayed_filename) 
+                filepath = os.path.join(folder['filepath'], cleaned_filename)
+
+                attachment_info = {
+                    'attachment': {
+                        'href': href,
+                    },
+                    'filepath': filepath,
+                }
+                attachment_infos.append(attachment_info)
+            except Exception:
+                logger.warning(
+                    "Unable to retrieve attachment information for "
+                    f"course:{course_id} content:{content_id} attachment:{a_idx}"
+                )
+        return attachment_infos
+    
+    def get_cookies(self):
+        cookies = self.driver.get_cookies()
+        return cookies_to_dict(cookies)
+    
+    def close(self):
+        # stop polling before the driver goes away
+        self.log_watcher_stop.set()
+        self.log_thread_executor.shutdown(wait=True)
+        self.driver.quit()
+    
+    def extract_m3u8_playlist(self, media_info, timeout=10, 
+                              player_timeout=5):
+        driver = self.driver
+        # only consider responses received after this point,
+        # responses returned twice are skipped using their request_id
+        last_seen_time = time.time()
+
+        name = media_info['name']
+        logger.info(
+            f'Extracting .m3u8 file from network responses for {name}'
+        )
+        driver.get(media_info['href'])
+        try:
+            player = WebDriverWait(driver, player_timeout).until(
+                EC.presence_of_element_located((
+                    By.CSS_SELECTOR,
+                    KALTURA_PLAYER_SELECTOR
+                ))
+            )
+        except TimeoutException:
+            logger.warning(f'Player did not load for {name}')
+            return None
+
+        player.click()
+        seen = set()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # wake up as soon as a playlist response is received
+            kaltura_m3u8s = self.responses.wait_for(
+                M3U8_MIME_TYPES, 
+                last_seen_time, 
+                timeout=deadline - time.monotonic(),
+                exclude=seen,
+            )
+            if kaltura_m3u8s:
+                last_seen_time = kaltura_m3u8s[-1]['time']
+
+            for x in kaltura_m3u8s:
+                request_id = x['request_id']
+                seen.add(request_id)
+                try:
+                    body = driver.execute_cdp_cmd("Network.getResponseBody", {
+                        "requestId": request_id
+                    })
+                    if body.get('base64Encoded') == True:
+                        body = base64.b64decode(body['body'])
+                        body = body.decode('utf-8')
+                    else:
+                        body = body['body']
+                    
+                    if M3U8.STREAM_INFO_PREFIX in body:
+                        # this file is the main manifest file
+                        filename = clean_filename(media_info['name'])
+                        filename = f'{filename}.m3u8'
+                        filepath = os.path.join('media', filename)
+                        logger.info(f'Extracted {filename}')
+                        return {
+                            'playlist': {
+                                'body': body,
+                                'url': x['url'],
+                            },
+                            'filepath': filepath,
+                        }
+
+                except Exception as e:
+                    logger.error(
+                        f'Error occured while extracting .m3u8:\n{e}'
+                    )
+        logger.warning(f'Did not find .m3u8 for {name}')
+
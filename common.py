@@ -0,0 +1,128 @@
+#!/bin/python3
+'''
+Constants, logging, configuration and helpers shared by every module.
+'''
+# ==================== IMPORTS ===========================
+import re
+import logging
+
+# ==================== IMPORTS REQURING PIP INSTALL ===========================
+from requests import Session as RequestsSession
+from requests.adapters import HTTPAdapter
+
+# =========== IMPORT FROM OTHER SCRIPT ==============
+class ConfigDefaults:
+    '''
+    Used for settings missing from config.py, 
+    or for every setting when there is no config.py
+    '''
+    EMAIL = None
+    DOWNLOAD_DIR = '~/Downloads'
+    OUTPUT = 'zip'
+    PASSWORD = None
+    SESSION_CACHE = True
+    SESSION_MAX_AGE = 8 * 60 * 60
+    MAX_WORKERS = 8
+    CRAWLER = 'http'
+    MEDIA_EXTRACTION_WORKERS = 3
+    MAX_CONNECTIONS_PER_HOST = None
+    FFMPEG_PATH = 'ffmpeg'
+    FFMPEG_JOBS = None
+    FFMPEG_MAX_BANDWIDTH = None
+    HLS_SEGMENT_WORKERS = 8
+    CHUNK_SIZE = 1024 * 1024
+    MAX_IN_FLIGHT_BYTES = 64 * 1024 * 1024
+    WRITER_QUEUE_SIZE = 16
+    COMPRESSION_LEVEL = 6
+    COMPRESSION_WORKERS = None
+    DEDUP = 'off'
+    RETRY_ATTEMPTS = 5
+    RETRY_BACKOFF = 1.0
+    RETRY_MAX_BACKOFF = 60.0
+    REQUEST_TIMEOUT = 60
+    RESUME = True
+    SEGMENTED_CONNECTIONS = 4
+    SEGMENTED_MIN_SIZE = 32 * 1024 * 1024
+    MAX_BANDWIDTH = None
+    HOST_CONNECTION_LIMITS = {}
+
+def load_config():
+    try:
+        import config
+    except ImportError:
+        return ConfigDefaults
+    for key, value in vars(ConfigDefaults).items():
+        if key.isupper() and not hasattr(config, key):
+            setattr(config, key, value)
+    return config
+
+config = load_config()
+
+# ===================== OTHER CONSTANTS ==============
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36"
+
+# ===================== URLS ==============
+BASE_URL = 'https://ntulearn.ntu.edu.sg'
+SSO_LOGIN_BASE_URL = 'https://login.microsoftonline.com'
+# returns 401 unless signed in
+CURRENT_USER_URL = BASE_URL + '/learn/api/v1/users/me'
+# same endpoint used by the course list page, as JSON
+COURSE_MEMBERSHIPS_URL = BASE_URL + (
+    '/learn/api/v1/users/me/memberships?expand=course&limit=100'
+)
+COURSE_CONTENT_TREE_TEMPLATE = BASE_URL + (
+    '/webapps/blackboard/content/courseMenu.jsp'
+    '?course_id={0}&newWindow=true&openInParentWindow=true'
+)
+
+# ===================== DOWNLOAD STATUS ==============
+STATUS_DOWNLOADED = 'downloaded'
+STATUS_UNCHANGED = 'unchanged'
+# linked to another file with the same content
+STATUS_DUPLICATE = 'duplicate'
+# already written by an interrupted run that is being resumed
+STATUS_CHECKPOINTED = 'checkpointed'
+
+# directory (inside the download directory) used to keep state between runs
+STATE_DIR_NAME = '.ntu-learn-downloader'
+
+# ==================== LOGGING ===========================
+logger = logging.getLogger('ntu-learn-downloader')
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(levelname)s - %(name)s - %(message)s')
+
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+# ==================== CODE ===========================
+
+def clean_filename(name):
+    name = re.sub(r'[^a-zA-Z-_0-9.]+', '_', name).strip('_')
+    return name
+
+def cookies_to_dict(cookies):
+    return {c['name']:c['value'] for c in cookies}
+
+def create_session(cookies, max_workers, max_connections_per_host=None):
+    '''
+    Create a thread safe session with pooled keep-alive connections
+    '''
+    if max_connections_per_host is None:
+        max_connections_per_host = max_workers
+    sess = RequestsSession()
+    adapter = HTTPAdapter(
+        # number of hosts to keep connection pools for
+        pool_connections=max_workers,
+        # connections kept alive per host
+        pool_maxsize=max_connections_per_host,
+        # block instead of opening extra connections 
+        # when the pool for a host is exhausted
+        pool_block=True,
+    )
+    sess.mount('https://', adapter)
+    sess.mount('http://', adapter)
+    sess.headers.update({'User-Agent': USER_AGENT})
+    sess.cookies.update(cookies)
+    return sess
+
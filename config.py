@@ -6,12 +6,105 @@ EMAIL = None
 # Location on disk to download .zip folders to
 DOWNLOAD_DIR = '~/Downloads'
 
+# Output format
+# 'zip': write files into <DOWNLOAD_DIR>/<COURSE_NAME>-<RANDOM_UUID>.zip
+# 'dir': mirror files into <DOWNLOAD_DIR>/<COURSE_NAME>/
+OUTPUT = 'zip'
+
 # It is bad practice to save passwords in plain-text
 # do so at your own risk
 PASSWORD = None
 
+# reuse the cookies of the last sign in until they expire
+# saved to <DOWNLOAD_DIR>/.ntu-learn-downloader/session.json (owner only)
+SESSION_CACHE = True
+
+# maximum age (seconds) of a cached session
+SESSION_MAX_AGE = 8 * 60 * 60
+
 # maximum threads for concurrent downloads
 MAX_WORKERS = 8
 
+# how content folders and attachments are enumerated after signing in
+# 'http': fetch the pages with plain HTTP requests (faster)
+# 'browser': navigate to each page with the browser
+CRAWLER = 'http'
+
+# number of browsers used to extract video playlists concurrently
+MEDIA_EXTRACTION_WORKERS = 3
+
+# maximum connections kept open to a single host
+# None uses the same value as MAX_WORKERS
+MAX_CONNECTIONS_PER_HOST = None
+
 FFMPEG_PATH = 'ffmpeg'
 
+# maximum concurrent ffmpeg conversions (with --use-ffmpeg)
+# None uses half the number of CPUs
+FFMPEG_JOBS = None
+
+# maximum combined bandwidth (bits/s) of streams read by concurrent
+# ffmpeg conversions, e.g. 50_000_000 for 50 Mbit/s. None for no limit
+FFMPEG_MAX_BANDWIDTH = None
+
+# maximum HLS segments downloaded concurrently (with --native-hls)
+HLS_SEGMENT_WORKERS = 8
+
+# size (bytes) of each chunk read from the network when downloading
+CHUNK_SIZE = 1024 * 1024
+
+# maximum number of downloaded bytes held in memory across all workers
+MAX_IN_FLIGHT_BYTES = 64 * 1024 * 1024
+
+# maximum number of downloaded files waiting to be written to the .zip file
+# download workers wait for the zip writer when this many files are queued
+# (files waiting to be compressed are limited to the same number)
+WRITER_QUEUE_SIZE = 16
+
+# deflate level (0-9) for files that are not already compressed (e.g. .txt)
+# files such as .pdf, .pptx or .mp4 are always stored as is
+# 0 stores every file uncompressed
+COMPRESSION_LEVEL = 6
+
+# threads used to compress files before they are written to the .zip file
+# None uses the number of CPUs
+COMPRESSION_WORKERS = None
+
+# 'off' downloads every occurrence of a file linked from several folders
+# otherwise the file is downloaded once and the other occurrences are 
+# hardlinked (dir) or listed in duplicates.json (zip)
+# 'href': same file link, 'hash': same file link or same content
+DEDUP = 'off'
+
+# attempts made to download a file before giving up
+# connection errors, timeouts and 408/425/429/5xx responses are retried
+RETRY_ATTEMPTS = 5
+
+# seconds waited before the first retry, doubled after every attempt
+# (with random jitter), up to RETRY_MAX_BACKOFF
+RETRY_BACKOFF = 1.0
+RETRY_MAX_BACKOFF = 60.0
+
+# seconds without receiving any data before a request is retried
+REQUEST_TIMEOUT = 60
+
+# an interrupted run (Ctrl-C, crash) is continued by the next run for the 
+# same course: the same .zip file is reopened, files that were already 
+# written are skipped and partially downloaded files are resumed
+RESUME = True
+
+# large attachments are split into byte ranges fetched over this many 
+# connections at once, as each connection is throttled separately
+# 1 downloads every file over a single connection
+SEGMENTED_CONNECTIONS = 4
+
+# size (bytes) from which an attachment is split into ranges
+SEGMENTED_MIN_SIZE = 32 * 1024 * 1024
+
+# maximum combined bandwidth (bits/s) of all downloads, including HLS 
+# segments and ffmpeg inputs, e.g. 50_000_000 for 50 Mbit/s. None for no limit
+MAX_BANDWIDTH = None
+
+# maximum connections to specific hosts, other hosts use
+# MAX_CONNECTIONS_PER_HOST, e.g. {'ntulearn.ntu.edu.sg': 4}
+HOST_CONNECTION_LIMITS = {}
@@ -0,0 +1,408 @@
+#!/bin/python3
+'''
+Enumerates courses, content folders and attachments with plain HTTP
+requests using the cookies of a signed in browser, 
+and caches those cookies between runs.
+'''
+# ==================== IMPORTS ===========================
+import json
+import uuid
+import re
+import time
+import os
+
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from common import (
+    config, logger, clean_filename, cookies_to_dict, create_session,
+    BASE_URL, CURRENT_USER_URL, COURSE_MEMBERSHIPS_URL, 
+    COURSE_CONTENT_TREE_TEMPLATE, STATE_DIR_NAME,
+)
+
+# ==================== CODE ===========================
+
+class HTMLNode:
+    __slots__ = ('tag', 'attrs', 'parent', 'children')
+
+    def __init__(self, tag, attrs, parent=None):
+        self.tag = tag
+        self.attrs = attrs
+        self.parent = parent
+        # HTMLNode or str
+        self.children = []
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def has_class(self, name):
+        return name in (self.attrs.get('class') or '').split()
+
+    def iter(self):
+        '''All descendant elements in document order'''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node is not self:
+                yield node
+            stack.extend(
+                x for x in reversed(node.children) 
+                if isinstance(x, HTMLNode)
+            )
+
+    def find_all(self, predicate):
+        return [x for x in self.iter() if predicate(x)]
+
+    def find(self, predicate):
+        return next((x for x in self.iter() if predicate(x)), None)
+
+    def is_hidden(self):
+        if 'hidden' in self.attrs:
+            return True
+        style = (self.attrs.get('style') or '').replace(' ', '').lower()
+        return 'display:none' in style or 'visibility:hidden' in style
+
+    def text(self):
+        '''Text of the element, leaving out hidden descendants'''
+        parts = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                parts.append(node)
+            elif node is self or not node.is_hidden():
+                stack.extend(reversed(node.children))
+        # collapse whitespace like the rendered text of the element
+        return ' '.join(''.join(parts).split())
+
+class HTMLTreeBuilder(HTMLParser):
+    '''
+    Builds a tree of HTMLNode from a (possibly sloppy) html document
+    '''
+    VOID_ELEMENTS = {
+        'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 
+        'link', 'meta', 'source', 'track', 'wbr',
+    }
+    # elements whose content is not text of the page
+    RAW_TEXT_ELEMENTS = {'script', 'style'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = HTMLNode('#document', {})
+        self.stack = [self.root]
+
+    @staticmethod
+    def parse(html):
+        builder = HTMLTreeBuilder()
+        builder.feed(html)
+        builder.close()
+        return builder.root
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'li' and self.stack[-1].tag == 'li':
+            # <li> implicitly closes the previous <li>
+            self.stack.pop()
+        parent = self.stack[-1]
+        node = HTMLNode(tag, {k: (v or '') for k, v in attrs}, parent)
+        parent.children.append(node)
+        if tag not in HTMLTreeBuilder.VOID_ELEMENTS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        parent = self.stack[-1]
+        node = HTMLNode(tag, {k: (v or '') for k, v in attrs}, parent)
+        parent.children.append(node)
+
+    def handle_endtag(self, tag):
+        # close the nearest open element with this tag,
+        # stray end tags are ignored
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                return
+
+    def handle_data(self, data):
+        if self.stack[-1].tag in HTMLTreeBuilder.RAW_TEXT_ELEMENTS:
+            return
+        self.stack[-1].children.append(data)
+
+class ContentCrawler:
+    '''
+    Enumerates courses, and content folders and attachments of a course 
+    with plain HTTP requests using the cookies of a signed in browser.
+    The pages are server rendered, so no browser is needed.
+    '''
+    def __init__(self, cookies, max_workers=config.MAX_WORKERS, session=None,
+                 timeout=config.REQUEST_TIMEOUT):
+        if session is None:
+            session = create_session(cookies, max_workers)
+        self.session = session
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    def fetch(self, url):
+        res = self.session.get(url, timeout=self.timeout)
+        res.raise_for_status()
+        host = urlparse(res.url).hostname
+        if host != urlparse(BASE_URL).hostname:
+            # redirected to the sign in page
+            raise RuntimeError(f'Not signed in, redirected to {res.url}')
+        return res.url, res.text
+
+    @staticmethod
+    def membership_to_course_info(membership):
+        course = membership['course']
+        if course.get('isClosed'):
+            status = 'Completed'
+        elif course.get('isAvailable', True):
+            status = 'Open'
+        else:
+            status = 'Private'
+        return {
+            'course_id': course['id'],
+            'short_name': course['courseId'].strip(),
+            'long_name': course['name'].strip(),
+            'status': status,
+        }
+
+    @staticmethod
+    def parse_content_tree(html, course_info, base_url):
+        root = HTMLTreeBuilder.parse(html)
+        contents = root.find_all(lambda x: (
+            x.tag == 'li' and 'Link$ReferredToType:CONTENT' in x.get('id', '')
+        ))
+        content_set = set(map(id, contents))
+
+        folders = []
+        ancestor_ids = set()
+        for elem in contents:
+            content_id = elem.get('id').split(':::')[1]
+            elem_link = elem.find(lambda x: (
+                x.tag == 'a' and 'href' in x.attrs and 'title' in x.attrs 
+                and x.get('target') == 'content'
+            ))
+            filename = clean_filename(elem_link.get('title').strip())
+            folders.append({
+                'content_id': content_id,
+                'course_id': course_info['course_id'],
+                'course_short_name': course_info['short_name'],
+                'course_long_name': course_info['long_name'],
+                'filename': filename,
+                'href': urljoin(base_url, elem_link.get('href')),
+            })
+
+        filenames = {
+            id(elem): folder['filename'] 
+            for elem, folder in zip(contents, folders)
+        }
+        for elem, folder in zip(contents, folders):
+            parts = [folder['filename']]
+            parent = elem.parent
+            while parent is not None:
+                if id(parent) in content_set:
+                    ancestor_ids.add(id(parent))
+                    parts.append(filenames[id(parent)])
+                parent = parent.parent
+            folder['filepath'] = os.path.join(*reversed(parts))
+
+        # folders that do not contain other folders
+        return [
+            folder for elem, folder in zip(contents, folders)
+            if id(elem) not in ancestor_ids
+        ]
+
+    @staticmethod
+    def parse_folder_attachments(html, folder, base_url):
+        content_id = folder['content_id']
+        course_id = folder['course_id']
+        root = HTMLTreeBuilder.parse(html)
+        item = root.find(
+            lambda x: x.get('id') == f'contentListItem:{content_id}'
+        )
+        if item is None:
+            return []
+        attachment_elems = []
+        for attachments in item.find_all(lambda x: x.has_class('attachments')):
+            attachment_elems.extend(
+                attachments.find_all(lambda x: x.tag == 'li')
+            )
+
+        attachment_infos = []
+        for a_idx, attachment_elem in enumerate(attachment_elems):
+            try:
+                link_elem = attachment_elem.find(lambda x: (
+                    x.tag == 'a' and '/bbcswebdav' in x.get('href', '')
+                ))
+                m = re.match(r'(.*?)\s+\(([^\)]+)\)', attachment_elem.text())
+                displayed_filename, displayed_filesize = m.groups()
+                cleaned_filename = clean_filename(displayed_filename.strip())
+                filepath = os.path.join(folder['filepath'], cleaned_filename)
+                attachment_infos.append({
+                    'attachment': {
+                        'href': urljoin(base_url, link_elem.get('href')),
+                    },
+                    'filepath': filepath,
+                })
+            except Exception:
+                logger.warning(
+                    "Unable to retrieve attachment information for "
+                    f"course:{course_id} content:{content_id} attachment:{a_idx}"
+                )
+        return attachment_infos
+
+    def enumerate_courses(self):
+        courses_info = []
+        url = COURSE_MEMBERSHIPS_URL
+        while url is not None:
+            url, text = self.fetch(url)
+            data = json.loads(text)
+            courses_info.extend(
+                ContentCrawler.membership_to_course_info(x)
+                for x in data['results']
+                if 'course' in x
+            )
+            next_page = data.get('paging', {}).get('nextPage')
+            url = urljoin(url, next_page) if next_page else None
+
+        open_courses_info = [x for x in courses_info if x['status'] == 'Open']
+        print(f'Found {len(open_courses_info)} open courses')
+        return open_courses_info
+
+    def enumerate_content_folders(self, course_info):
+        url = COURSE_CONTENT_TREE_TEMPLATE.format(
+            course_info['course_id']
+        )
+        url, html = self.fetch(url)
+        folders = ContentCrawler.parse_content_tree(html, course_info, url)
+        if len(folders) == 0:
+            raise RuntimeError(f'No content folders found at {url}')
+        return folders
+
+    def enumerate_attachments_for_folder(self, folder):
+        url, html = self.fetch(folder['href'])
+        return ContentCrawler.parse_folder_attachments(html, folder, url)
+
+    def enumerate_attachments_for_folders(self, folders):
+        all_attachments = list(self.iter_attachments_for_folders(folders))
+        n = len(all_attachments)
+        logger.info(f"Found {n} attachments");
+        print(f'Found {n} attachments')
+        return all_attachments
+
+    def iter_attachments_for_folders(self, folders):
+        '''
+        Yields the attachments of each folder in folder order, 
+        as soon as its page and the pages before it are parsed.
+        The order decides which occurrence of a duplicate file is kept,
+        so it does not depend on which page is fetched first
+        '''
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(self.enumerate_attachments_for_folder, x)
+                for x in folders
+            ]
+            try:
+                for future in futures:
+                    yield from future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def close(self):
+        self.session.close()
+
+class SessionCache:
+    '''
+    Cookies of a signed in browser saved to disk, so that subsequent 
+    runs can skip the sign in flow until the session expires.
+    The file is only readable by the current user.
+    '''
+    VERSION = 1
+    FILENAME = 'session.json'
+
+    def __init__(self, path, max_age=config.SESSION_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+
+    @staticmethod
+    def for_download_dir(download_dir, **kwargs):
+        path = os.path.join(download_dir, STATE_DIR_NAME, SessionCache.FILENAME)
+        return SessionCache(path, **kwargs)
+
+    @staticmethod
+    def cookies_expire_at(cookies, saved_at, max_age):
+        expires_at = saved_at + max_age
+        for cookie in cookies:
+            # session cookies have no expiry and are bounded by max_age
+            if cookie.get('expiry') is not None:
+                expires_at = min(expires_at, cookie['expiry'])
+        return expires_at
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') != SessionCache.VERSION:
+                logger.warning(
+                    f'Ignoring session cache with unknown version: {self.path}'
+                )
+                return None
+            if data['expires_at'] <= time.time():
+                logger.info(f'Cached session has expired: {self.path}')
+                self.clear()
+                return None
+            logger.info(f'Loaded cached session from {self.path}')
+            return data['cookies']
+        except Exception as e:
+            logger.error(f'Failed to load session cache {self.path}:\n{e}')
+            return None
+
+    def save(self, cookies):
+        saved_at = time.time()
+        data = {
+            'version': SessionCache.VERSION,
+            'saved_at': saved_at,
+            'expires_at': SessionCache.cookies_expire_at(
+                cookies, saved_at, self.max_age
+            ),
+            'cookies': cookies,
+        }
+        dirname = os.path.dirname(self.path)
+        # a bare filename is saved to the current directory
+        if dirname:
+            os.makedirs(dirname, mode=0o700, exist_ok=True)
+        tmp_path = f'{self.path}.{uuid.uuid4()}.tmp'
+        # create the file with owner only permissions 
+        # instead of restricting them after the cookies are written
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def validate(cookies):
+        '''
+        Returns True if the cookies are still signed in to NTU Learn.
+        '''
+        crawler = ContentCrawler(
+            cookies_to_dict(cookies), 
+            max_workers=1,
+        )
+        try:
+            crawler.fetch(CURRENT_USER_URL)
+            return True
+        except Exception as e:
+            logger.info(f'Cached session is no longer valid:\n{e}')
+            return False
+        finally:
+            crawler.close()
+
@@ -0,0 +1,2572 @@
+#!/bin/python3
+'''
+Downloads attachments and playlists into a .zip file or a directory.
+'''
+# ==================== IMPORTS ===========================
+import json
+import shutil
+import uuid
+import hashlib
+import time
+import zipfile
+import zlib
+import io
+import tempfile
+import subprocess
+import re
+import random
+import math
+import os
+
+from queue import Queue
+from contextlib import nullcontext
+from urllib.parse import (
+    urlsplit, urlunsplit, urlencode, parse_qsl,
+)
+from email.utils import parsedate_to_datetime
+from collections import Counter, deque
+from threading import (
+    Lock, Event, Semaphore, BoundedSemaphore, Thread, 
+    Condition as ThreadCondition,
+)
+from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import wait as wait_for_futures
+
+# ==================== IMPORTS REQURING PIP INSTALL ===========================
+from requests import exceptions as requests_exceptions
+
+from common import (
+    config, logger, clean_filename, create_session, 
+    STATE_DIR_NAME, STATUS_DOWNLOADED, STATUS_UNCHANGED, STATUS_DUPLICATE,
+    STATUS_CHECKPOINTED,
+)
+from m3u8_parser import M3U8, Segment
+
+# ==================== CODE ===========================
+
+class ThreadSharedZipFile(zipfile.ZipFile):
+    # zipfile internals used to write entries compressed outside the lock
+    PRECOMPRESSED_INTERNALS = (
+        '_lock', '_writing', '_writecheck', '_seekable', '_allowZip64', 
+        '_didModify', 'start_dir', 'fp',
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._thread_shared_zf_lock = Lock()
+        self.supports_precompressed = all(
+            hasattr(self, name) 
+            for name in ThreadSharedZipFile.PRECOMPRESSED_INTERNALS
+        )
+    
+    def writestr_with_lock(self, arcpath, content):
+        success = False
+        with self._thread_shared_zf_lock:
+            super().writestr(arcpath, content)
+            success = True
+        
+        return success
+
+    def write_with_lock(self, src_path, arcpath):
+        success = False
+        with self._thread_shared_zf_lock:
+            super().write(src_path, arcname=arcpath)
+            success = True
+        return success
+
+    def write_fileobj_with_lock(self, arcpath, fileobj, size, 
+                                chunk_size=config.CHUNK_SIZE,
+                                compress_type=zipfile.ZIP_STORED):
+        # copy an already downloaded file object into the archive 
+        # chunk by chunk so that it is never fully loaded into memory
+        success = False
+        force_zip64 = size > zipfile.ZIP64_LIMIT
+        zinfo = zipfile.ZipInfo(arcpath, date_time=time.localtime()[:6])
+        zinfo.compress_type = compress_type
+        zinfo.external_attr = 0o600 << 16
+        with self._thread_shared_zf_lock:
+            with super().open(zinfo, 'w', force_zip64=force_zip64) as dst:
+                shutil.copyfileobj(fileobj, dst, chunk_size)
+            success = True
+        return success
+
+    def write_compressed_with_lock(self, zinfo, fileobj,
+                                   chunk_size=config.CHUNK_SIZE):
+        '''
+        Write an entry whose data has already been compressed.
+        zinfo must have compress_type, CRC, file_size and compress_size set.
+        This allows entries to be compressed outside of the lock.
+        zipfile has no public API for this, so it relies on private
+        attributes (PRECOMPRESSED_INTERNALS). Check supports_precompressed
+        first and compress under the lock with write_fileobj_with_lock 
+        otherwise.
+        '''
+        success = False
+        zip64 = (
+            zinfo.file_size > zipfile.ZIP64_LIMIT
+        ) or (
+            zinfo.compress_size > zipfile.ZIP64_LIMIT
+        )
+        with self._thread_shared_zf_lock, self._lock:
+            if self._writing:
+                raise ValueError(
+                    "Can't write to ZIP archive while an open "
+                    "writing handle exists."
+                )
+            if zip64 and not self._allowZip64:
+                raise zipfile.LargeZipFile(
+                    'Filesize would require ZIP64 extensions'
+                )
+            zinfo.flag_bits = 0x00
+            if not zinfo.external_attr:
+                zinfo.external_attr = 0o600 << 16
+            if self._seekable:
+                self.fp.seek(self.start_dir)
+            zinfo.header_offset = self.fp.tell()
+            self._writecheck(zinfo)
+            self._didModify = True
+            # sizes and CRC are known, so the header is final
+            self.fp.write(zinfo.FileHeader(zip64))
+            shutil.copyfileobj(fileobj, self.fp, chunk_size)
+            self.start_dir = self.fp.tell()
+            self.filelist.append(zinfo)
+            self.NameToInfo[zinfo.filename] = zinfo
+            success = True
+        return success
+
+class CompressionPolicy:
+    '''
+    Decides how each entry of a .zip file is compressed.
+    Files that are already compressed are stored as is, 
+    everything else is deflated.
+    '''
+    STORED_EXTENSIONS = {
+        # documents (zip containers or internally compressed)
+        '.pdf', '.docx', '.pptx', '.xlsx', '.odt', '.odp', '.ods', '.epub',
+        # archives
+        '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.jar',
+        # media
+        '.mp4', '.m4a', '.m4v', '.m4s', '.mov', '.mkv', '.webm', '.avi',
+        '.ts', '.aac', '.mp3', '.ogg', '.flac', '.wmv',
+        '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    }
+
+    def __init__(self, level=config.COMPRESSION_LEVEL):
+        self.level = level
+
+    def compress_type_for(self, arcpath):
+        if self.level == 0:
+            return zipfile.ZIP_STORED
+        ext = os.path.splitext(arcpath)[1].lower()
+        if ext in CompressionPolicy.STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+class ZipSink:
+    '''
+    Writes downloaded files into a single .zip file.
+    Entries are handed to a dedicated writer thread through a bounded
+    queue so that download workers do not wait on each other while an
+    entry is being written. When the queue is full, workers block until
+    the writer catches up.
+    Entries that should be deflated are compressed by a pool of
+    compression threads before they are queued, so the writer thread 
+    only copies bytes into the archive.
+    Duplicates are stored once, DUPLICATES_INDEX maps the path of 
+    every duplicate to the path of the entry holding its content.
+    Entries that could not be compressed or written are kept in failed,
+    their callback is never called.
+    '''
+    _STOP = object()
+    DUPLICATES_INDEX = 'duplicates.json'
+    # set by close() when nothing was written and the file was deleted
+    removed = False
+
+    def __init__(self, path, queue_size=config.WRITER_QUEUE_SIZE,
+                 chunk_size=config.CHUNK_SIZE,
+                 compression_policy: CompressionPolicy = None,
+                 compression_workers=config.COMPRESSION_WORKERS,
+                 temp_dir=None, mode='w'):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.temp_dir = temp_dir
+        if compression_policy is None:
+            compression_policy = CompressionPolicy()
+        self.compression_policy = compression_policy
+        self.zf = ThreadSharedZipFile(path, mode)
+        self.queue = Queue(maxsize=queue_size)
+        # entries waiting to be compressed count against the same bound,
+        # so workers block instead of piling up spill files
+        self.pending_compressions = BoundedSemaphore(queue_size)
+        self.stats = Counter()
+        self.stats_lock = Lock()
+        # zlib releases the GIL, so threads compress in parallel
+        self.compress_executor = ThreadPoolExecutor(
+            max_workers=compression_workers or os.cpu_count() or 1
+        )
+        self.writer_executor = ThreadPoolExecutor(max_workers=1)
+        self.writer_future = self.writer_executor.submit(self.writer_loop)
+        self.drained = False
+        self.links_lock = Lock()
+        self.links = {}
+        # arcpaths of entries that failed after being queued
+        self.failed = set()
+
+    @staticmethod
+    def open(download_dir, prefix='', **options):
+        uid = str(uuid.uuid4())
+        prefix = clean_filename(prefix)
+        zf_name = f'{prefix}{uid}.zip'
+        return ZipSink(os.path.join(download_dir, zf_name), **options)
+
+    @staticmethod
+    def reopen(path, links=None, **options):
+        '''
+        Appends to the .zip file of an interrupted run.
+        A run that crashed never wrote the end of the file, 
+        so it cannot be reopened.
+        '''
+        if not zipfile.is_zipfile(path):
+            raise ValueError(f'{path} is missing or incomplete')
+        sink = ZipSink(path, mode='a', **options)
+        sink.links.update(links or {})
+        return sink
+
+    def needs_full_copy(self, arcpath):
+        # each run writes a new .zip file, files that were already 
+        # downloaded by a previous run can be left out of it
+        return False
+
+    def put(self, entry):
+        start = time.perf_counter()
+        self.queue.put(entry)
+        blocked = time.perf_counter() - start
+        depth = self.queue.qsize()
+        with self.stats_lock:
+            self.stats['entries'] += 1
+            self.stats['producer_blocked_time'] += blocked
+            self.stats['queue_depth_total'] += depth
+            self.stats['queue_depth_max'] = max(
+                self.stats['queue_depth_max'], depth
+            )
+        return True
+
+    def should_deflate(self, arcpath):
+        compress_type = self.compression_policy.compress_type_for(arcpath)
+        return compress_type == zipfile.ZIP_DEFLATED
+
+    def writestr(self, arcpath, content, callback=None):
+        if self.should_deflate(arcpath):
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            return self.compress_then_put(
+                arcpath, io.BytesIO(content), len(content), callback
+            )
+        return self.put(('str', arcpath, content, callback))
+
+    def write(self, src_path, arcpath, callback=None):
+        # src_path must exist until the sink is closed
+        if self.should_deflate(arcpath):
+            return self.compress_then_put(
+                arcpath, 
+                open(src_path, 'rb'),
+                os.path.getsize(src_path),
+                callback,
+            )
+        return self.put(('path', arcpath, src_path, callback))
+
+    def write_spill(self, arcpath, spill, size, callback=None):
+        # the sink takes ownership of the spill file and closes it 
+        # once it has been written to the archive
+        if self.should_deflate(arcpath):
+            return self.compress_then_put(arcpath, spill, size, callback)
+        return self.put(('spill', arcpath, (spill, size), callback))
+
+    def link(self, src_arcpath, arcpath, callback=None):
+        with self.links_lock:
+            self.links[arcpath] = src_arcpath
+        if callback is not None:
+            callback()
+        return True
+
+    def compress_then_put(self, arcpath, src, size, callback):
+        if not self.zf.supports_precompressed:
+            # compressed by the writer thread while holding the lock
+            return self.put(('deflate', arcpath, (src, size), callback))
+        start = time.perf_counter()
+        self.pending_compressions.acquire()
+        with self.stats_lock:
+            self.stats['producer_blocked_time'] += time.perf_counter() - start
+        try:
+            self.compress_executor.submit(
+                self.compress_entry, arcpath, src, size, callback
+            )
+        except BaseException:
+            self.pending_compressions.release()
+            raise
+        return True
+
+    def compress_entry(self, arcpath, src, size, callback):
+        # runs on the compression pool, takes ownership of src
+        try:
+            self.compress_then_put_entry(arcpath, src, size, callback)
+        finally:
+            self.pending_compressions.release()
+
+    def compress_then_put_entry(self, arcpath, src, size, callback):
+        start = time.perf_counter()
+        dst = None
+        try:
+            src.seek(0)
+            dst = tempfile.TemporaryFile(dir=self.temp_dir)
+            compressor = zlib.compressobj(
+                self.compression_policy.level, zlib.DEFLATED, -15
+            )
+            crc = 0
+            for chunk in iter(lambda: src.read(self.chunk_size), b''):
+                crc = zlib.crc32(chunk, crc)
+                dst.write(compressor.compress(chunk))
+            dst.write(compressor.flush())
+            compress_size = dst.tell()
+        except Exception as e:
+            src.close()
+            if dst is not None:
+                dst.close()
+            with self.stats_lock:
+                self.stats['errors'] += 1
+                self.failed.add(arcpath)
+            msg = f'Error occured while compressing {arcpath}:\n{e}'
+            print(msg)
+            logger.error(msg)
+            return
+        with self.stats_lock:
+            self.stats['compress_time'] += time.perf_counter() - start
+
+        if compress_size >= size:
+            # deflate did not help, store the original bytes instead
+            dst.close()
+            self.put(('spill', arcpath, (src, size), callback))
+            return
+
+        src.close()
+        zinfo = zipfile.ZipInfo(arcpath, date_time=time.localtime()[:6])
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.file_size = size
+        zinfo.compress_size = compress_size
+        zinfo.CRC = crc
+        self.put(('compressed', arcpath, (zinfo, dst), callback))
+
+    def writer_loop(self):
+        while True:
+            start = time.perf_counter()
+            entry = self.queue.get()
+            stalled = time.perf_counter() - start
+            with self.stats_lock:
+                self.stats['writer_stall_time'] += stalled
+            if entry is ZipSink._STOP:
+                break
+
+            kind, arcpath, payload, callback = entry
+            start = time.perf_counter()
+            try:
+                if kind == 'str':
+                    self.zf.writestr_with_lock(arcpath, payload)
+                elif kind == 'path':
+                    self.zf.write_with_lock(payload, arcpath)
+                elif kind in ('spill', 'deflate'):
+                    spill, size = payload
+                    compress_type = zipfile.ZIP_STORED
+                    if kind == 'deflate':
+                        compress_type = zipfile.ZIP_DEFLATED
+                    with spill:
+                        spill.seek(0)
+                        self.zf.write_fileobj_with_lock(
+                            arcpath, spill, size, 
+                            chunk_size=self.chunk_size,
+                            compress_type=compress_type,
+                        )
+                elif kind == 'compressed':
+                    zinfo, spill = payload
+                    with spill:
+                        spill.seek(0)
+                        self.zf.write_compressed_with_lock(
+                            zinfo, spill, chunk_size=self.chunk_size,
+                        )
+                if callback is not None:
+                    callback()
+            except Exception as e:
+                with self.stats_lock:
+                    self.stats['errors'] += 1
+                    self.failed.add(arcpath)
+                msg = f'Error occured while writing {arcpath}:\n{e}'
+                print(msg)
+                logger.error(msg)
+            with self.stats_lock:
+                self.stats['writer_busy_time'] += time.perf_counter() - start
+
+    def report(self):
+        stats = self.stats
+        n = max(stats['entries'], 1)
+        logger.info(
+            f'Zip writer: {stats["entries"]} entries, '
+            f'{stats["errors"]} errors, '
+            f'queue depth avg {stats["queue_depth_total"] / n:.1f} '
+            f'max {stats["queue_depth_max"]}/{self.queue.maxsize}, '
+            f'compression {stats["compress_time"]:.1f}s, '
+            f'writer busy {stats["writer_busy_time"]:.1f}s, '
+            f'writer stalled {stats["writer_stall_time"]:.1f}s, '
+            f'workers blocked {stats["producer_blocked_time"]:.1f}s, '
+            f'{len(self.links)} duplicates'
+        )
+        # a writer that is mostly stalled is waiting on the network,
+        # workers that are mostly blocked are waiting on the disk
+
+    def drain(self):
+        '''
+        Waits until every queued entry has been written or has failed.
+        Nothing can be written afterwards
+        '''
+        if self.drained:
+            return
+        self.drained = True
+        # compression threads queue their entries before the writer stops
+        self.compress_executor.shutdown(wait=True)
+        self.queue.put(ZipSink._STOP)
+        self.writer_future.result()
+        self.writer_executor.shutdown(wait=True)
+
+    def close(self, final=True):
+        self.drain()
+        # an interrupted run is continued in the same file, 
+        # the index is written once by the run that completes it
+        if self.links and final:
+            self.zf.writestr(
+                ZipSink.DUPLICATES_INDEX, 
+                json.dumps(self.links, indent=1, sort_keys=True),
+            )
+        empty = not self.zf.filelist
+        self.zf.close()
+        self.report()
+        if empty and final:
+            # e.g. a sync run where nothing has changed
+            os.remove(self.path)
+            self.removed = True
+
+class DirectorySink:
+    '''
+    Mirrors downloaded files into a directory tree.
+    Each file is written to a temporary name then renamed into place,
+    so workers never share a lock and an interrupted run only leaves 
+    complete files behind.
+    '''
+    # the download directory is kept even when nothing was written
+    removed = False
+
+    def __init__(self, path):
+        self.path = path
+        # files are written by the workers, which report their own errors
+        self.failed = set()
+
+    @staticmethod
+    def open(download_dir, prefix='', **options):
+        # filepaths already start with the course name
+        return DirectorySink(download_dir)
+
+    @staticmethod
+    def reopen(path, links=None, **options):
+        # files are complete once renamed into place, hardlinks included
+        return DirectorySink(path)
+
+    def get_path(self, arcpath):
+        root = os.path.abspath(self.path)
+        path = os.path.abspath(os.path.join(root, arcpath))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f'{arcpath} is outside of {root}')
+        return path
+
+    def needs_full_copy(self, arcpath):
+        return not os.path.exists(self.get_path(arcpath))
+
+    def write_atomic(self, arcpath, write_func, callback=None):
+        path = self.get_path(arcpath)
+        dirname, basename = os.path.split(path)
+        os.makedirs(dirname, exist_ok=True)
+        tmp_path = os.path.join(dirname, f'.{basename}.{uuid.uuid4()}.part')
+        try:
+            with open(tmp_path, 'wb') as f:
+                write_func(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if callback is not None:
+            callback()
+        return True
+
+    def writestr(self, arcpath, content, callback=None):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return self.write_atomic(
+            arcpath, lambda f: f.write(content), callback
+        )
+
+    def write(self, src_path, arcpath, callback=None):
+        def copy(f):
+            with open(src_path, 'rb') as src:
+                shutil.copyfileobj(src, f)
+        return self.write_atomic(arcpath, copy, callback)
+
+    def write_spill(self, arcpath, spill, size, callback=None):
+        def copy(f):
+            spill.seek(0)
+            shutil.copyfileobj(spill, f)
+        with spill:
+            return self.write_atomic(arcpath, copy, callback)
+
+    def link(self, src_arcpath, arcpath, callback=None):
+        '''
+        Hardlinks arcpath to src_arcpath, which must have been written
+        '''
+        src_path = self.get_path(src_arcpath)
+        path = self.get_path(arcpath)
+        dirname, basename = os.path.split(path)
+        os.makedirs(dirname, exist_ok=True)
+        tmp_path = os.path.join(dirname, f'.{basename}.{uuid.uuid4()}.part')
+        try:
+            os.link(src_path, tmp_path)
+        except OSError:
+            # e.g. the file system does not support hardlinks
+            return self.write(src_path, arcpath, callback)
+        os.replace(tmp_path, path)
+        if callback is not None:
+            callback()
+        return True
+
+    def drain(self):
+        pass
+
+    def close(self, final=True):
+        pass
+
+# output formats that can be selected from the command line
+SINKS = {
+    'zip': ZipSink,
+    'dir': DirectorySink,
+}
+
+class ByteBudget:
+    '''
+    Caps the number of bytes reserved across all workers.
+    Download workers reserve space before reading a chunk from the network 
+    and release it once the chunk has been written to disk. 
+    ffmpeg jobs reserve the bytes/s of the stream they read until they end.
+    '''
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._cond = ThreadCondition()
+
+    def acquire(self, n):
+        # a single reservation can never exceed the limit,
+        # otherwise it would wait forever
+        n = min(n, self.limit)
+        with self._cond:
+            while self.in_use + n > self.limit:
+                self._cond.wait()
+            self.in_use += n
+        return n
+
+    def release(self, n):
+        with self._cond:
+            self.in_use -= n
+            self._cond.notify_all()
+
+class TokenBucket:
+    '''
+    Caps the rate (bytes/s) at which bytes are received, 
+    shared by every download worker.
+    Workers take tokens for the bytes they have just received and sleep 
+    off any shortfall, so the rate holds however many workers are running.
+    At most burst bytes are received at full speed after being idle.
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = Lock()
+
+    def consume(self, n, stopping=None):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            # tokens go negative instead of waiting for n to fit, 
+            # the next workers wait for the debt to be repaid
+            self.tokens -= n
+            delay = -self.tokens / self.rate
+        if delay > 0:
+            if stopping is not None:
+                stopping.wait(delay)
+            else:
+                time.sleep(delay)
+
+class HostSlot:
+    '''
+    A connection to a host held until released, 
+    which may happen before the end of the with block
+    '''
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+        self.held = False
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        self.held = True
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+class HostLimiter:
+    '''
+    Caps the number of concurrent connections to each host, 
+    including those opened by ffmpeg
+    '''
+    def __init__(self, default, limits=None):
+        self.default = default
+        # host -> maximum connections, overrides the default
+        self.limits = {
+            host.lower(): n for host, n in (limits or {}).items()
+        }
+        self._lock = Lock()
+        self.semaphores = {}
+
+    def slot(self, url):
+        host = (urlsplit(url).hostname or '').lower()
+        with self._lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = Semaphore(
+                    self.limits.get(host, self.default)
+                )
+            return HostSlot(self.semaphores[host])
+
+class DownloadInterrupted(Exception):
+    def __init__(self):
+        super().__init__('interrupted, it will be resumed by the next run')
+
+class ResumeError(Exception):
+    '''
+    A resumed download did not continue where it stopped,
+    it is retried from the start
+    '''
+
+class RetryPolicy:
+    '''
+    Decides whether a failed request is retried and how long to wait first.
+    Waits grow exponentially with random (full) jitter, so that workers 
+    failing together, e.g. while the server is overloaded, do not all 
+    retry at the same time.
+    '''
+    # timeout, too early, too many requests, and server side errors
+    RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+    RETRYABLE_EXCEPTIONS = (
+        requests_exceptions.ConnectionError,
+        requests_exceptions.Timeout,
+        # connection dropped in the middle of the body
+        requests_exceptions.ChunkedEncodingError,
+        ResumeError,
+    )
+
+    def __init__(self, attempts=config.RETRY_ATTEMPTS, 
+                 backoff=config.RETRY_BACKOFF,
+                 max_backoff=config.RETRY_MAX_BACKOFF):
+        self.attempts = max(attempts, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def is_retryable(self, error):
+        if isinstance(error, requests_exceptions.HTTPError):
+            res = error.response
+            return (
+                res is not None 
+                and res.status_code in RetryPolicy.RETRYABLE_STATUS_CODES
+            )
+        return isinstance(error, RetryPolicy.RETRYABLE_EXCEPTIONS)
+
+    @staticmethod
+    def retry_after(error):
+        '''
+        Seconds requested by the Retry-After header of a 429 or 503 
+        response, if any
+        '''
+        res = getattr(error, 'response', None)
+        value = res.headers.get('Retry-After') if res is not None else None
+        if not value:
+            return None
+        if value.strip().isdigit():
+            return int(value)
+        try:
+            retry_at = parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError):
+            return None
+        return max(0, retry_at - time.time())
+
+    def delay(self, error, attempt):
+        '''
+        Seconds to wait before retrying after the given attempt (from 0) 
+        failed with error, or None if it should not be retried
+        '''
+        if attempt + 1 >= self.attempts or not self.is_retryable(error):
+            return None
+        delay = random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt)
+        )
+        retry_after = RetryPolicy.retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+    def call(self, func, *args, stopping=None, on_retry=None, **kwargs):
+        '''
+        Calls func until it succeeds or fails with an error 
+        that should not be retried. Waiting stops early once 
+        the stopping event is set.
+        on_retry(error, attempt, delay) is called before waiting
+        to retry instead of logging a generic warning, 
+        attempt being the number (from 1) of the next one
+        '''
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self.delay(e, attempt)
+                if delay is None:
+                    raise
+                if on_retry is not None:
+                    on_retry(e, attempt + 2, delay)
+                else:
+                    logger.warning(
+                        f'Retrying in {delay:.1f}s '
+                        f'(attempt {attempt + 2}/{self.attempts}):\n{e}'
+                    )
+                if stopping is not None and stopping.wait(delay):
+                    raise DownloadInterrupted() from e
+                elif stopping is None:
+                    time.sleep(delay)
+                attempt += 1
+
+class HLSDownloader:
+    '''
+    Downloads an HLS stream without ffmpeg.
+    The segments of the highest bandwidth variant are fetched 
+    concurrently and written in order into a single file.
+    '''
+    def __init__(self, session, executor, max_segments_in_flight,
+                 retry_policy: RetryPolicy = None, timeout=None,
+                 bandwidth: TokenBucket = None, hosts: HostLimiter = None,
+                 stopping: Event = None):
+        self.session = session
+        self.executor = executor
+        self.max_segments_in_flight = max_segments_in_flight
+        if retry_policy is None:
+            retry_policy = RetryPolicy(attempts=1)
+        self.retry_policy = retry_policy
+        self.timeout = timeout
+        self.bandwidth = bandwidth
+        if hosts is None:
+            hosts = HostLimiter(max_segments_in_flight)
+        self.hosts = hosts
+        # set when interrupted, segments that have not started are 
+        # skipped and the file is left unfinished
+        if stopping is None:
+            stopping = Event()
+        self.stopping = stopping
+        self.keys_lock = Lock()
+        # key URI -> future of its value
+        self.keys = {}
+
+    @staticmethod
+    def decrypt_aes128(data, key, iv):
+        try:
+            from cryptography.hazmat.primitives.ciphers import (
+                Cipher, algorithms, modes
+            )
+        except ImportError as e:
+            raise RuntimeError(
+                'The "cryptography" package is required to download '
+                'AES-128 encrypted streams: '
+                'python -m pip install cryptography'
+            ) from e
+        decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+        data = decryptor.update(data) + decryptor.finalize()
+        # remove PKCS7 padding, a wrong key or iv leaves garbage there
+        pad = data[-1] if data else 0
+        if not 1 <= pad <= 16 or data[-pad:] != bytes([pad]) * pad:
+            raise ValueError('invalid PKCS7 padding')
+        return data[:-pad]
+
+    def get(self, url, byterange=None):
+        headers = {}
+        if byterange is not None:
+            length, offset = byterange
+            headers['Range'] = f'bytes={offset}-{offset + length - 1}'
+        return self.retry_policy.call(
+            self.get_once, url, headers, stopping=self.stopping,
+        )
+
+    def get_once(self, url, headers):
+        if self.stopping.is_set():
+            raise DownloadInterrupted()
+        with self.hosts.slot(url):
+            res = self.session.get(url, headers=headers, timeout=self.timeout)
+            res.raise_for_status()
+        # segments are small, taking the tokens once the whole 
+        # segment is received keeps the same average rate
+        if self.bandwidth is not None:
+            self.bandwidth.consume(len(res.content), self.stopping)
+        return res
+
+    def get_media_playlist(self, playlist_info):
+        master_playlist = M3U8.parse_master(
+            playlist_info['body'], playlist_info.get('url')
+        )
+        variant = master_playlist.best_variant
+        res = self.get(variant.uri)
+        return M3U8.parse_media(res.text, base_url=res.url)
+
+    def get_key(self, key):
+        if key.method != 'AES-128':
+            raise ValueError(
+                f'Unsupported HLS encryption method: {key.method}'
+            )
+        # the first worker to miss fetches the key, 
+        # the others wait for its future
+        uri = key.uri
+        with self.keys_lock:
+            future = self.keys.get(uri)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.keys[uri] = future
+        if owner:
+            try:
+                future.set_result(self.get(uri).content)
+            except Exception as e:
+                # let the next segment try again
+                with self.keys_lock:
+                    del self.keys[uri]
+                future.set_exception(e)
+        return future.result()
+
+    def fetch_segment(self, segment):
+        data = self.get(segment.uri, segment.byterange).content
+        key = segment.key
+        if key is not None:
+            if key.iv:
+                iv = bytes.fromhex(key.iv[2:].zfill(32))
+            else:
+                # IV defaults to the media sequence number
+                iv = segment.sequence.to_bytes(16, 'big')
+            data = HLSDownloader.decrypt_aes128(data, self.get_key(key), iv)
+        return data
+
+    def iter_segments(self, segments):
+        '''
+        Fetches segments concurrently and yields (segment, data) 
+        in playlist order
+        '''
+        def submit(segment):
+            if self.stopping.is_set():
+                raise DownloadInterrupted()
+            return segment, self.executor.submit(self.fetch_segment, segment)
+
+        # keep a bounded window of segments in flight
+        remaining = iter(segments)
+        in_flight = deque()
+        try:
+            for segment in remaining:
+                in_flight.append(submit(segment))
+                if len(in_flight) >= self.max_segments_in_flight:
+                    break
+            while in_flight:
+                segment, future = in_flight.popleft()
+                yield segment, future.result()
+                next_segment = next(remaining, None)
+                if next_segment is not None:
+                    in_flight.append(submit(next_segment))
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+    def download(self, playlist_info, fileobj):
+        media_playlist = self.get_media_playlist(playlist_info)
+        segments = media_playlist.segments
+        logger.info(f'Downloading {len(segments)} segments')
+
+        size = 0
+        current_map = None
+        for segment, data in self.iter_segments(segments):
+            init_map = segment.map
+            if init_map is not None and init_map is not current_map:
+                # fragmented mp4, the init section precedes 
+                # the segments that use it
+                init_data = self.fetch_segment(Segment(
+                    init_map.uri, 0, 
+                    sequence=segment.sequence,
+                    byterange=init_map.byterange,
+                    key=init_map.key,
+                ))
+                fileobj.write(init_data)
+                size += len(init_data)
+                current_map = init_map
+            fileobj.write(data)
+            size += len(data)
+        return size
+
+    def download_local(self, uri, directory):
+        '''
+        Downloads the media playlist at uri (e.g. subtitles) and its 
+        segments into directory, and returns the path of a playlist 
+        of the local copies, so that ffmpeg can read it without 
+        opening connections of its own
+        '''
+        res = self.get(uri)
+        media_playlist = M3U8.parse_media(res.text, base_url=res.url)
+        segments = media_playlist.segments
+        target_duration = media_playlist.target_duration or max(
+            [x.duration for x in segments], default=1
+        )
+        lines = [
+            '#EXTM3U',
+            f'#EXT-X-TARGETDURATION:{math.ceil(target_duration)}',
+            f'#EXT-X-MEDIA-SEQUENCE:{media_playlist.media_sequence}',
+        ]
+        os.makedirs(directory, exist_ok=True)
+        for i, (segment, data) in enumerate(self.iter_segments(segments)):
+            # segments are decrypted, so the playlist has no keys
+            ext = os.path.splitext(urlsplit(segment.uri).path)[1]
+            name = f'{i}{ext}'
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(data)
+            if segment.discontinuity:
+                lines.append('#EXT-X-DISCONTINUITY')
+            lines.append(f'#EXTINF:{segment.duration:.3f},')
+            lines.append(name)
+        lines.append('#EXT-X-ENDLIST')
+        path = os.path.join(directory, 'playlist.m3u8')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+class LocalStreams:
+    '''
+    HLS streams downloaded once into temp_dir by the native HLS downloader
+    and shared by the jobs that need them, i.e. the .ts copy of a video 
+    and the input of ffmpeg for its .mp4.
+    Jobs register the stream when they are submitted and release it 
+    when they are done, the file is removed once every job has released it.
+    Sinks keep reading the file through their open handle.
+    '''
+    def __init__(self, hls: HLSDownloader, temp_dir):
+        self.hls = hls
+        self.temp_dir = temp_dir
+        self._lock = Lock()
+        # key -> {'users': number of jobs, 'future': future of (path, size)}
+        self.streams = {}
+
+    @staticmethod
+    def key(playlist_info):
+        # relative uris make the same body mean different streams
+        return (
+            playlist_info.get('url'), 
+            hashlib.sha256(playlist_info['body'].encode('utf-8')).hexdigest(),
+        )
+
+    def register(self, playlist_info):
+        with self._lock:
+            entry = self.streams.setdefault(
+                LocalStreams.key(playlist_info), {'users': 0, 'future': None}
+            )
+            entry['users'] += 1
+
+    def is_shared(self, playlist_info):
+        '''
+        Returns True if another job uses the stream, or already 
+        downloaded it, e.g. the .ts job finished before the .mp4 started
+        '''
+        with self._lock:
+            entry = self.streams.get(LocalStreams.key(playlist_info))
+            if entry is None:
+                return False
+            future = entry['future']
+            downloaded = (
+                future is not None and future.done() 
+                and not future.cancelled() and future.exception() is None
+            )
+            return entry['users'] > 1 or downloaded
+
+    def get(self, playlist_info):
+        '''
+        Returns (path, size) of the stream, 
+        downloading it unless another job already has
+        '''
+        with self._lock:
+            entry = self.streams[LocalStreams.key(playlist_info)]
+            future = entry['future']
+            owner = future is None
+            if owner:
+                future = entry['future'] = Future()
+        if owner:
+            path = os.path.join(self.temp_dir, str(uuid.uuid4()) + '.ts')
+            try:
+                with open(path, 'wb') as f:
+                    size = self.hls.download(playlist_info, f)
+                future.set_result((path, size))
+            except BaseException as e:
+                if os.path.exists(path):
+                    os.remove(path)
+                # let the other job try again
+                with self._lock:
+                    entry['future'] = None
+                future.set_exception(e)
+        return future.result()
+
+    def release(self, playlist_info):
+        key = LocalStreams.key(playlist_info)
+        with self._lock:
+            entry = self.streams[key]
+            entry['users'] -= 1
+            if entry['users'] > 0:
+                return
+            del self.streams[key]
+        future = entry['future']
+        if future is not None and future.done() and not future.exception():
+            path, _ = future.result()
+            try:
+                os.remove(path)
+            except OSError:
+                # e.g. still open on Windows, 
+                # removed with the temporary directory
+                pass
+
+class SyncManifest:
+    '''
+    Persistent record of the files downloaded for a course.
+    Used on subsequent runs to skip files that have not changed.
+    '''
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def for_course(download_dir, course_short_name):
+        filename = clean_filename(course_short_name) + '.manifest.json'
+        path = os.path.join(download_dir, STATE_DIR_NAME, filename)
+        return SyncManifest(path)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') != SyncManifest.VERSION:
+                logger.warning(
+                    f'Ignoring sync manifest with unknown version: {self.path}'
+                )
+                return
+            self.entries = data['entries']
+            logger.info(
+                f'Loaded {len(self.entries)} entries from {self.path}'
+            )
+        except Exception as e:
+            logger.error(f'Failed to load sync manifest {self.path}:\n{e}')
+
+    def save(self):
+        with self._lock:
+            data = {
+                'version': SyncManifest.VERSION,
+                'entries': self.entries,
+            }
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # write to a temporary file first so that an interrupted save
+            # never leaves a truncated manifest behind
+            tmp_path = f'{self.path}.{uuid.uuid4()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def get(self, filepath):
+        with self._lock:
+            return self.entries.get(filepath)
+
+    def conditional_headers(self, filepath, href):
+        entry = self.get(filepath)
+        headers = {}
+        if entry is None or entry.get('href') != href:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def is_unchanged(self, filepath, sha256):
+        entry = self.get(filepath)
+        return entry is not None and entry.get('sha256') == sha256
+
+    def record(self, filepath, **fields):
+        fields['filepath'] = filepath
+        fields['synced_at'] = time.time()
+        with self._lock:
+            self.entries[filepath] = fields
+
+class Checkpoint:
+    '''
+    Journal of a run that has not finished yet, so that an interrupted
+    run (Ctrl-C, crash) is continued by the next run for the same course:
+    the same output is reopened, files already written to it are skipped
+    and partially downloaded files are resumed with Range requests.
+    One JSON object per line, appended as files are written, so that a 
+    crash loses at most the last line. Removed once a run completes.
+    '''
+    VERSION = 1
+
+    def __init__(self, path, partial_dir):
+        self.path = path
+        # partially downloaded files, named after their filepath
+        self.partial_dir = partial_dir
+        self._lock = Lock()
+        self.header = None
+        # filepath -> record
+        self.done = {}
+        self.partials = {}
+        # filepaths being downloaded into partial_dir
+        self.claimed = set()
+        self.journal = None
+        if os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def for_course(download_dir, course_short_name):
+        name = clean_filename(course_short_name)
+        state_dir = os.path.join(download_dir, STATE_DIR_NAME)
+        return Checkpoint(
+            os.path.join(state_dir, name + '.checkpoint.jsonl'),
+            os.path.join(state_dir, name + '.partial'),
+        )
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # cut short by a crash
+                        continue
+                    kind = record.get('type')
+                    if kind == 'header':
+                        self.header = record
+                    elif kind == 'done':
+                        self.done[record['filepath']] = record
+                        self.partials.pop(record['filepath'], None)
+                    elif kind == 'partial':
+                        self.partials[record['filepath']] = record
+        except Exception as e:
+            logger.error(f'Failed to load checkpoint {self.path}:\n{e}')
+            self.header = None
+        if self.header is None or (
+            self.header.get('version') != Checkpoint.VERSION
+        ):
+            self.header = None
+            self.done.clear()
+            self.partials.clear()
+
+    def reopen_sink(self, output, sink_cls, **options):
+        '''
+        Returns the sink of the interrupted run,
+        or None if there is nothing to resume
+        '''
+        if self.header is None:
+            return None
+        if self.header['output'] != output:
+            logger.warning(
+                f'Not resuming the interrupted run, it wrote to '
+                f'--output {self.header["output"]} instead of {output}'
+            )
+            self.done.clear()
+            return None
+        path = self.header['path']
+        links = {
+            filepath: record['duplicate_of']
+            for filepath, record in self.done.items()
+            if record.get('duplicate_of')
+        }
+        try:
+            sink = sink_cls.reopen(path, links=links, **options)
+        except Exception as e:
+            # files written before a crash are lost with the .zip file, 
+            # partially downloaded files can still be resumed
+            logger.warning(
+                f'Unable to resume writing to {path}, starting over:\n{e}'
+            )
+            self.done.clear()
+            return None
+        logger.info(
+            f'Resuming interrupted run, {len(self.done)} files '
+            f'already written to {path}, {len(self.partials)} '
+            'partially downloaded'
+        )
+        return sink
+
+    def start(self, output, sink):
+        '''
+        Starts the journal of a run writing to sink, 
+        keeping what is left of the interrupted run
+        '''
+        self.header = {
+            'type': 'header',
+            'version': Checkpoint.VERSION,
+            'output': output,
+            'path': sink.path,
+            'created_at': time.time(),
+        }
+        records = [self.header]
+        records.extend(self.done.values())
+        records.extend(self.partials.values())
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{uuid.uuid4()}.tmp'
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        os.replace(tmp_path, self.path)
+        self.journal = open(self.path, 'a')
+
+    def append(self, record):
+        with self._lock:
+            if self.journal is None:
+                return
+            self.journal.write(json.dumps(record) + '\n')
+            self.journal.flush()
+
+    def is_done(self, filepath):
+        with self._lock:
+            return filepath in self.done
+
+    def record_done(self, filepath, duplicate_of=None):
+        record = {'type': 'done', 'filepath': filepath}
+        if duplicate_of is not None:
+            record['duplicate_of'] = duplicate_of
+        with self._lock:
+            self.done[filepath] = record
+            self.partials.pop(filepath, None)
+        self.append(record)
+
+    def record_partial(self, filepath, href, validator):
+        record = {
+            'type': 'partial', 
+            'filepath': filepath, 
+            'href': href,
+            'validator': validator,
+        }
+        with self._lock:
+            self.partials[filepath] = record
+        self.append(record)
+
+    def claim_partial(self, filepath, href):
+        '''
+        Returns (path, validator) of the partial file for filepath, 
+        validator is None unless it holds the start of href. 
+        path is None if filepath is already being downloaded
+        '''
+        with self._lock:
+            if filepath in self.claimed:
+                return None, None
+            self.claimed.add(filepath)
+            record = self.partials.get(filepath)
+        name = hashlib.sha1(filepath.encode('utf-8')).hexdigest() + '.part'
+        path = os.path.join(self.partial_dir, name)
+        validator = None
+        if record is not None and record['href'] == href:
+            validator = record['validator']
+        return path, validator
+
+    def release_partial(self, filepath):
+        with self._lock:
+            self.claimed.discard(filepath)
+
+    def close(self):
+        with self._lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        shutil.rmtree(self.partial_dir, ignore_errors=True)
+
+class PartialDownload:
+    '''
+    Bytes of a file received so far and their sha256, so that a failed 
+    download is resumed with a Range request instead of starting over.
+    The bytes are kept in the checkpoint directory when there is one, so 
+    that the next run can resume them too.
+    '''
+    def __init__(self, fileobj, path=None):
+        self.fileobj = fileobj
+        self.path = path
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        # ETag or Last-Modified of the response the bytes came from
+        self.validator = None
+
+    @staticmethod
+    def open(checkpoint, filepath, href, temp_dir=None, 
+             chunk_size=config.CHUNK_SIZE):
+        path = validator = None
+        if checkpoint is not None:
+            path, validator = checkpoint.claim_partial(filepath, href)
+        if path is None:
+            return PartialDownload(tempfile.TemporaryFile(dir=temp_dir))
+        if validator is None or not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return PartialDownload(open(path, 'w+b'), path)
+        partial = PartialDownload(open(path, 'r+b'), path)
+        partial.validator = validator
+        for chunk in iter(lambda: partial.fileobj.read(chunk_size), b''):
+            partial.hasher.update(chunk)
+            partial.size += len(chunk)
+        return partial
+
+    @staticmethod
+    def validator_of(res):
+        # weak ETags cannot be used with If-Range
+        etag = res.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return res.headers.get('Last-Modified')
+
+    def range_headers(self):
+        if not self.size or not self.validator:
+            return {}
+        return {
+            'Range': f'bytes={self.size}-',
+            # the whole file is sent instead if it has changed
+            'If-Range': self.validator,
+        }
+
+    def begin(self, res):
+        '''
+        Prepares for the body of res, 
+        which continues the bytes received so far if it is partial
+        '''
+        if res.status_code == 206:
+            m = re.match(
+                r'bytes (\d+)-', res.headers.get('Content-Range', '')
+            )
+            if m is None or int(m.group(1)) != self.size:
+                self.reset()
+                raise ResumeError(
+                    'Unexpected Content-Range: '
+                    f'{res.headers.get("Content-Range")}'
+                )
+        elif self.size:
+            # the file has changed or the server ignored the range
+            self.reset()
+        self.validator = PartialDownload.validator_of(res)
+
+    def reset(self):
+        self.fileobj.seek(0)
+        self.fileobj.truncate()
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.validator = None
+
+    def write(self, chunk):
+        self.fileobj.write(chunk)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+    def keep(self, size, chunk_size=config.CHUNK_SIZE):
+        '''
+        Keeps the first size bytes of a file written out of order
+        (e.g. by RangeWriters), hashing them again
+        '''
+        self.fileobj.flush()
+        self.fileobj.truncate(size)
+        self.fileobj.seek(0)
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        for chunk in iter(lambda: self.fileobj.read(chunk_size), b''):
+            self.hasher.update(chunk)
+            self.size += len(chunk)
+
+    def detach(self):
+        '''
+        Returns the complete file, which is no longer kept for resuming
+        '''
+        fileobj, self.fileobj = self.fileobj, None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                # still open, removed with the checkpoint
+                pass
+        return fileobj
+
+    def close(self):
+        # named bytes are kept for the next run
+        if self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
+
+    def discard(self):
+        self.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+class RangeWriter:
+    '''
+    Writes one byte range of a file at its offset with os.pwrite, so that 
+    ranges fetched concurrently share the file without seeking it
+    '''
+    def __init__(self, fd, offset, end, aborted):
+        self.fd = fd
+        # next byte to write, the range ends before end
+        self.offset = offset
+        self.end = end
+        # set when another range failed
+        self.aborted = aborted
+
+    @property
+    def remaining(self):
+        return self.end - self.offset
+
+    def write(self, chunk):
+        if self.aborted.is_set():
+            raise DownloadInterrupted()
+        if len(chunk) > self.remaining:
+            raise ResumeError('Received more bytes than requested')
+        view = memoryview(chunk)
+        while view:
+            n = os.pwrite(self.fd, view, self.offset)
+            view = view[n:]
+            self.offset += n
+
+# /bbcswebdav/pid-<content item>-dt-content-rid-<file>/xid-<file>
+# the same file linked from several content items only differs in pid
+XID_PATTERN = re.compile(r'/xid-([0-9]+_[0-9]+)')
+
+def canonical_href(href):
+    m = XID_PATTERN.search(href)
+    if m:
+        return 'xid-' + m.group(1)
+    # the query identifies the file for links such as
+    # /webapps/blackboard/execute/content/file?cmd=view&content_id=...
+    # only the order of its parameters is ignored
+    parts = urlsplit(href)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit(parts._replace(query=query, fragment=''))
+
+class DuplicateIndex:
+    '''
+    Files downloaded to a sink, so that other occurrences of the same
+    file can be linked to them instead of being stored again.
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        # canonical href -> (filepath, future of the first download)
+        self.by_href = {}
+        # sha256 -> filepath of the first file written with that content
+        self.by_sha256 = {}
+
+class Downloader:
+    def __init__(self, 
+                 cookies={}, 
+                 max_workers=config.MAX_WORKERS, 
+                 download_dir=config.DOWNLOAD_DIR,
+                 ffmpeg_path=config.FFMPEG_PATH,
+                 temp_dir=None, 
+                 chunk_size=config.CHUNK_SIZE,
+                 max_in_flight_bytes=config.MAX_IN_FLIGHT_BYTES,
+                 max_connections_per_host=config.MAX_CONNECTIONS_PER_HOST,
+                 manifest: SyncManifest = None,
+                 hls_segment_workers=config.HLS_SEGMENT_WORKERS,
+                 ffmpeg_jobs=config.FFMPEG_JOBS,
+                 ffmpeg_max_bandwidth=config.FFMPEG_MAX_BANDWIDTH,
+                 dedup=config.DEDUP,
+                 retry_policy: RetryPolicy = None,
+                 request_timeout=config.REQUEST_TIMEOUT,
+                 segmented_connections=config.SEGMENTED_CONNECTIONS,
+                 segmented_min_size=config.SEGMENTED_MIN_SIZE,
+                 max_bandwidth=config.MAX_BANDWIDTH,
+                 host_connection_limits=config.HOST_CONNECTION_LIMITS,
+                 ):
+        self.cookies = cookies
+        # used for sinks without a manifest of their own
+        self.manifest = manifest
+        self.manifests_lock = Lock()
+        self.manifests = {}
+        self.checkpoints = {}
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        self.request_timeout = request_timeout
+        self.segmented_connections = segmented_connections
+        self.segmented_min_size = segmented_min_size
+        # set when interrupted, downloads that have not started are 
+        # skipped and those in progress stop at their next chunk
+        self.stopping = Event()
+        # 'off', 'href' (same canonical href), 
+        # or 'hash' (same canonical href or same content)
+        self.dedup = dedup
+        self.duplicate_indexes = {}
+        self.max_workers = max_workers
+        if max_connections_per_host is None:
+            max_connections_per_host = max_workers
+        self.max_connections_per_host = max_connections_per_host
+        self.hosts = HostLimiter(
+            max_connections_per_host, host_connection_limits,
+        )
+        # bytes/s shared by attachments, HLS segments and ffmpeg inputs
+        self.bandwidth = None
+        if max_bandwidth:
+            self.bandwidth = TokenBucket(
+                max_bandwidth / 8, burst=max(chunk_size, max_bandwidth / 8),
+            )
+        self.session = self.create_session()
+        # segments (of HLS streams and of large attachments) are fetched 
+        # on their own pool, a file being downloaded on self.executor 
+        # waits for its segments
+        self.segment_executor = ThreadPoolExecutor(
+            max_workers=hls_segment_workers
+        )
+        self.hls = HLSDownloader(
+            self.session, 
+            self.segment_executor,
+            max_segments_in_flight=2 * hls_segment_workers,
+            retry_policy=retry_policy,
+            timeout=request_timeout,
+            bandwidth=self.bandwidth,
+            hosts=self.hosts,
+            stopping=self.stopping,
+        )
+        self.streams = LocalStreams(self.hls, temp_dir)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers
+        )
+        if ffmpeg_jobs is None:
+            # remuxing with -c copy is mostly I/O bound,
+            # half of the CPUs leaves room for the download workers
+            ffmpeg_jobs = max(1, (os.cpu_count() or 1) // 2)
+        self.ffmpeg_executor = ThreadPoolExecutor(
+            max_workers=ffmpeg_jobs,
+        )
+        # ffmpeg_max_bandwidth is given in bits/s and kept in bytes/s.
+        # Each job reserves the bandwidth of the stream it is reading 
+        # before it starts
+        self.ffmpeg_bandwidth = None
+        if ffmpeg_max_bandwidth:
+            self.ffmpeg_bandwidth = ByteBudget(ffmpeg_max_bandwidth // 8)
+        self.ffmpeg_progress_lock = Lock()
+        self.ffmpeg_progress = {}
+        self.ffmpeg_path = ffmpeg_path
+        self.download_dir = download_dir
+        self.temp_dir = temp_dir
+        self.chunk_size = chunk_size
+        self.in_flight = ByteBudget(max(max_in_flight_bytes, chunk_size))
+
+    def create_session(self):
+        '''
+        Create a session shared by all download workers so that
+        connections to the same host are kept alive and reused.
+        '''
+        # hosts allowed more connections need a larger pool
+        pool_size = max(
+            [self.max_connections_per_host, *self.hosts.limits.values()]
+        )
+        return create_session(
+            self.cookies, 
+            self.max_workers, 
+            pool_size,
+        )
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.ffmpeg_executor.shutdown(wait=True)
+        self.segment_executor.shutdown(wait=True)
+        self.session.close()
+
+    def duplicate_index_for(self, sink):
+        with self.manifests_lock:
+            if sink not in self.duplicate_indexes:
+                self.duplicate_indexes[sink] = DuplicateIndex()
+            return self.duplicate_indexes[sink]
+
+    def manifest_for(self, sink):
+        with self.manifests_lock:
+            return self.manifests.get(sink, self.manifest)
+
+    def checkpoint_for(self, sink):
+        with self.manifests_lock:
+            return self.checkpoints.get(sink)
+
+    def is_unchanged(self, filepath, sha256, sink):
+        manifest = self.manifest_for(sink)
+        if manifest is None:
+            return False
+        # files that went missing from the output are written again
+        if sink.needs_full_copy(filepath):
+            return False
+        return manifest.is_unchanged(filepath, sha256)
+
+    def record_callback(self, filepath, sink, **fields):
+        '''
+        Returns a function that records a file in the sync manifest 
+        and the checkpoint. 
+        Sinks call it once the file has actually been written.
+        '''
+        manifest = self.manifest_for(sink)
+        checkpoint = self.checkpoint_for(sink)
+        if manifest is None and checkpoint is None:
+            return None
+        def callback():
+            if manifest is not None:
+                manifest.record(filepath, **fields)
+            if checkpoint is not None:
+                checkpoint.record_done(
+                    filepath, duplicate_of=fields.get('duplicate_of')
+                )
+        return callback
+
+    def submit(self, executor, func, idx, download_info, sink, *args):
+        '''
+        Submits func(idx, download_info, sink, *args) to executor,
+        unless the file was written by the interrupted run being resumed
+        '''
+        future = self.checkpointed(download_info, sink)
+        if future is not None:
+            return future
+        return executor.submit(
+            self.run_unless_stopping, 
+            func, idx, download_info, sink, *args,
+        )
+
+    def checkpointed(self, download_info, sink):
+        '''
+        Returns a completed future if the file was written 
+        by the interrupted run being resumed
+        '''
+        checkpoint = self.checkpoint_for(sink)
+        if checkpoint is None or not checkpoint.is_done(
+            download_info['filepath']
+        ):
+            return None
+        future = Future()
+        future.set_result((download_info, None, STATUS_CHECKPOINTED))
+        return future
+
+    def run_unless_stopping(self, func, idx, download_info, sink, *args):
+        if self.stopping.is_set():
+            return download_info, DownloadInterrupted(), None
+        return func(idx, download_info, sink, *args)
+
+    def download_content(self, idx, download_info, sink):
+        def done_callback(future):
+            download_info, error, status = future.result()
+            filepath = download_info['filepath']
+            if isinstance(error, DownloadInterrupted):
+                print(f'Interrupted {filepath}')
+            elif error:
+                msg = (
+                    'Error occured while downloading '
+                    f'{filepath}:\n{error}'
+                )
+                print(msg)
+                logger.error(msg)
+            elif status == STATUS_UNCHANGED:
+                print(f'Unchanged since last sync {filepath}')
+            elif status == STATUS_DUPLICATE:
+                print(f'Linked duplicate {filepath}')
+            elif status == STATUS_CHECKPOINTED:
+                print(f'Already downloaded by the interrupted run {filepath}')
+            else:
+                print(f'Successfully downloaded {filepath}')
+            
+        if 'playlist' in download_info:
+            future = self.submit(
+                self.executor,
+                self.download_playlist,
+                idx,
+                download_info,
+                sink,
+            )
+            future.add_done_callback(done_callback)
+            return [future]
+        elif 'playlist_as_mp4' in download_info:
+            future = self.submit_stream(
+                self.ffmpeg_executor,
+                self.download_playlist_as_mp4,
+                idx,
+                download_info,
+                sink,
+                download_info['playlist_as_mp4'],
+            )
+            future.add_done_callback(done_callback)
+            return [future]
+        elif 'playlist_as_ts' in download_info:
+            future = self.submit_stream(
+                self.executor,
+                self.download_playlist_as_ts,
+                idx,
+                download_info,
+                sink,
+                download_info['playlist_as_ts'],
+            )
+            future.add_done_callback(done_callback)
+            return [future]
+        elif 'attachment' in download_info:
+            future = self.submit_attachment(idx, download_info, sink)
+            future.add_done_callback(done_callback)
+            return [future]
+        else:
+            return []
+
+    def submit_stream(self, executor, func, idx, download_info, sink, 
+                      playlist_info):
+        '''
+        Same as submit() for a file made from an HLS stream. 
+        The stream is registered so that a .ts and an .mp4 
+        made from it share a single download, and released once the 
+        job is done, whether it succeeded, failed or was skipped
+        '''
+        self.streams.register(playlist_info)
+        future = self.submit(executor, func, idx, download_info, sink)
+        future.add_done_callback(
+            lambda _: self.streams.release(playlist_info)
+        )
+        return future
+
+    def submit_attachment(self, idx, download_info, sink):
+        if not download_info['attachment'].get('href'):
+            # reported like any other failed download
+            future = Future()
+            future.set_result((download_info, ValueError(
+                f'No link to download {download_info["filepath"]}'
+            ), None))
+            return future
+        if self.dedup == 'off':
+            return self.submit(
+                self.executor, 
+                self.download_attachment, idx, download_info, sink,
+            )
+        index = self.duplicate_index_for(sink)
+        key = canonical_href(download_info['attachment']['href'])
+        with index.lock:
+            original = index.by_href.get(key)
+            if original is None:
+                future = self.submit(
+                    self.executor,
+                    self.download_attachment, idx, download_info, sink,
+                )
+                index.by_href[key] = (download_info['filepath'], future)
+                return future
+        future = self.checkpointed(download_info, sink)
+        if future is not None:
+            return future
+
+        # link to the first occurrence once it has been downloaded,
+        # without holding a worker while waiting for it
+        original_filepath, original_future = original
+        future = Future()
+        def submit_duplicate(done):
+            try:
+                inner = self.executor.submit(
+                    self.run_unless_stopping,
+                    self.download_duplicate,
+                    idx, 
+                    download_info, 
+                    sink, 
+                    original_filepath,
+                    done.result(),
+                )
+            except Exception as e:
+                future.set_result((download_info, e, None))
+                return
+            inner.add_done_callback(lambda x: future.set_result(x.result()))
+        original_future.add_done_callback(submit_duplicate)
+        return future
+
+    def download_duplicate(self, idx, download_info, sink, 
+                           original_filepath, original_result):
+        _, error, status = original_result
+        filepath = download_info['filepath']
+        if filepath == original_filepath:
+            # listed twice, nothing more to write
+            if status == STATUS_DOWNLOADED:
+                status = STATUS_DUPLICATE
+            return download_info, error, status
+        if status == STATUS_UNCHANGED:
+            manifest = self.manifest_for(sink)
+            entry = manifest.get(filepath) if manifest else None
+            if (
+                entry is not None
+                and entry.get('duplicate_of') == original_filepath
+                and not sink.needs_full_copy(filepath)
+            ):
+                return download_info, None, STATUS_UNCHANGED
+        if error or status not in (STATUS_DOWNLOADED, STATUS_CHECKPOINTED):
+            # nothing was written to link to
+            return self.download_attachment(idx, download_info, sink)
+        try:
+            sink.link(
+                original_filepath, filepath, 
+                callback=self.record_callback(
+                    filepath,
+                    sink,
+                    href=download_info['attachment']['href'],
+                    duplicate_of=original_filepath,
+                ),
+            )
+            return download_info, None, STATUS_DUPLICATE
+        except Exception as e:
+            return download_info, e, None
+
+    def link_if_duplicate_content(self, filepath, sha256, sink, callback):
+        '''
+        Links filepath to a file already written with the same content.
+        Returns False if there is none, the caller writes the file then
+        calls written_content().
+        '''
+        if self.dedup != 'hash':
+            return False
+        index = self.duplicate_index_for(sink)
+        with index.lock:
+            original_filepath = index.by_sha256.get(sha256)
+        if original_filepath is None or original_filepath == filepath:
+            return False
+        sink.link(original_filepath, filepath, callback=callback)
+        return True
+
+    def written_content(self, filepath, sha256, sink):
+        if self.dedup != 'hash':
+            return
+        index = self.duplicate_index_for(sink)
+        with index.lock:
+            index.by_sha256.setdefault(sha256, filepath)
+
+    def download_playlist(self, idx, download_info, sink):
+        try: 
+            filepath = download_info['filepath']
+            print(f'Downloading {filepath}')
+            playlist_info = download_info['playlist']
+            content = playlist_info['body']
+            sha256 = hashlib.sha256(content.encode('utf-8')).hexdigest()
+            if self.is_unchanged(filepath, sha256, sink):
+                return download_info, None, STATUS_UNCHANGED
+            sink.writestr(
+                filepath, content,
+                callback=self.record_callback(
+                    filepath,
+                    sink,
+                    size=len(content),
+                    sha256=sha256,
+                ),
+            )
+            return download_info, None, STATUS_DOWNLOADED
+        except Exception as e:
+            return download_info, e, None
+
+    def download_playlist_as_mp4(self, idx, download_info, sink):
+        try: 
+            filepath = download_info['filepath']
+            print(f'Downloading {filepath}')
+
+            playlist_info = download_info['playlist_as_mp4']
+            # the converted file is identified by the playlist it came from
+            source_sha256 = hashlib.sha256(
+                playlist_info['body'].encode('utf-8')
+            ).hexdigest()
+            if self.is_unchanged(filepath, source_sha256, sink):
+                return download_info, None, STATUS_UNCHANGED
+            master_playlist = M3U8.parse_master(
+                playlist_info['body'], playlist_info.get('url')
+            )
+
+            # highest bandwidth stream
+            stream = master_playlist.best_variant
+            subtitles = stream.subtitle_renditions
+
+            # ffmpeg's own connections cannot be throttled, with a 
+            # bandwidth limit the stream is downloaded by the native 
+            # HLS downloader and ffmpeg only remuxes the local copy.
+            # The same copy is used when the .ts is also downloaded
+            stream_path = None
+            if (
+                self.bandwidth is not None 
+                or self.streams.is_shared(playlist_info)
+            ):
+                stream_path, _ = self.streams.get(playlist_info)
+
+            subtitles_dir, subtitle_paths = self.download_subtitles(
+                subtitles
+            )
+
+            # build ffmpeg command
+            cmd = [self.ffmpeg_path]
+            cmd.extend([
+                '-i', stream_path or stream.uri,
+            ])
+            for subtitle_path in subtitle_paths:
+                cmd.extend([
+                    # segments of local playlists are only read 
+                    # if their extension is allowed, e.g. not .vtt
+                    '-allowed_extensions', 'ALL',
+                    '-i', subtitle_path,
+                ])
+
+            # single AV stream
+            cmd.extend([
+                '-map', '0:v',
+                '-map', '0:a',
+            ])
+
+            # multi sub track
+            for sub_idx, sub in enumerate(subtitles):
+                cmd.extend([
+                    '-map', f'{sub_idx+1}:s',
+                ])
+            cmd.extend([
+                '-c:v', 'copy',
+                '-c:a', 'copy',
+            ])
+            if len(subtitles) > 0:
+                cmd.extend([
+                    '-c:s', 'mov_text',
+                ])
+        
+            random_name = str(uuid.uuid4()) + '.mp4'
+            outpath = os.path.join(self.temp_dir, random_name)
+            cmd.append(outpath)
+
+            # total duration is needed to estimate progress
+            duration = None
+            try:
+                media_playlist = self.hls.get_media_playlist(playlist_info)
+                duration = media_playlist.duration
+            except Exception as e:
+                logger.warning(
+                    f'Unable to determine duration of {filepath}:\n{e}'
+                )
+
+            bandwidth = 0
+            if self.ffmpeg_bandwidth is not None and stream_path is None:
+                # BANDWIDTH is in bits/s
+                bandwidth = self.ffmpeg_bandwidth.acquire(
+                    stream.bandwidth // 8
+                )
+            try:
+                # ffmpeg holds a connection to the host of the stream
+                with (
+                    self.hosts.slot(stream.uri) if stream_path is None 
+                    else nullcontext()
+                ):
+                    self.run_ffmpeg(cmd, filepath, duration)
+            except BaseException:
+                # e.g. terminated when stopping, the output is unfinished
+                if os.path.exists(outpath):
+                    os.remove(outpath)
+                raise
+            finally:
+                if bandwidth:
+                    self.ffmpeg_bandwidth.release(bandwidth)
+                shutil.rmtree(subtitles_dir, ignore_errors=True)
+
+            if os.path.exists(outpath):
+                sink.write(
+                    outpath, filepath,
+                    callback=self.record_callback(
+                        filepath,
+                        sink,
+                        size=os.path.getsize(outpath),
+                        sha256=source_sha256,
+                    ),
+                )
+
+            return download_info, None, STATUS_DOWNLOADED
+        except Exception as e:
+            return download_info, e, None
+    
+    def download_subtitles(self, subtitles):
+        '''
+        Downloads the subtitle renditions into a temporary directory 
+        with the HLS downloader, so that they go through the same limits 
+        as the other downloads instead of being read by ffmpeg.
+        Returns the directory and the local playlist of each rendition
+        '''
+        directory = tempfile.mkdtemp(dir=self.temp_dir)
+        try:
+            return directory, [
+                self.hls.download_local(
+                    sub.uri, os.path.join(directory, str(sub_idx))
+                )
+                for sub_idx, sub in enumerate(subtitles)
+            ]
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+    def download_playlist_as_ts(self, idx, download_info, sink):
+        try: 
+            filepath = download_info['filepath']
+            print(f'Downloading {filepath}')
+
+            playlist_info = download_info['playlist_as_ts']
+            # the stream is identified by the playlist it came from
+            source_sha256 = hashlib.sha256(
+                playlist_info['body'].encode('utf-8')
+            ).hexdigest()
+            if self.is_unchanged(filepath, source_sha256, sink):
+                return download_info, None, STATUS_UNCHANGED
+
+            # possibly downloaded by the job converting it to .mp4
+            path, size = self.streams.get(playlist_info)
+            record = self.record_callback(
+                filepath,
+                sink,
+                size=size,
+                sha256=source_sha256,
+            )
+            # the sink reads the open file, so the local copy can be 
+            # released once the job is done (see submit_stream) even if 
+            # the sink has not written it yet
+            sink.write_spill(
+                filepath, open(path, 'rb'), size, callback=record,
+            )
+            return download_info, None, STATUS_DOWNLOADED
+        except Exception as e:
+            return download_info, e, None
+
+    def run_ffmpeg(self, cmd, filepath, duration, log_interval=5):
+        '''
+        Run ffmpeg and track its progress using the machine readable
+        key=value output of -progress
+        '''
+        cmd = [
+            cmd[0], 
+            '-nostdin', '-nostats', '-loglevel', 'error',
+            '-progress', 'pipe:1',
+        ] + cmd[1:]
+        progress = {
+            'filepath': filepath,
+            'duration': duration,
+            'out_time': 0.0,
+            'speed': None,
+            'eta': None,
+            'done': False,
+        }
+        with self.ffmpeg_progress_lock:
+            self.ffmpeg_progress[filepath] = progress
+
+        last_log = 0
+        with tempfile.TemporaryFile(mode='w+', dir=self.temp_dir) as stderr:
+            # in its own session, so that Ctrl-C does not kill ffmpeg 
+            # in the middle of a write, it is terminated once stopping
+            p = subprocess.Popen(
+                cmd, text=True, stdout=subprocess.PIPE, stderr=stderr,
+                start_new_session=True,
+            )
+            Thread(
+                target=self.terminate_when_stopping, args=(p,), daemon=True,
+            ).start()
+            for line in p.stdout:
+                key, _, value = line.strip().partition('=')
+                if key == 'out_time_us' and value.isdigit():
+                    progress['out_time'] = int(value) / 1e6
+                elif key == 'speed' and value.endswith('x'):
+                    try:
+                        progress['speed'] = float(value[:-1])
+                    except ValueError:
+                        pass
+                elif key == 'progress':
+                    # end of a progress block
+                    speed = progress['speed']
+                    if duration and speed:
+                        remaining = max(duration - progress['out_time'], 0)
+                        progress['eta'] = remaining / speed
+                    if value == 'end':
+                        progress['done'] = True
+                    now = time.time()
+                    if now - last_log >= log_interval or value == 'end':
+                        last_log = now
+                        logger.info(Downloader.format_ffmpeg_progress(
+                            progress
+                        ))
+            returncode = p.wait()
+            if returncode != 0 and self.stopping.is_set():
+                raise DownloadInterrupted()
+            if returncode != 0:
+                stderr.seek(0)
+                error = stderr.read().strip()[-1000:]
+                raise RuntimeError(
+                    f'ffmpeg exited with code {returncode}:\n{error}'
+                )
+
+    def terminate_when_stopping(self, p, poll_interval=0.5):
+        while p.poll() is None:
+            if self.stopping.wait(poll_interval):
+                p.terminate()
+                return
+
+    @staticmethod
+    def format_ffmpeg_progress(progress):
+        def hms(seconds):
+            seconds = int(seconds)
+            return f'{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}'
+
+        msg = f'{progress["filepath"]}: {hms(progress["out_time"])}'
+        duration = progress['duration']
+        if duration:
+            percent = min(100 * progress['out_time'] / duration, 100)
+            msg += f'/{hms(duration)} ({percent:.0f}%)'
+        if progress['speed'] is not None:
+            msg += f' speed={progress["speed"]}x'
+        if progress['eta'] is not None and not progress['done']:
+            msg += f' ETA {hms(progress["eta"])}'
+        return msg
+
+    def download_attachment(self, idx, download_info, sink):
+        partial = None
+        checkpoint = self.checkpoint_for(sink)
+        try:
+            filepath = download_info['filepath']
+            print(f'Downloading {filepath}')
+            attachment_info = download_info['attachment']
+            href = attachment_info['href']
+            # the response is spilled to disk instead of holding
+            # the whole file in memory
+            partial = PartialDownload.open(
+                checkpoint, filepath, href, 
+                temp_dir=self.temp_dir, chunk_size=self.chunk_size,
+            )
+            headers = {}
+            manifest = self.manifest_for(sink)
+            if partial.size:
+                print(f'Resuming {filepath} after {partial.size} bytes')
+            elif manifest and not sink.needs_full_copy(filepath):
+                headers = manifest.conditional_headers(filepath, href)
+
+            def on_retry(error, attempt, delay):
+                # each attempt continues from the bytes kept in partial
+                msg = (
+                    f'Retrying {filepath} in {delay:.1f}s '
+                    f'(attempt {attempt}/{self.retry_policy.attempts}'
+                    f', {partial.size} bytes received):\n{error}'
+                )
+                print(msg)
+                logger.warning(msg)
+
+            res_headers = self.retry_policy.call(
+                self.fetch_attachment, 
+                filepath, href, headers, partial, checkpoint,
+                stopping=self.stopping, on_retry=on_retry,
+            )
+            if res_headers is None:
+                partial.discard()
+                return download_info, None, STATUS_UNCHANGED
+            size = partial.size
+            sha256 = partial.hasher.hexdigest()
+            # server may not support conditional requests
+            if self.is_unchanged(filepath, sha256, sink):
+                partial.discard()
+                return download_info, None, STATUS_UNCHANGED
+            callback = self.record_callback(
+                filepath,
+                sink,
+                href=href,
+                size=size,
+                sha256=sha256,
+                etag=res_headers.get('ETag'),
+                last_modified=res_headers.get('Last-Modified'),
+            )
+            if self.link_if_duplicate_content(
+                filepath, sha256, sink, callback
+            ):
+                partial.discard()
+                return download_info, None, STATUS_DUPLICATE
+            # the sink closes the spill file once it has been written
+            sink.write_spill(
+                filepath, partial.detach(), size, callback=callback
+            )
+            self.written_content(filepath, sha256, sink)
+            return download_info, None, STATUS_DOWNLOADED
+        except Exception as e:
+            return download_info, e, None
+        finally:
+            if partial is not None:
+                # bytes kept in the checkpoint directory are resumed 
+                # by the next run
+                partial.close()
+                if partial.path is not None:
+                    checkpoint.release_partial(download_info['filepath'])
+
+    def fetch_attachment(self, filepath, href, headers, partial, checkpoint):
+        '''
+        Downloads href into partial, continuing from the bytes 
+        it already holds if possible.
+        Returns the response headers, or None if not modified
+        '''
+        headers = {**headers, **partial.range_headers()}
+        with self.hosts.slot(href) as slot, self.session.get(
+            href, headers=headers, stream=True, timeout=self.request_timeout,
+        ) as res:
+            if res.status_code == 304:
+                return None
+            if res.status_code == 416:
+                # e.g. the file is shorter than the bytes kept for it
+                partial.reset()
+                raise ResumeError(f'Range not satisfiable: {href}')
+            res.raise_for_status()
+            partial.begin(res)
+            total = self.segmented_size(res, partial)
+            if total is not None:
+                self.fetch_segmented(
+                    res, partial, total, filepath, href, checkpoint, slot,
+                )
+                return res.headers
+            if partial.path is not None and partial.validator is not None:
+                checkpoint.record_partial(filepath, href, partial.validator)
+            self.stream_response_to_file(res, partial)
+            return res.headers
+
+    def segmented_size(self, res, partial):
+        '''
+        Returns the full size of the file if the rest of it should be 
+        fetched in several ranges at once, None otherwise.
+        The response to the first request is used to decide, 
+        so small files do not pay for an extra HEAD request
+        '''
+        if self.segmented_connections < 2 or not hasattr(os, 'pwrite'):
+            return None
+        # every range must come from the same version of the file
+        if partial.validator is None:
+            return None
+        if (
+            res.status_code != 206 
+            and res.headers.get('Accept-Ranges') != 'bytes'
+        ):
+            return None
+        # the length of a compressed body is not the size of the file
+        if res.headers.get('Content-Encoding', 'identity') != 'identity':
+            return None
+        try:
+            length = int(res.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return None
+        if length < self.segmented_min_size:
+            return None
+        return partial.size + length
+
+    def fetch_segmented(self, res, partial, total, filepath, href, 
+                        checkpoint, slot):
+        '''
+        Splits the rest of the file into ranges written into the
+        preallocated partial file as they arrive. The first range is 
+        read from res, the others are fetched concurrently over other 
+        connections of the shared pool.
+        '''
+        fileobj = partial.fileobj
+        fileobj.flush()
+        fd = fileobj.fileno()
+        start = partial.size
+        os.ftruncate(fd, total)
+        if partial.path is not None:
+            # bytes after the gaps cannot be resumed until the file is 
+            # contiguous again, the next run starts over after a crash
+            checkpoint.record_partial(filepath, href, None)
+
+        n = min(
+            self.segmented_connections, 
+            -(-(total - start) // self.chunk_size),
+        )
+        bounds = [start + (total - start) * i // n for i in range(n + 1)]
+        aborted = Event()
+        writers = [
+            RangeWriter(fd, bounds[i], bounds[i + 1], aborted) 
+            for i in range(n)
+        ]
+        futures = [
+            self.segment_executor.submit(
+                self.fetch_range, res.url, partial.validator, writer,
+            )
+            for writer in writers[1:]
+        ]
+        try:
+            try:
+                self.stream_response_to_file(
+                    res, writers[0], limit=writers[0].remaining,
+                )
+            except Exception as e:
+                if not self.retry_policy.is_retryable(e):
+                    raise
+            finally:
+                # let the other ranges use the connection
+                res.close()
+                slot.release()
+            if writers[0].remaining:
+                self.fetch_range(res.url, partial.validator, writers[0])
+            for future in futures:
+                future.result()
+        except BaseException:
+            aborted.set()
+            wait_for_futures(futures)
+            # keep the contiguous start of the file to resume from
+            size = start
+            for writer in writers:
+                size = writer.offset
+                if writer.remaining:
+                    break
+            validator = partial.validator
+            partial.keep(size, self.chunk_size)
+            partial.validator = validator
+            if partial.path is not None:
+                checkpoint.record_partial(filepath, href, validator)
+            raise
+        partial.keep(total, self.chunk_size)
+
+    def fetch_range(self, url, validator, writer):
+        def fetch():
+            headers = {
+                'Range': f'bytes={writer.offset}-{writer.end - 1}',
+                'If-Range': validator,
+            }
+            with self.hosts.slot(url), self.session.get(
+                url, headers=headers, stream=True, 
+                timeout=self.request_timeout,
+            ) as res:
+                res.raise_for_status()
+                m = re.match(
+                    r'bytes (\d+)-', res.headers.get('Content-Range', '')
+                )
+                if (
+                    res.status_code != 206 
+                    or m is None 
+                    or int(m.group(1)) != writer.offset
+                ):
+                    # e.g. the file changed since the first range
+                    raise ResumeError(
+                        f'Unexpected response to a range request: {url}'
+                    )
+                self.stream_response_to_file(
+                    res, writer, limit=writer.remaining,
+                )
+            if writer.remaining:
+                raise ResumeError(f'Range ended early: {url}')
+        self.retry_policy.call(fetch, stopping=self.stopping)
+
+    def stream_response_to_file(self, res, fileobj, hasher=None, limit=None):
+        '''
+        Writes the body of res to fileobj, 
+        or only its first limit bytes if given
+        '''
+        chunks = res.iter_content(chunk_size=self.chunk_size)
+        size = 0
+        while limit is None or size < limit:
+            if self.stopping.is_set():
+                raise DownloadInterrupted()
+            # reserve space for the next chunk before it is read
+            reserved = self.in_flight.acquire(self.chunk_size)
+            try:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                if limit is not None:
+                    chunk = chunk[:limit - size]
+                fileobj.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                size += len(chunk)
+            finally:
+                self.in_flight.release(reserved)
+            if self.bandwidth is not None:
+                self.bandwidth.consume(len(chunk), self.stopping)
+        return size
+  
+    def download_all(self, download_infos, sink, manifest=None, 
+                     checkpoint=None):
+        futures = []
+        try:
+            self.submit_all(
+                download_infos, sink, manifest, futures, checkpoint
+            )
+            wait_for_futures(futures)
+        except KeyboardInterrupt:
+            self.interrupt()
+            raise
+        finally:
+            # let submitted downloads finish before the sink is closed,
+            # even if enumerating the remaining files failed
+            self.finish(futures, sink)
+
+    def submit_all(self, download_infos, sink, manifest=None, futures=None,
+                   checkpoint: Checkpoint = None):
+        '''
+        Submits every file to the download pool without waiting for them,
+        so that several sinks (e.g. one per course) can share the pool.
+        Futures are appended to futures (if given) as they are submitted,
+        pass them to finish() once all files are submitted.
+        The checkpoint (if any) must have been started for sink.
+        '''
+        if futures is None:
+            futures = []
+        logger.info(f'Downloading files to {sink.path}')
+        with self.manifests_lock:
+            if manifest is not None:
+                self.manifests[sink] = manifest
+            if checkpoint is not None:
+                self.checkpoints[sink] = checkpoint
+
+        # download_infos may be a generator that is still crawling,
+        # each file is submitted as soon as it is yielded
+        for info_idx, download_info in enumerate(download_infos):
+            futures.extend(self.download_content(info_idx, download_info, sink))
+        return futures
+
+    def finish(self, futures, sink):
+        '''
+        Waits for the futures returned by submit_all, 
+        then closes the sink and saves its manifest.
+        The checkpoint of the sink is kept if the run was interrupted 
+        or some files failed with an error that can be retried, so that
+        the next run resumes them, and removed otherwise.
+        '''
+        try:
+            wait_for_futures(futures)
+        except KeyboardInterrupt:
+            # e.g. Ctrl-C again while waiting, the sink is still closed
+            self.interrupt()
+            raise
+        finally:
+            self.close_sink(futures, sink)
+
+    @staticmethod
+    def has_failed(future):
+        if not future.done() or future.cancelled():
+            return True
+        if future.exception() is not None:
+            return True
+        _, error, _ = future.result()
+        return error is not None
+
+    def can_resume(self, future):
+        '''
+        Returns True if the job did not finish or failed with an error 
+        that a later run may get past, e.g. a dropped connection.
+        Permanent errors (404, no link, ffmpeg errors) are not resumed, 
+        otherwise the checkpoint would be kept and every later run 
+        would skip the files it lists without checking them again
+        '''
+        if not future.done() or future.cancelled():
+            return True
+        error = future.exception()
+        if error is None:
+            _, error, _ = future.result()
+        return (
+            isinstance(error, DownloadInterrupted) 
+            or self.retry_policy.is_retryable(error)
+        )
+
+    def close_sink(self, futures, sink):
+        try:
+            # files still queued by the sink are written, or fail,
+            # before deciding whether the run is resumed
+            sink.drain()
+        finally:
+            self.close_drained_sink(futures, sink)
+
+    def close_drained_sink(self, futures, sink):
+        interrupted = self.stopping.is_set()
+        failed = [x for x in futures if Downloader.has_failed(x)]
+        checkpoint = self.checkpoint_for(sink)
+        if sink.failed:
+            msg = (
+                f'{len(sink.failed)} files could not be written '
+                f'to {sink.path}'
+            )
+            print(msg)
+            logger.error(msg)
+        # the failed files are retried in the same output by the next run
+        # unless none of them could succeed by trying again.
+        # Files the sink failed to write are missing from the checkpoint
+        resumable = interrupted or (checkpoint is not None and (
+            bool(sink.failed) or any(map(self.can_resume, failed))
+        ))
+        try:
+            sink.close(final=not resumable)
+        finally:
+            manifest = self.manifest_for(sink)
+            if manifest:
+                manifest.save()
+            if checkpoint is not None:
+                if resumable:
+                    checkpoint.close()
+                else:
+                    checkpoint.remove()
+            with self.manifests_lock:
+                self.manifests.pop(sink, None)
+                self.checkpoints.pop(sink, None)
+                self.duplicate_indexes.pop(sink, None)
+        if resumable and checkpoint is not None:
+            reason = 'Interrupted' if interrupted else 'Some files failed'
+            msg = (
+                f'{reason}, run again to continue downloading '
+                f'to {sink.path}'
+            )
+            print(msg)
+            logger.info(msg)
+        elif sink.removed:
+            msg = f'Nothing new to download, {sink.path} was not kept'
+            print(msg)
+            logger.info(msg)
+        else:
+            logger.info(f'Files can be found at {sink.path}')
+
+    def interrupt(self):
+        '''
+        Stops downloading (e.g. on Ctrl-C) without losing what was 
+        downloaded: files that have not started are skipped, attachments
+        being downloaded stop at their next chunk and are kept to be 
+        resumed, HLS streams stop at their next segment, ffmpeg is 
+        terminated, and files already downloaded are still written
+        '''
+        self.stopping.set()
+
+    def download_all_to_zip(
+        self, 
+        download_infos,
+        overwrite=False,
+        prefix='',
+    ):
+        sink = ZipSink.open(self.download_dir, prefix)
+        self.download_all(download_infos, sink)
+
+    def download_all_to_dir(self, download_infos, prefix=''):
+        sink = DirectorySink.open(self.download_dir, prefix)
+        self.download_all(download_infos, sink)
+
@@ -0,0 +1,403 @@
+#!/bin/python3
+'''
+Single pass parser for HLS (.m3u8) playlists.
+'''
+# ==================== IMPORTS ===========================
+import logging
+
+from urllib.parse import urljoin
+
+# ==================== LOGGING ===========================
+# configured by common.py when used by the downloader
+logger = logging.getLogger('ntu-learn-downloader')
+
+# ==================== CODE ===========================
+
+class Key:
+    __slots__ = ('method', 'uri', 'iv', 'keyformat', 'keyformatversions')
+
+    def __init__(self, method, uri=None, iv=None, 
+                 keyformat='identity', keyformatversions=None):
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+        self.keyformat = keyformat
+        self.keyformatversions = keyformatversions
+
+class InitSection:
+    '''#EXT-X-MAP'''
+    __slots__ = ('uri', 'byterange', 'key')
+
+    def __init__(self, uri, byterange=None, key=None):
+        self.uri = uri
+        self.byterange = byterange
+        self.key = key
+
+class Segment:
+    __slots__ = (
+        'uri', 'duration', 'title', 'sequence', 'byterange', 'key', 'map',
+        'discontinuity', 'program_date_time',
+    )
+
+    def __init__(self, uri, duration, title='', sequence=0, byterange=None,
+                 key=None, map=None, discontinuity=False, 
+                 program_date_time=None):
+        self.uri = uri
+        self.duration = duration
+        self.title = title
+        self.sequence = sequence
+        # (length, offset) or None
+        self.byterange = byterange
+        self.key = key
+        self.map = map
+        self.discontinuity = discontinuity
+        self.program_date_time = program_date_time
+
+class Rendition:
+    '''#EXT-X-MEDIA'''
+    __slots__ = (
+        'type', 'group_id', 'name', 'language', 'uri', 
+        'default', 'autoselect', 'attributes',
+    )
+
+    def __init__(self, attributes, uri=None):
+        self.attributes = attributes
+        self.type = attributes.get('TYPE')
+        self.group_id = attributes.get('GROUP-ID')
+        self.name = attributes.get('NAME')
+        self.language = attributes.get('LANGUAGE')
+        self.default = attributes.get('DEFAULT') == 'YES'
+        self.autoselect = attributes.get('AUTOSELECT') == 'YES'
+        self.uri = uri
+
+class Variant:
+    '''#EXT-X-STREAM-INF or #EXT-X-I-FRAME-STREAM-INF'''
+    __slots__ = (
+        'uri', 'bandwidth', 'average_bandwidth', 'codecs', 'resolution', 
+        'frame_rate', 'audio', 'video', 'subtitles', 'closed_captions',
+        'i_frames_only', 'attributes', 'renditions',
+    )
+
+    def __init__(self, attributes, uri, i_frames_only=False):
+        self.attributes = attributes
+        self.uri = uri
+        self.bandwidth = int(attributes.get('BANDWIDTH', 0))
+        self.average_bandwidth = None
+        if 'AVERAGE-BANDWIDTH' in attributes:
+            self.average_bandwidth = int(attributes['AVERAGE-BANDWIDTH'])
+        codecs = attributes.get('CODECS')
+        self.codecs = codecs.split(',') if codecs else []
+        self.resolution = None
+        if 'RESOLUTION' in attributes:
+            w, h = attributes['RESOLUTION'].lower().split('x')
+            self.resolution = (int(w), int(h))
+        self.frame_rate = None
+        if 'FRAME-RATE' in attributes:
+            self.frame_rate = float(attributes['FRAME-RATE'])
+        self.audio = attributes.get('AUDIO')
+        self.video = attributes.get('VIDEO')
+        self.subtitles = attributes.get('SUBTITLES')
+        self.closed_captions = attributes.get('CLOSED-CAPTIONS')
+        self.i_frames_only = i_frames_only
+        # renditions of the groups referenced by this variant, by TYPE
+        self.renditions = {}
+
+    def get_renditions(self, rendition_type):
+        return self.renditions.get(rendition_type, [])
+
+    @property
+    def subtitle_renditions(self):
+        return self.get_renditions('SUBTITLES')
+
+class MasterPlaylist:
+    __slots__ = (
+        'url', 'version', 'variants', 'i_frame_variants', 'renditions',
+        'session_data', 'session_keys', 'independent_segments', 'start',
+    )
+
+    def __init__(self, url=None):
+        # where the playlist was downloaded from, if known
+        self.url = url
+        self.version = None
+        self.variants = []
+        self.i_frame_variants = []
+        self.renditions = []
+        self.session_data = []
+        self.session_keys = []
+        self.independent_segments = False
+        self.start = None
+
+    @property
+    def best_variant(self):
+        if not self.variants:
+            # e.g. only #EXT-X-MEDIA renditions
+            raise ValueError(
+                f'No variant streams in master playlist {self.url}'
+            )
+        # variants are sorted by bandwidth, highest first
+        return self.variants[0]
+
+class MediaPlaylist:
+    __slots__ = (
+        'version', 'target_duration', 'media_sequence', 
+        'discontinuity_sequence', 'playlist_type', 'end_list', 
+        'i_frames_only', 'independent_segments', 'start', 'segments',
+    )
+
+    def __init__(self):
+        self.version = None
+        self.target_duration = None
+        self.media_sequence = 0
+        self.discontinuity_sequence = 0
+        self.playlist_type = None
+        self.end_list = False
+        self.i_frames_only = False
+        self.independent_segments = False
+        self.start = None
+        self.segments = []
+
+    @property
+    def duration(self):
+        return sum(x.duration for x in self.segments)
+
+class M3U8:
+    '''
+    Single pass, line oriented parser for HLS playlists (RFC 8216).
+    Returns a MasterPlaylist or a MediaPlaylist.
+    '''
+    STREAM_INFO_PREFIX = '#EXT-X-STREAM-INF'
+    MEDIA_PREFIX = '#EXT-X-MEDIA'
+
+    @staticmethod
+    def parse_attribute_list(text):
+        '''
+        Parse an attribute list such as
+        BANDWIDTH=1280000,CODECS="avc1.4d401f,mp4a.40.2"
+        Quoted values may contain commas and '='.
+        '''
+        attributes = {}
+        i = 0
+        n = len(text)
+        while i < n:
+            eq = text.find('=', i)
+            if eq < 0:
+                break
+            key = text[i:eq].strip()
+            i = eq + 1
+            if i < n and text[i] == '"':
+                end = text.find('"', i + 1)
+                if end < 0:
+                    end = n
+                value = text[i + 1:end]
+                comma = text.find(',', end)
+            else:
+                comma = text.find(',', i)
+                value = text[i:n if comma < 0 else comma].strip()
+            attributes[key] = value
+            if comma < 0:
+                break
+            i = comma + 1
+        return attributes
+
+    @staticmethod
+    def parse_byterange(text, previous_end=0):
+        # <length>[@<offset>], offset defaults to the end of the
+        # previous sub-range of the same resource
+        length, sep, offset = text.partition('@')
+        if sep:
+            return int(length), int(offset)
+        return int(length), previous_end
+
+    @staticmethod
+    def parse(text, base_url=None):
+        # urljoin is slow, plain relative paths (the common case) are
+        # resolved by prefixing the directory of the base url
+        base_dir = None
+        if base_url:
+            base_dir = base_url.split('#', 1)[0].split('?', 1)[0]
+            base_dir = base_dir[:base_dir.rfind('/') + 1]
+
+        def resolve(uri):
+            if not base_url or '://' in uri:
+                return uri
+            if uri[0] not in '/?#.' and ':' not in uri.split('/', 1)[0]:
+                return base_dir + uri
+            return urljoin(base_url, uri)
+
+        # the type of playlist is only known once a tag specific to
+        # it is seen, so both are filled in and one is returned
+        master = MasterPlaylist(base_url)
+        media = MediaPlaylist()
+
+        # state that applies to the next uri line
+        stream_inf = None
+        duration = None
+        title = ''
+        byterange = None
+        discontinuity = False
+        program_date_time = None
+        # state that applies to all following segments
+        key = None
+        init_section = None
+        byterange_end = {}
+
+        for line_no, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] != '#':
+                uri = resolve(line)
+                if stream_inf is not None:
+                    master.variants.append(Variant(stream_inf, uri))
+                    stream_inf = None
+                    continue
+                if duration is None:
+                    raise ValueError(
+                        f'URI without #EXTINF or #EXT-X-STREAM-INF '
+                        f'on line {line_no}'
+                    )
+                segment = Segment(
+                    uri, duration, title,
+                    sequence=media.media_sequence + len(media.segments),
+                    key=key,
+                    map=init_section,
+                    discontinuity=discontinuity,
+                    program_date_time=program_date_time,
+                )
+                if byterange is not None:
+                    segment.byterange = M3U8.parse_byterange(
+                        byterange, byterange_end.get(uri, 0)
+                    )
+                    length, offset = segment.byterange
+                    byterange_end[uri] = offset + length
+                media.segments.append(segment)
+                duration = None
+                title = ''
+                byterange = None
+                discontinuity = False
+                program_date_time = None
+                continue
+            if not line.startswith('#EXT'):
+                # comment
+                continue
+
+            tag, _, value = line.partition(':')
+            if tag == '#EXTINF':
+                duration, _, title = value.partition(',')
+                duration = float(duration)
+            elif tag == '#EXT-X-BYTERANGE':
+                byterange = value
+            elif tag == '#EXT-X-STREAM-INF':
+                stream_inf = M3U8.parse_attribute_list(value)
+            elif tag == '#EXT-X-MEDIA':
+                attributes = M3U8.parse_attribute_list(value)
+                uri = attributes.get('URI')
+                master.renditions.append(
+                    Rendition(attributes, resolve(uri) if uri else None)
+                )
+            elif tag == '#EXT-X-KEY':
+                attributes = M3U8.parse_attribute_list(value)
+                if attributes['METHOD'] == 'NONE':
+                    key = None
+                else:
+                    key = Key(
+                        attributes['METHOD'],
+                        uri=resolve(attributes['URI']),
+                        iv=attributes.get('IV'),
+                        keyformat=attributes.get('KEYFORMAT', 'identity'),
+                        keyformatversions=attributes.get('KEYFORMATVERSIONS'),
+                    )
+            elif tag == '#EXT-X-MAP':
+                attributes = M3U8.parse_attribute_list(value)
+                init_section = InitSection(
+                    resolve(attributes['URI']), key=key
+                )
+                if 'BYTERANGE' in attributes:
+                    init_section.byterange = M3U8.parse_byterange(
+                        attributes['BYTERANGE']
+                    )
+            elif tag == '#EXT-X-MEDIA-SEQUENCE':
+                media.media_sequence = int(value)
+            elif tag == '#EXT-X-TARGETDURATION':
+                media.target_duration = int(float(value))
+            elif tag == '#EXT-X-DISCONTINUITY':
+                discontinuity = True
+            elif tag == '#EXT-X-DISCONTINUITY-SEQUENCE':
+                media.discontinuity_sequence = int(value)
+            elif tag == '#EXT-X-PROGRAM-DATE-TIME':
+                program_date_time = value
+            elif tag == '#EXT-X-ENDLIST':
+                media.end_list = True
+            elif tag == '#EXT-X-PLAYLIST-TYPE':
+                media.playlist_type = value
+            elif tag == '#EXT-X-I-FRAMES-ONLY':
+                media.i_frames_only = True
+            elif tag == '#EXT-X-I-FRAME-STREAM-INF':
+                attributes = M3U8.parse_attribute_list(value)
+                master.i_frame_variants.append(Variant(
+                    attributes, resolve(attributes['URI']), 
+                    i_frames_only=True,
+                ))
+            elif tag == '#EXT-X-SESSION-DATA':
+                master.session_data.append(
+                    M3U8.parse_attribute_list(value)
+                )
+            elif tag == '#EXT-X-SESSION-KEY':
+                master.session_keys.append(
+                    M3U8.parse_attribute_list(value)
+                )
+            elif tag == '#EXT-X-INDEPENDENT-SEGMENTS':
+                master.independent_segments = True
+                media.independent_segments = True
+            elif tag == '#EXT-X-START':
+                master.start = media.start = M3U8.parse_attribute_list(value)
+            elif tag == '#EXT-X-VERSION':
+                master.version = media.version = int(value)
+            elif tag in ('#EXTM3U', '#EXT-X-DATERANGE'):
+                pass
+            else:
+                # unknown tags must be ignored (RFC 8216 section 6.3.1)
+                logger.debug(f'Ignoring unknown tag {tag}')
+
+        if master.variants or master.renditions or master.i_frame_variants:
+            M3U8.link_renditions(master)
+            return master
+        return media
+
+    @staticmethod
+    def link_renditions(playlist):
+        groups = {}
+        for rendition in playlist.renditions:
+            key = (rendition.type, rendition.group_id)
+            groups.setdefault(key, []).append(rendition)
+
+        group_attributes = (
+            ('AUDIO', 'audio'), 
+            ('VIDEO', 'video'), 
+            ('SUBTITLES', 'subtitles'),
+            ('CLOSED-CAPTIONS', 'closed_captions'),
+        )
+        for variant in playlist.variants + playlist.i_frame_variants:
+            for rendition_type, attr in group_attributes:
+                group_id = getattr(variant, attr)
+                if group_id:
+                    variant.renditions[rendition_type] = groups.get(
+                        (rendition_type, group_id), []
+                    )
+        # sort streams by quality (in case they are not already)
+        playlist.variants.sort(key=lambda x: -x.bandwidth)
+
+    @staticmethod
+    def parse_master(text, base_url=None):
+        playlist = M3U8.parse(text, base_url)
+        if not isinstance(playlist, MasterPlaylist):
+            raise ValueError('Expected a master playlist')
+        return playlist
+
+    @staticmethod
+    def parse_media(text, base_url=None):
+        playlist = M3U8.parse(text, base_url)
+        if not isinstance(playlist, MediaPlaylist):
+            raise ValueError('Expected a media playlist')
+        return playlist
+
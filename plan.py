@@ -0,0 +1,118 @@
+#!/bin/python3
+'''
+Saves the files found for a course as a JSON lines plan, so that they
+can be downloaded later, or split across processes, without the browser.
+'''
+# ==================== IMPORTS ===========================
+import json
+import time
+import zlib
+import os
+
+# =========== IMPORT FROM OTHER SCRIPT ==============
+from common import logger
+from crawler import SessionCache
+
+# ==================== CODE ===========================
+
+class DownloadPlan:
+    '''
+    The first line is a header with the course and a reference to the
+    session cache file holding the cookies (cookies are never written
+    to the plan itself). Every following line is a download info.
+    '''
+    VERSION = 1
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+
+    @property
+    def course_info(self):
+        return self.header['course']
+
+    @staticmethod
+    def header_for(course_info, session_path, plan_path):
+        # relative to the plan, so that both can be moved together
+        plan_dir = os.path.dirname(os.path.abspath(plan_path))
+        return {
+            'type': 'header',
+            'version': DownloadPlan.VERSION,
+            'created_at': time.time(),
+            'course': course_info,
+            'cookies': {
+                'session_cache': os.path.relpath(
+                    os.path.abspath(session_path), plan_dir
+                ),
+            },
+        }
+
+    @staticmethod
+    def record(path, course_info, session_path, download_infos):
+        '''
+        Writes each download info to the plan at path as it is yielded,
+        then yields it unchanged
+        '''
+        header = DownloadPlan.header_for(course_info, session_path, path)
+        n = 0
+        with open(path, 'w') as f:
+            f.write(json.dumps(header) + '\n')
+            for download_info in download_infos:
+                f.write(json.dumps({'type': 'file', **download_info}) + '\n')
+                f.flush()
+                n += 1
+                yield download_info
+        logger.info(f'Saved plan with {n} files to {path}')
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            header = json.loads(f.readline())
+        if header.get('type') != 'header':
+            raise ValueError(f'Missing plan header: {path}')
+        if header.get('version') != DownloadPlan.VERSION:
+            raise ValueError(
+                f'Unsupported plan version {header.get("version")}: {path}'
+            )
+        return DownloadPlan(path, header)
+
+    @staticmethod
+    def in_shard(filepath, shard):
+        '''
+        shard is (i, n) with 1 <= i <= n.
+        crc32 is stable across processes and machines, unlike hash()
+        '''
+        i, n = shard
+        return zlib.crc32(filepath.encode('utf-8')) % n == i - 1
+
+    def iter_download_infos(self, shard=None):
+        with open(self.path) as f:
+            # skip header
+            f.readline()
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.pop('type', None) != 'file':
+                    continue
+                if shard and not DownloadPlan.in_shard(
+                    entry['filepath'], shard
+                ):
+                    continue
+                yield entry
+
+    def session_path(self):
+        plan_dir = os.path.dirname(os.path.abspath(self.path))
+        return os.path.join(
+            plan_dir, self.header['cookies']['session_cache']
+        )
+
+    def load_cookies(self):
+        '''
+        Returns the cookies referenced by the plan,
+        or None if they are missing or expired
+        '''
+        cookies = SessionCache(self.session_path()).load()
+        if cookies and not SessionCache.validate(cookies):
+            return None
+        return cookies
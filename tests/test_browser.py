@@ -0,0 +1,80 @@
+import time
+import threading
+import unittest
+from unittest import mock
+
+from selenium.common.exceptions import NoSuchElementException
+
+import browser
+from browser import NTULearnClient, ResponseIndex
+
+COOKIES = [{'name': 'BbRouter', 'value': 'b', 'domain': 'ntulearn.ntu.edu.sg'}]
+
+class FakeDriver:
+    '''
+    A browser where the media player never loads
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cookie_reads = 0
+        self.urls = []
+
+    def get_cookies(self):
+        with self.lock:
+            self.cookie_reads += 1
+        return COOKIES
+
+    def get(self, url):
+        self.urls.append(url)
+
+    def find_element(self, by, value):
+        raise NoSuchElementException(value)
+
+def fake_client():
+    client = NTULearnClient.__new__(NTULearnClient)
+    client.credentials = None
+    client.driver = FakeDriver()
+    client.responses = ResponseIndex()
+    return client
+
+def media_info(i):
+    return {'short_name': 'C', 'name': f'Lecture {i}', 'href': f'http://h/{i}'}
+
+class PlaylistPoolTest(unittest.TestCase):
+    def test_cookies_are_read_once_for_every_worker(self):
+        client = fake_client()
+        client.extract_m3u8_playlist = lambda x: {'filepath': x['name']}
+        with mock.patch.object(browser, 'NTULearnClient') as client_cls:
+            worker = client_cls.return_value
+            worker.extract_m3u8_playlist.side_effect = (
+                lambda x: {'filepath': x['name']}
+            )
+            playlists = list(client.iter_playlists_from_media_infos(
+                [media_info(i) for i in range(6)], workers=4,
+            ))
+        self.assertEqual(client.driver.cookie_reads, 1)
+        self.assertEqual(client_cls.call_count, 3)
+        worker.add_cookies.assert_called_with(COOKIES)
+        self.assertEqual(worker.add_cookies.call_count, 3)
+        self.assertEqual(worker.close.call_count, 3)
+        self.assertEqual(
+            sorted(x['filepath'] for x in playlists),
+            [f'Lecture {i}' for i in range(6)],
+        )
+
+    def test_tab_gives_up_when_the_player_does_not_load(self):
+        client = fake_client()
+        start = time.monotonic()
+        with self.assertLogs('ntu-learn-downloader', 'WARNING') as logs:
+            playlist = client.extract_m3u8_playlist(
+                media_info(1), player_timeout=0.2,
+            )
+        self.assertIsNone(playlist)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(client.driver.urls, ['http://h/1'])
+        self.assertTrue(
+            any('Player did not load' in x for x in logs.output)
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,279 @@
+import os
+import json
+import stat
+import time
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from common import COURSE_MEMBERSHIPS_URL, CURRENT_USER_URL, STATE_DIR_NAME
+from crawler import ContentCrawler, HTMLTreeBuilder, SessionCache
+from browser import NTULearnClient
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+COURSE_INFO = {
+    'course_id': '_42_1',
+    'short_name': 'CZ1001',
+    'long_name': 'DISCRETE MATHEMATICS',
+}
+BASE_URL = 'https://ntulearn.ntu.edu.sg/webapps/blackboard/content/'
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+class FixtureSession:
+    '''
+    Answers every request with a saved page, recording the timeouts
+    '''
+    def __init__(self, pages):
+        self.pages = pages
+        self.timeouts = []
+
+    def get(self, url, timeout=None):
+        self.timeouts.append(timeout)
+        return SimpleNamespace(
+            url=url, text=self.pages[url], raise_for_status=lambda: None,
+        )
+
+    def close(self):
+        pass
+
+class HTMLTreeBuilderTest(unittest.TestCase):
+    def test_text_leaves_out_scripts_styles_and_hidden_elements(self):
+        root = HTMLTreeBuilder.parse(
+            '<li><script>var a = "(x)";</script>Notes.pdf'
+            '<style>li { color: red; }</style> (1 MB)'
+            '<span hidden>(y)</span><span style="display: none">(z)</span>'
+            '</li>'
+        )
+        li = root.find(lambda x: x.tag == 'li')
+        self.assertEqual(li.text(), 'Notes.pdf (1 MB)')
+
+class ContentCrawlerTest(unittest.TestCase):
+    def test_parse_content_tree(self):
+        folders = ContentCrawler.parse_content_tree(
+            read_fixture('content_tree.html'), COURSE_INFO, BASE_URL,
+        )
+        self.assertEqual(
+            [(x['content_id'], x['filepath']) for x in folders],
+            [
+                ('_101_1', os.path.join('Lectures', 'Week_1')),
+                ('_102_1', os.path.join('Lectures', 'Week_2_Recap')),
+                ('_200_1', 'Assignments'),
+            ],
+        )
+        self.assertEqual(
+            folders[0]['href'],
+            BASE_URL + 'listContent.jsp?course_id=_42_1'
+            '&content_id=_101_1&mode=reset',
+        )
+
+    def test_parse_folder_attachments(self):
+        folder = {
+            'content_id': '_110_1', 
+            'course_id': '_42_1', 
+            'filepath': 'Week_1',
+        }
+        attachments = ContentCrawler.parse_folder_attachments(
+            read_fixture('folder.html'), folder, BASE_URL,
+        )
+        self.assertEqual(attachments, [
+            {
+                'attachment': {
+                    'href': 'https://ntulearn.ntu.edu.sg/bbcswebdav/'
+                            'pid-110-dt-content-rid-1001_1/xid-1001_1',
+                },
+                'filepath': os.path.join('Week_1', 'Lecture_1_Intro.pdf'),
+            },
+            {
+                'attachment': {
+                    'href': 'https://ntulearn.ntu.edu.sg/bbcswebdav/'
+                            'pid-110-dt-content-rid-1002_1/xid-1002_1',
+                },
+                'filepath': os.path.join('Week_1', 'Tutorial_1.docx'),
+            },
+        ])
+
+    def test_enumerate_courses(self):
+        session = FixtureSession({
+            COURSE_MEMBERSHIPS_URL: read_fixture('memberships.json'),
+        })
+        crawler = ContentCrawler(None, session=session, timeout=7)
+        courses = crawler.enumerate_courses()
+        self.assertEqual(courses, [{
+            'course_id': '_42_1',
+            'short_name': 'CZ1001-CZ1001-SEM1-2026',
+            'long_name': 'DISCRETE MATHEMATICS',
+            'status': 'Open',
+        }])
+        self.assertEqual(session.timeouts, [7])
+
+    def test_enumerate_courses_follows_paging(self):
+        def membership(i):
+            return {'course': {
+                'id': f'_{i}_1', 'courseId': f'C{i}', 'name': f'Course {i}',
+            }}
+        next_url = COURSE_MEMBERSHIPS_URL + '&offset=100'
+        session = FixtureSession({
+            COURSE_MEMBERSHIPS_URL: json.dumps({
+                'results': [membership(1), membership(2)],
+                'paging': {
+                    'nextPage': '/learn/api/v1/users/me/memberships'
+                                '?expand=course&limit=100&offset=100',
+                },
+            }),
+            next_url: json.dumps({
+                'results': [membership(3)],
+                'paging': {},
+            }),
+        })
+        crawler = ContentCrawler(None, session=session)
+        courses = crawler.enumerate_courses()
+        self.assertEqual(
+            [x['course_id'] for x in courses], ['_1_1', '_2_1', '_3_1'],
+        )
+        self.assertEqual(len(session.timeouts), 2)
+
+    def test_attachments_are_yielded_in_folder_order(self):
+        folders = [{'filepath': str(i)} for i in range(8)]
+        def enumerate_attachments_for_folder(folder):
+            # later folders are parsed first
+            time.sleep(0.01 * (len(folders) - int(folder['filepath'])))
+            return [
+                {'filepath': os.path.join(folder['filepath'], x)}
+                for x in 'ab'
+            ]
+        crawler = ContentCrawler(
+            None, max_workers=len(folders), session=FixtureSession({}),
+        )
+        with mock.patch.object(
+            crawler, 'enumerate_attachments_for_folder', 
+            enumerate_attachments_for_folder,
+        ):
+            attachments = list(crawler.iter_attachments_for_folders(folders))
+        self.assertEqual(
+            [x['filepath'] for x in attachments],
+            [os.path.join(str(i), x) for i in range(8) for x in 'ab'],
+        )
+
+class RedirectSession:
+    '''
+    Answers every request from the sign in page, like an expired session
+    '''
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        return SimpleNamespace(
+            url='https://loginfs.ntu.edu.sg/adfs/ls/', text='',
+            raise_for_status=lambda: None,
+        )
+
+    def close(self):
+        pass
+
+COOKIES = [
+    {'name': 'JSESSIONID', 'value': 'a'},
+    {'name': 'BbRouter', 'value': 'b', 'expiry': 2_000_000_000},
+]
+
+class SessionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = SessionCache.for_download_dir(
+            self.tmpdir.name, max_age=3600,
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_expiry_is_the_earliest_cookie_expiry_or_max_age(self):
+        self.assertEqual(
+            SessionCache.cookies_expire_at(COOKIES, 1000, 3600), 4600,
+        )
+        self.assertEqual(
+            SessionCache.cookies_expire_at(COOKIES, 2_000_000_000 - 60, 3600),
+            2_000_000_000,
+        )
+        self.assertEqual(
+            SessionCache.cookies_expire_at([], 1000, 3600), 4600,
+        )
+
+    def test_save_and_load(self):
+        self.cache.save(COOKIES)
+        self.assertEqual(
+            self.cache.path, 
+            os.path.join(self.tmpdir.name, STATE_DIR_NAME, 'session.json'),
+        )
+        self.assertEqual(self.cache.load(), COOKIES)
+
+    def test_file_is_only_accessible_by_the_owner(self):
+        self.cache.save(COOKIES)
+        mode = stat.S_IMODE(os.stat(self.cache.path).st_mode)
+        self.assertEqual(mode, 0o600)
+        mode = stat.S_IMODE(os.stat(os.path.dirname(self.cache.path)).st_mode)
+        self.assertEqual(mode & ~0o700, 0)
+        # no temporary files are left next to it
+        self.assertEqual(
+            os.listdir(os.path.dirname(self.cache.path)), ['session.json'],
+        )
+
+    def test_expired_session_is_removed(self):
+        self.cache.save([{'name': 'a', 'value': 'b', 'expiry': 1}])
+        with self.assertLogs('ntu-learn-downloader', 'INFO'):
+            self.assertIsNone(self.cache.load())
+        self.assertFalse(os.path.exists(self.cache.path))
+
+    def test_session_expires_after_max_age(self):
+        self.cache.save(COOKIES)
+        with mock.patch('time.time', return_value=time.time() + 3601):
+            self.assertIsNone(self.cache.load())
+        self.assertFalse(os.path.exists(self.cache.path))
+
+    def test_clear(self):
+        self.cache.save(COOKIES)
+        self.cache.clear()
+        self.assertFalse(os.path.exists(self.cache.path))
+        self.assertIsNone(self.cache.load())
+        # clearing twice is fine
+        self.cache.clear()
+
+    def test_validate(self):
+        session = FixtureSession({CURRENT_USER_URL: '{}'})
+        with mock.patch('crawler.create_session', return_value=session):
+            self.assertTrue(SessionCache.validate(COOKIES))
+        self.assertEqual(len(session.timeouts), 1)
+
+    def test_validate_rejects_a_stale_session(self):
+        session = RedirectSession()
+        with mock.patch(
+            'crawler.create_session', return_value=session,
+        ), self.assertLogs('ntu-learn-downloader', 'INFO') as logs:
+            self.assertFalse(SessionCache.validate(COOKIES))
+        self.assertEqual(session.urls, [CURRENT_USER_URL])
+        self.assertTrue(any('redirected' in x for x in logs.output))
+
+class BrowserFolderAttachmentsTest(unittest.TestCase):
+    def test_items_without_link_are_skipped(self):
+        folder = {
+            'content_id': '_110_1', 
+            'course_id': '_42_1', 
+            'filepath': 'Week_1',
+        }
+        href = 'https://ntulearn.ntu.edu.sg/bbcswebdav/pid-110/xid-1001_1'
+        with self.assertLogs('ntu-learn-downloader', 'WARNING'):
+            attachments = NTULearnClient.parse_folder_attachments([
+                {'text': 'Recording link (external)', 'href': None},
+                {'text': ' Lecture 1.pdf\n(1.2 MB) ', 'href': href},
+            ], folder)
+        self.assertEqual(attachments, [{
+            'attachment': {'href': href},
+            'filepath': os.path.join('Week_1', 'Lecture_1.pdf'),
+        }])
+
+if __name__ == '__main__':
+    unittest.main()
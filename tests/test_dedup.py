@@ -0,0 +1,107 @@
+import os
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from downloader import Downloader, DirectorySink, canonical_href
+
+class FileHandler(BaseHTTPRequestHandler):
+    '''
+    Serves /webapps/blackboard/execute/content/file?content_id=<id>, 
+    with a different body for each content_id
+    '''
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        body = f'file {query["content_id"][0]}'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class CanonicalHrefTest(unittest.TestCase):
+    def test_xid(self):
+        self.assertEqual(
+            canonical_href('/bbcswebdav/pid-1-dt-content-rid-2_1/xid-2_1'),
+            canonical_href('/bbcswebdav/pid-7-dt-content-rid-2_1/xid-2_1'),
+        )
+
+    def test_query_is_kept(self):
+        url = '/webapps/blackboard/execute/content/file?cmd=view&content_id='
+        self.assertNotEqual(
+            canonical_href(url + '_123_1'), canonical_href(url + '_124_1'),
+        )
+
+    def test_query_order_and_fragment_are_ignored(self):
+        self.assertEqual(
+            canonical_href('/file?cmd=view&content_id=_1_1#page=2'),
+            canonical_href('/file?content_id=_1_1&cmd=view'),
+        )
+
+class DedupDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def test_files_differing_in_content_id_are_both_downloaded(self):
+        base = (
+            f'http://127.0.0.1:{self.server.server_port}'
+            '/webapps/blackboard/execute/content/file'
+            '?cmd=view&course_id=_9_1&content_id='
+        )
+        download_infos = [
+            {'attachment': {'href': base + '_123_1'}, 'filepath': 'C/a.pdf'},
+            {'attachment': {'href': base + '_124_1'}, 'filepath': 'C/b.pdf'},
+        ]
+        downloader = Downloader(
+            download_dir=self.tmpdir.name, temp_dir=self.tmpdir.name,
+            dedup='href',
+        )
+        try:
+            downloader.download_all(
+                iter(download_infos), DirectorySink(self.tmpdir.name),
+            )
+        finally:
+            downloader.close()
+        for filepath, body in [('a.pdf', b'file _123_1'), 
+                               ('b.pdf', b'file _124_1')]:
+            with open(os.path.join(self.tmpdir.name, 'C', filepath), 'rb') as f:
+                self.assertEqual(f.read(), body)
+
+    def test_attachment_without_href_fails_alone(self):
+        base = (
+            f'http://127.0.0.1:{self.server.server_port}'
+            '/webapps/blackboard/execute/content/file?content_id='
+        )
+        download_infos = [
+            {'attachment': {'href': None}, 'filepath': 'C/missing.pdf'},
+            {'attachment': {'href': base + '_1_1'}, 'filepath': 'C/a.pdf'},
+        ]
+        downloader = Downloader(
+            download_dir=self.tmpdir.name, temp_dir=self.tmpdir.name,
+            dedup='href',
+        )
+        sink = DirectorySink(self.tmpdir.name)
+        try:
+            future = downloader.submit_attachment(0, download_infos[0], sink)
+            download_info, error, status = future.result()
+            self.assertIsInstance(error, ValueError)
+            self.assertIsNone(status)
+            downloader.download_all(iter(download_infos), sink)
+        finally:
+            downloader.close()
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir.name, 'C')), 
+                         ['a.pdf'])
+
+if __name__ == '__main__':
+    unittest.main()
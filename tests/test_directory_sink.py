@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from downloader import DirectorySink
+
+class DirectorySinkTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, 'out')
+        self.sink = DirectorySink(self.root)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read(self, arcpath):
+        with open(os.path.join(self.root, arcpath), 'rb') as f:
+            return f.read()
+
+    def listdir(self, arcpath):
+        return sorted(os.listdir(os.path.join(self.root, arcpath)))
+
+    def test_files_are_written_under_the_root(self):
+        callback = mock.Mock()
+        self.sink.writestr('C/Week 1/a.txt', 'notes', callback=callback)
+        callback.assert_called_once()
+        self.assertEqual(self.read('C/Week 1/a.txt'), b'notes')
+        self.assertFalse(self.sink.needs_full_copy('C/Week 1/a.txt'))
+        self.assertTrue(self.sink.needs_full_copy('C/Week 1/b.txt'))
+
+    def test_file_is_renamed_into_place_once_complete(self):
+        self.sink.writestr('C/a.txt', 'old')
+        def write_func(f):
+            f.write(b'partial')
+            # only the temporary file exists while writing
+            self.assertEqual(self.read('C/a.txt'), b'old')
+            self.assertEqual(len(self.listdir('C')), 2)
+        self.sink.write_atomic('C/a.txt', write_func)
+        self.assertEqual(self.read('C/a.txt'), b'partial')
+        self.assertEqual(self.listdir('C'), ['a.txt'])
+
+    def test_failed_write_leaves_no_partial_file(self):
+        callback = mock.Mock()
+        def write_func(f):
+            f.write(b'partial')
+            raise OSError('connection lost')
+        with self.assertRaises(OSError):
+            self.sink.write_atomic('C/a.txt', write_func, callback)
+        callback.assert_not_called()
+        self.assertEqual(self.listdir('C'), [])
+
+    def test_link(self):
+        self.sink.writestr('C/Week 1/a.pdf', 'pdf')
+        callback = mock.Mock()
+        self.sink.link('C/Week 1/a.pdf', 'C/Week 2/a.pdf', callback)
+        callback.assert_called_once()
+        self.assertEqual(self.read('C/Week 2/a.pdf'), b'pdf')
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.root, 'C/Week 1/a.pdf'),
+            os.path.join(self.root, 'C/Week 2/a.pdf'),
+        ))
+        self.assertEqual(self.listdir('C/Week 2'), ['a.pdf'])
+
+    def test_link_falls_back_to_a_copy(self):
+        self.sink.writestr('C/Week 1/a.pdf', 'pdf')
+        callback = mock.Mock()
+        with mock.patch('os.link', side_effect=OSError('not supported')):
+            self.sink.link('C/Week 1/a.pdf', 'C/Week 2/a.pdf', callback)
+        callback.assert_called_once()
+        self.assertEqual(self.read('C/Week 2/a.pdf'), b'pdf')
+        self.assertFalse(os.path.samefile(
+            os.path.join(self.root, 'C/Week 1/a.pdf'),
+            os.path.join(self.root, 'C/Week 2/a.pdf'),
+        ))
+        self.assertEqual(self.listdir('C/Week 2'), ['a.pdf'])
+
+    def test_paths_outside_of_the_root_are_rejected(self):
+        for arcpath in ('../a.txt', 'C/../../a.txt', '/tmp/a.txt'):
+            with self.assertRaisesRegex(ValueError, 'outside of'):
+                self.sink.writestr(arcpath, 'notes')
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_close_keeps_the_directory(self):
+        self.sink.close()
+        self.assertFalse(self.sink.removed)
+
+if __name__ == '__main__':
+    unittest.main()
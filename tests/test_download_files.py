@@ -0,0 +1,228 @@
+import os
+import json
+import zipfile
+import argparse
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import download_files
+from download_files import add_download_arguments, open_sink
+from plan import DownloadPlan
+
+class FileHandler(BaseHTTPRequestHandler):
+    '''Serves server.files, anything else is a 404'''
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def parse_download_args(*argv):
+    parser = argparse.ArgumentParser()
+    add_download_arguments(parser)
+    return parser.parse_args(list(argv))
+
+def course_info(name):
+    return {'course_id': f'_{name}_1', 'short_name': name, 'long_name': name}
+
+FILEPATHS = [f'C/folder {i}/file {i}.pdf' for i in range(200)]
+
+class ShardTest(unittest.TestCase):
+    def test_each_filepath_is_in_exactly_one_shard(self):
+        for n in range(1, 6):
+            for filepath in FILEPATHS:
+                shards = [
+                    i for i in range(1, n + 1)
+                    if DownloadPlan.in_shard(filepath, (i, n))
+                ]
+                self.assertEqual(len(shards), 1, (filepath, n))
+
+    def run_shards(self, n):
+        '''
+        Runs every shard of a plan of FILEPATHS,
+        returns {name: filepaths} of the downloads that were started
+        '''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'plan.jsonl')
+            download_infos = (
+                {'attachment': {'href': 'http://h/' + x}, 'filepath': x}
+                for x in FILEPATHS
+            )
+            for _ in DownloadPlan.record(
+                path, course_info('C'),
+                os.path.join(tmpdir, 'session.json'), download_infos,
+            ):
+                pass
+            started = {}
+            def download(args, cookies, download_infos, name):
+                self.assertNotIn(name, started)
+                started[name] = [x['filepath'] for x in download_infos]
+            with mock.patch.object(
+                DownloadPlan, 'load_cookies', return_value=[],
+            ), mock.patch.object(download_files, 'download', download):
+                for i in range(1, n + 1):
+                    args = argparse.Namespace(plan=path, shard=(i, n))
+                    download_files.run_plan(args)
+        return started
+
+    def test_shards_split_the_plan_without_overlap(self):
+        started = self.run_shards(3)
+        filepaths = [x for names in started.values() for x in names]
+        self.assertEqual(sorted(filepaths), sorted(FILEPATHS))
+        self.assertTrue(all(started.values()))
+
+    def test_shard_outputs_do_not_collide(self):
+        names = [
+            name for n in (1, 2, 11, 12) for name in self.run_shards(n)
+        ]
+        self.assertEqual(len(set(names)), len(names))
+        with tempfile.TemporaryDirectory() as download_dir:
+            args = parse_download_args(
+                '--download-dir', download_dir, '--output', 'zip', '--sync',
+            )
+            paths = set()
+            for name in names:
+                sink, manifest, checkpoint = open_sink(
+                    args, name, download_dir,
+                )
+                sink.close()
+                paths.update([sink.path, manifest.path, checkpoint.path])
+                self.assertTrue(
+                    os.path.basename(sink.path).startswith(name + '-')
+                )
+            self.assertEqual(len(paths), 3 * len(names))
+
+class SavePlanTest(unittest.TestCase):
+    def test_plan_saved_to_bare_filename(self):
+        download_infos = [
+            {'attachment': {'href': 'http://h/a.pdf'}, 'filepath': 'C/a.pdf'},
+        ]
+        args = argparse.Namespace(save_plan='plan.jsonl')
+        client = mock.Mock()
+        client.driver.get_cookies.return_value = [
+            {'name': 'session', 'value': 'x'},
+        ]
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmpdir, mock.patch.object(
+            download_files, 'iter_download_infos', 
+            return_value=iter(download_infos),
+        ):
+            os.chdir(tmpdir)
+            try:
+                recorded = list(download_files.iter_course_download_infos(
+                    args, client, course_info('C'), {}, None,
+                ))
+                plan = DownloadPlan.load('plan.jsonl')
+                self.assertEqual(recorded, download_infos)
+                self.assertEqual(
+                    list(plan.iter_download_infos()), download_infos,
+                )
+                self.assertEqual(
+                    plan.session_path(), 
+                    os.path.join(os.getcwd(), 'plan.jsonl.session.json'),
+                )
+                with mock.patch(
+                    'crawler.SessionCache.validate', return_value=True,
+                ):
+                    self.assertEqual(plan.load_cookies(), [
+                        {'name': 'session', 'value': 'x'},
+                    ])
+            finally:
+                os.chdir(cwd)
+
+class SignInTest(unittest.TestCase):
+    def test_course_list_uses_the_api_with_either_crawler(self):
+        for crawler in ('http', 'browser'):
+            args = argparse.Namespace(
+                email=None, password=None, session_cache=False, 
+                crawler=crawler,
+            )
+            with mock.patch('browser.NTULearnClient') as client_cls:
+                client, course_infos, session_cache = (
+                    download_files.sign_in(args)
+                )
+            client.enumerate_courses.assert_called_once_with()
+            self.assertIsNone(session_cache)
+
+class DownloadCoursesTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+        self.server.files = {
+            f'/{name}.txt': name.encode() for name in ('A', 'B', 'C')
+        }
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.download_dir = self.tmpdir.name
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def download_info(self, course, name):
+        return {
+            'attachment': {'href': f'{self.base}/{name}'},
+            'filepath': f'{course}/{name}',
+        }
+
+    def iter_course_download_infos(self, args, client, course_info, cookies,
+                                   session_cache):
+        name = course_info['short_name']
+        yield self.download_info(name, f'{name}.txt')
+        if name == 'B':
+            # a file that fails to download, then the crawl fails
+            yield self.download_info(name, 'missing.txt')
+            raise RuntimeError('lost the browser')
+
+    def test_failed_course_does_not_affect_the_others(self):
+        args = parse_download_args(
+            '--download-dir', self.download_dir, '--output', 'zip',
+            '--sync', '--max-attempts', '1',
+        )
+        client = mock.Mock()
+        with mock.patch.object(
+            download_files, 'iter_course_download_infos',
+            self.iter_course_download_infos,
+        ), self.assertLogs('ntu-learn-downloader', 'ERROR') as logs:
+            download_files.download_courses(
+                args, client, [course_info(x) for x in 'ABC'], {}, None,
+            )
+        client.close.assert_called_once()
+        self.assertTrue(any('Failed to crawl B' in x for x in logs.output))
+
+        zips = {}
+        for filename in os.listdir(self.download_dir):
+            if filename.endswith('.zip'):
+                with zipfile.ZipFile(
+                    os.path.join(self.download_dir, filename)
+                ) as zf:
+                    zips[filename[0]] = {
+                        x: zf.read(x) for x in zf.namelist()
+                    }
+        self.assertEqual(zips, {
+            'A': {'A/A.txt': b'A'},
+            'B': {'B/B.txt': b'B'},
+            'C': {'C/C.txt': b'C'},
+        })
+
+        for name in 'ABC':
+            manifest = download_files.SyncManifest.for_course(
+                self.download_dir, name,
+            )
+            with open(manifest.path) as f:
+                entries = json.load(f)['entries']
+            self.assertEqual(list(entries), [f'{name}/{name}.txt'])
+
+if __name__ == '__main__':
+    unittest.main()
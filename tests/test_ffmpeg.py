@@ -0,0 +1,146 @@
+import os
+import sys
+import stat
+import time
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from downloader import Downloader
+
+# -progress output of a 60s stream converted at twice real time
+PROGRESS = '''\
+frame=100
+out_time_us=10000000
+out_time=00:00:10.000000
+speed=2.0x
+progress=continue
+out_time_us=30000000
+speed=N/A
+progress=continue
+out_time_us=60000000
+speed=2.5x
+progress=end
+'''
+
+MASTER = '''\
+#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=6000000
+http://h/{name}/index.m3u8
+'''
+
+class FFmpegProgressTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.downloader = Downloader(
+            download_dir=self.tmpdir.name, temp_dir=self.tmpdir.name,
+        )
+
+    def tearDown(self):
+        self.downloader.close()
+        self.tmpdir.cleanup()
+
+    def fake_ffmpeg(self, output, returncode=0):
+        '''Writes a stand in for ffmpeg printing output to stdout'''
+        path = os.path.join(self.tmpdir.name, 'ffmpeg')
+        with open(path, 'w') as f:
+            f.write(
+                f'#!{sys.executable}\nimport sys\n'
+                f'sys.stdout.write({output!r})\n'
+                f'sys.stderr.write("stream error")\n'
+                f'sys.exit({returncode})\n'
+            )
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        return path
+
+    def test_progress_is_parsed(self):
+        path = self.fake_ffmpeg(PROGRESS)
+        with self.assertLogs('ntu-learn-downloader', 'INFO') as logs:
+            self.downloader.run_ffmpeg([path], 'C/v.mp4', 60)
+        progress = self.downloader.ffmpeg_progress['C/v.mp4']
+        self.assertEqual(progress['out_time'], 60.0)
+        self.assertEqual(progress['speed'], 2.5)
+        self.assertEqual(progress['eta'], 0)
+        self.assertTrue(progress['done'])
+        # the first block and the end are logged
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn(
+            'C/v.mp4: 0:00:10/0:01:00 (17%) speed=2.0x ETA 0:00:25',
+            logs.output[0],
+        )
+        self.assertIn(
+            'C/v.mp4: 0:01:00/0:01:00 (100%) speed=2.5x', logs.output[1],
+        )
+        self.assertNotIn('ETA', logs.output[1])
+
+    def test_progress_without_duration(self):
+        path = self.fake_ffmpeg(PROGRESS)
+        with self.assertLogs('ntu-learn-downloader', 'INFO') as logs:
+            self.downloader.run_ffmpeg([path], 'C/v.mp4', None)
+        self.assertIsNone(self.downloader.ffmpeg_progress['C/v.mp4']['eta'])
+        self.assertIn('C/v.mp4: 0:00:10 speed=2.0x', logs.output[0])
+
+    def test_failure_reports_stderr(self):
+        path = self.fake_ffmpeg('progress=end\n', returncode=1)
+        with self.assertRaisesRegex(RuntimeError, 'code 1:\nstream error'):
+            self.downloader.run_ffmpeg([path], 'C/v.mp4', None)
+
+    def test_format_ffmpeg_progress(self):
+        self.assertEqual(Downloader.format_ffmpeg_progress({
+            'filepath': 'C/v.mp4', 'duration': 7200, 'out_time': 3725.5,
+            'speed': 1.5, 'eta': 2316.3, 'done': False,
+        }), 'C/v.mp4: 1:02:05/2:00:00 (52%) speed=1.5x ETA 0:38:36')
+
+class FFmpegBandwidthTest(unittest.TestCase):
+    def test_jobs_share_the_bandwidth_budget(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # 8 Mbit/s fits one 6 Mbit/s stream at a time
+            downloader = Downloader(
+                download_dir=tmpdir, temp_dir=tmpdir, ffmpeg_jobs=2,
+                ffmpeg_max_bandwidth=8_000_000,
+            )
+            self.assertEqual(downloader.ffmpeg_bandwidth.limit, 1_000_000)
+            lock = threading.Lock()
+            in_use = []
+            running = []
+            def run_ffmpeg(cmd, filepath, duration):
+                with lock:
+                    running.append(filepath)
+                    in_use.append(
+                        (len(running), downloader.ffmpeg_bandwidth.in_use)
+                    )
+                time.sleep(0.1)
+                with lock:
+                    running.remove(filepath)
+
+            download_infos = [
+                {
+                    'playlist_as_mp4': {'body': MASTER.format(name=x)},
+                    'filepath': f'C/{x}.mp4',
+                }
+                for x in 'ab'
+            ]
+            with mock.patch.object(
+                downloader, 'run_ffmpeg', run_ffmpeg,
+            ), mock.patch.object(
+                downloader.hls, 'get_media_playlist', 
+                return_value=SimpleNamespace(duration=60),
+            ):
+                futures = [
+                    downloader.ffmpeg_executor.submit(
+                        downloader.download_playlist_as_mp4, 
+                        i, x, mock.Mock(),
+                    )
+                    for i, x in enumerate(download_infos)
+                ]
+                results = [x.result() for x in futures]
+            downloader.close()
+        self.assertEqual([x[1] for x in results], [None, None])
+        # one job at a time, each holding 6 Mbit/s in bytes/s
+        self.assertEqual(in_use, [(1, 750_000), (1, 750_000)])
+        self.assertEqual(downloader.ffmpeg_bandwidth.in_use, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+from downloader import (
+    HLSDownloader, LocalStreams, DownloadInterrupted, Downloader, ZipSink,
+)
+from m3u8_parser import Segment
+
+class SlowSession:
+    '''
+    Returns the same body (or the body of each URL, if a dict) 
+    after a delay, counting requests
+    '''
+    def __init__(self, body, delay=0.1):
+        self.body = body
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        with self.lock:
+            self.requests.append(url)
+        time.sleep(self.delay)
+        body = self.body
+        if isinstance(body, dict):
+            body = body[url]
+        return SimpleNamespace(
+            url=url, content=body, text=body.decode('utf-8'), 
+            raise_for_status=lambda: None,
+        )
+
+class KeyCacheTest(unittest.TestCase):
+    def test_key_is_fetched_once_by_concurrent_segments(self):
+        session = SlowSession(b'k' * 16)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            hls = HLSDownloader(session, executor, max_segments_in_flight=4)
+            key = SimpleNamespace(method='AES-128', uri='http://h/key.bin')
+            values = list(executor.map(
+                lambda _: hls.get_key(key), range(4)
+            ))
+        self.assertEqual(values, [b'k' * 16] * 4)
+        self.assertEqual(session.requests, ['http://h/key.bin'])
+
+try:
+    from cryptography.hazmat.primitives.ciphers import (
+        Cipher, algorithms, modes
+    )
+except ImportError:
+    Cipher = None
+
+@unittest.skipIf(Cipher is None, 'cryptography is not installed')
+class DecryptTest(unittest.TestCase):
+    KEY = b'k' * 16
+    IV = b'i' * 16
+
+    def encrypt(self, data, key=KEY):
+        encryptor = Cipher(algorithms.AES(key), modes.CBC(self.IV)).encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+
+    def test_padding_is_removed(self):
+        for data in (b'segment', b's' * 16):
+            pad = 16 - len(data) % 16
+            encrypted = self.encrypt(data + bytes([pad]) * pad)
+            self.assertEqual(
+                HLSDownloader.decrypt_aes128(encrypted, self.KEY, self.IV),
+                data,
+            )
+
+    def test_invalid_padding_is_rejected(self):
+        for padded in (b's' * 15 + b'\x00', b's' * 15 + b'\x11',
+                       b's' * 13 + b'\x01\x02\x03'):
+            with self.assertRaisesRegex(ValueError, 'invalid PKCS7 padding'):
+                HLSDownloader.decrypt_aes128(
+                    self.encrypt(padded), self.KEY, self.IV,
+                )
+
+    def test_empty_data_is_rejected(self):
+        with self.assertRaisesRegex(ValueError, 'invalid PKCS7 padding'):
+            HLSDownloader.decrypt_aes128(b'', self.KEY, self.IV)
+
+class StoppingTest(unittest.TestCase):
+    def test_segments_stop_once_stopping_is_set(self):
+        segments = [Segment(f'http://h/{i}.ts', 4.0) for i in range(20)]
+        session = SlowSession(b'segment', delay=0.01)
+        stopping = threading.Event()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            hls = HLSDownloader(
+                session, executor, max_segments_in_flight=2, 
+                stopping=stopping,
+            )
+            received = []
+            with self.assertRaises(DownloadInterrupted):
+                for segment, data in hls.iter_segments(segments):
+                    received.append(segment)
+                    if len(received) == 3:
+                        stopping.set()
+        self.assertEqual(len(received), 3)
+        self.assertLessEqual(len(session.requests), 5)
+
+    def test_requests_are_not_sent_once_stopping(self):
+        session = SlowSession(b'playlist', delay=0)
+        stopping = threading.Event()
+        stopping.set()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            hls = HLSDownloader(
+                session, executor, max_segments_in_flight=1, 
+                stopping=stopping,
+            )
+            with self.assertRaises(DownloadInterrupted):
+                hls.get('http://h/media.m3u8')
+        self.assertEqual(session.requests, [])
+
+class CountingHLSDownloader:
+    def __init__(self):
+        self.downloads = 0
+
+    def download(self, playlist_info, fileobj):
+        self.downloads += 1
+        time.sleep(0.1)
+        fileobj.write(b'stream')
+        return len(b'stream')
+
+class LocalStreamsTest(unittest.TestCase):
+    def test_stream_is_downloaded_once_and_removed_after_release(self):
+        playlist_info = {'body': '#EXTM3U\n', 'url': 'http://h/master.m3u8'}
+        hls = CountingHLSDownloader()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            streams = LocalStreams(hls, tmpdir)
+            streams.register(playlist_info)
+            streams.register(playlist_info)
+            self.assertTrue(streams.is_shared(playlist_info))
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                results = list(executor.map(
+                    lambda _: streams.get(playlist_info), range(2)
+                ))
+            self.assertEqual(hls.downloads, 1)
+            path, size = results[0]
+            self.assertEqual(results, [(path, 6)] * 2)
+
+            streams.release(playlist_info)
+            self.assertTrue(os.path.exists(path))
+            streams.release(playlist_info)
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(os.listdir(tmpdir), [])
+
+    def test_finished_download_is_reused_by_a_later_job(self):
+        playlist_info = {'body': '#EXTM3U\n', 'url': 'http://h/master.m3u8'}
+        hls = CountingHLSDownloader()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            streams = LocalStreams(hls, tmpdir)
+            # the .ts and .mp4 jobs are submitted together
+            streams.register(playlist_info)
+            streams.register(playlist_info)
+            # the .ts job finishes before the .mp4 job starts
+            path, _ = streams.get(playlist_info)
+            streams.release(playlist_info)
+            self.assertTrue(streams.is_shared(playlist_info))
+            self.assertEqual(streams.get(playlist_info), (path, 6))
+            self.assertEqual(hls.downloads, 1)
+            streams.release(playlist_info)
+            self.assertFalse(os.path.exists(path))
+
+    def test_stream_used_by_a_single_job_is_not_shared(self):
+        playlist_info = {'body': '#EXTM3U\n', 'url': 'http://h/master.m3u8'}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            streams = LocalStreams(CountingHLSDownloader(), tmpdir)
+            streams.register(playlist_info)
+            self.assertFalse(streams.is_shared(playlist_info))
+
+    def test_stream_is_removed_when_the_sink_fails_to_write_it(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            temp_dir = os.path.join(tmpdir, 'temp')
+            os.makedirs(temp_dir)
+            downloader = Downloader(download_dir=tmpdir, temp_dir=temp_dir)
+            downloader.streams.hls = CountingHLSDownloader()
+            sink = ZipSink(os.path.join(tmpdir, 'C.zip'))
+            def fail(*args, **kwargs):
+                raise OSError('disk full')
+            sink.zf.write_fileobj_with_lock = fail
+            playlist_info = {'body': '#EXTM3U\n', 'url': 'http://h/m.m3u8'}
+            try:
+                with self.assertLogs('ntu-learn-downloader', 'ERROR'):
+                    downloader.download_all(iter([
+                        {'playlist_as_ts': playlist_info, 'filepath': 'C/v.ts'},
+                    ]), sink)
+            finally:
+                downloader.close()
+            self.assertEqual(os.listdir(temp_dir), [])
+
+class DownloadLocalTest(unittest.TestCase):
+    def test_subtitles_are_copied_with_a_local_playlist(self):
+        session = SlowSession({
+            'http://h/subs/en.m3u8': (
+                b'#EXTM3U\n#EXT-X-TARGETDURATION:6\n'
+                b'#EXTINF:6.0,\n0.vtt\n#EXTINF:4.5,\n1.vtt\n'
+                b'#EXT-X-ENDLIST\n'
+            ),
+            'http://h/subs/0.vtt': b'WEBVTT\n\none\n',
+            'http://h/subs/1.vtt': b'WEBVTT\n\ntwo\n',
+        }, delay=0)
+        with ThreadPoolExecutor(max_workers=2) as executor, \
+                tempfile.TemporaryDirectory() as tmpdir:
+            hls = HLSDownloader(session, executor, max_segments_in_flight=2)
+            path = hls.download_local('http://h/subs/en.m3u8', tmpdir)
+            with open(path) as f:
+                self.assertEqual(f.read().split(), [
+                    '#EXTM3U', '#EXT-X-TARGETDURATION:6', 
+                    '#EXT-X-MEDIA-SEQUENCE:0',
+                    '#EXTINF:6.000,', '0.vtt', '#EXTINF:4.500,', '1.vtt',
+                    '#EXT-X-ENDLIST',
+                ])
+            with open(os.path.join(tmpdir, '1.vtt'), 'rb') as f:
+                self.assertEqual(f.read(), b'WEBVTT\n\ntwo\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import sys
+import stat
+import time
+import zipfile
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from concurrent.futures import Future
+
+from downloader import Downloader, ZipSink, DownloadInterrupted
+
+class InterruptTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.downloader = Downloader(
+            download_dir=self.tmpdir.name, temp_dir=self.tmpdir.name,
+        )
+
+    def tearDown(self):
+        self.downloader.close()
+        self.tmpdir.cleanup()
+
+    def test_ffmpeg_is_terminated_when_stopping(self):
+        # stands in for ffmpeg, converting forever
+        path = os.path.join(self.tmpdir.name, 'ffmpeg')
+        with open(path, 'w') as f:
+            f.write(f'#!{sys.executable}\nimport time\ntime.sleep(60)\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+        threading.Timer(0.2, self.downloader.interrupt).start()
+        start = time.monotonic()
+        with self.assertRaises(DownloadInterrupted):
+            self.downloader.run_ffmpeg([path], 'C/v.mp4', None)
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_sink_is_closed_when_interrupted_again(self):
+        path = os.path.join(self.tmpdir.name, 'C.zip')
+        sink = ZipSink(path)
+        sink.writestr('C/a.txt', 'notes')
+        # still running when Ctrl-C is pressed again
+        pending = Future()
+        with mock.patch(
+            'downloader.wait_for_futures', side_effect=KeyboardInterrupt,
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                self.downloader.finish([pending], sink)
+        self.assertTrue(self.downloader.stopping.is_set())
+        with zipfile.ZipFile(path) as zf:
+            self.assertEqual(zf.read('C/a.txt'), b'notes')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import argparse
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from downloader import TokenBucket, HostLimiter
+from download_files import add_download_arguments, create_downloader
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.slept.append(delay)
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('downloader.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_is_received_without_waiting(self):
+        bucket = TokenBucket(rate=100, burst=500)
+        bucket.consume(500)
+        self.assertEqual(self.clock.slept, [])
+        self.assertEqual(bucket.tokens, 0)
+
+    def test_shortfall_becomes_debt_slept_off_at_the_rate(self):
+        bucket = TokenBucket(rate=100, burst=500)
+        bucket.consume(700)
+        self.assertEqual(bucket.tokens, -200)
+        self.assertEqual(self.clock.slept, [2.0])
+        # the next worker waits for the debt and its own bytes
+        bucket.consume(100)
+        self.assertEqual(bucket.tokens, -300)
+        self.assertEqual(self.clock.slept, [2.0, 3.0])
+
+    def test_tokens_refill_at_the_rate_up_to_the_burst(self):
+        bucket = TokenBucket(rate=100, burst=500)
+        bucket.consume(700)
+        self.clock.now += 3
+        bucket.consume(50)
+        self.assertEqual(bucket.tokens, 50)
+        self.assertEqual(self.clock.slept, [2.0])
+        self.clock.now += 60
+        bucket.consume(0)
+        self.assertEqual(bucket.tokens, 500)
+
+    def test_stopping_is_waited_on_instead_of_sleeping(self):
+        bucket = TokenBucket(rate=100, burst=0)
+        stopping = mock.Mock()
+        bucket.consume(250, stopping)
+        stopping.wait.assert_called_once_with(2.5)
+        self.assertEqual(self.clock.slept, [])
+
+class TokenBucketStoppingTest(unittest.TestCase):
+    def test_consume_returns_once_stopping_is_set(self):
+        # a 100 s debt
+        bucket = TokenBucket(rate=10, burst=0)
+        stopping = threading.Event()
+        threading.Timer(0.1, stopping.set).start()
+        started = time.monotonic()
+        bucket.consume(1000, stopping)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_consume_returns_at_once_when_already_stopping(self):
+        bucket = TokenBucket(rate=10, burst=0)
+        stopping = threading.Event()
+        stopping.set()
+        started = time.monotonic()
+        bucket.consume(1000, stopping)
+        self.assertLess(time.monotonic() - started, 1)
+
+class HostLimiterTest(unittest.TestCase):
+    def max_concurrent(self, limiter, url, n_threads=6):
+        '''
+        Holds a slot for url in each of n_threads threads,
+        returns the largest number held at once
+        '''
+        lock = threading.Lock()
+        held = [0]
+        peak = [0]
+        def work():
+            with limiter.slot(url):
+                with lock:
+                    held[0] += 1
+                    peak[0] = max(peak[0], held[0])
+                time.sleep(0.05)
+                with lock:
+                    held[0] -= 1
+        threads = [threading.Thread(target=work) for _ in range(n_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return peak[0]
+
+    def test_slots_are_capped_per_host(self):
+        limiter = HostLimiter(2, {'Slow.Example.com': 1})
+        self.assertEqual(
+            self.max_concurrent(limiter, 'https://slow.example.com/a'), 1,
+        )
+        self.assertEqual(
+            self.max_concurrent(limiter, 'https://other.example.com/a'), 2,
+        )
+
+    def test_hosts_do_not_share_slots(self):
+        limiter = HostLimiter(1)
+        with limiter.slot('https://a.example.com/x'):
+            slot = limiter.slot('https://b.example.com/x')
+            self.assertTrue(slot.semaphore.acquire(blocking=False))
+            slot.semaphore.release()
+            slot = limiter.slot('https://A.example.com:8443/y')
+            self.assertFalse(slot.semaphore.acquire(blocking=False))
+
+    def test_early_release_frees_the_slot_once(self):
+        limiter = HostLimiter(1)
+        with limiter.slot('https://a.example.com/x') as slot:
+            slot.release()
+            slot.release()
+            other = limiter.slot('https://a.example.com/y')
+            self.assertTrue(other.semaphore.acquire(blocking=False))
+            self.assertFalse(other.semaphore.acquire(blocking=False))
+            other.semaphore.release()
+
+    def test_command_line_limits_reach_the_downloader(self):
+        parser = argparse.ArgumentParser()
+        add_download_arguments(parser)
+        args = parser.parse_args([
+            '--max-connections-per-host', '3',
+            '--host-connection-limit', 'slow.example.com=1',
+        ])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            downloader = create_downloader(args, {}, tmpdir)
+            try:
+                limiter = downloader.hosts
+                self.assertEqual(
+                    self.max_concurrent(
+                        limiter, 'https://slow.example.com/a',
+                    ), 1,
+                )
+                self.assertEqual(
+                    self.max_concurrent(
+                        limiter, 'https://fast.example.com/a',
+                    ), 3,
+                )
+            finally:
+                downloader.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+
+from m3u8_parser import M3U8, MasterPlaylist, MediaPlaylist
+
+BASE_URL = 'https://cdn.example.com/vod/lecture1/master.m3u8?token=abc'
+
+MASTER = '''#EXTM3U
+#EXT-X-VERSION:4
+#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="subs",NAME="English",LANGUAGE="en",DEFAULT=YES,URI="subs/en.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=640000,CODECS="avc1.42e00a,mp4a.40.2",RESOLUTION=640x360
+360p/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2560000,AVERAGE-BANDWIDTH=2000000,CODECS="avc1.4d401f,mp4a.40.2",RESOLUTION=1280x720,FRAME-RATE=29.970,SUBTITLES="subs"
+/vod/lecture1/720p/index.m3u8
+'''
+
+MEDIA = '''#EXTM3U
+#EXT-X-VERSION:7
+#EXT-X-TARGETDURATION:6
+#EXT-X-MEDIA-SEQUENCE:100
+#EXT-X-MAP:URI="init.mp4",BYTERANGE="720@0"
+#EXT-X-KEY:METHOD=AES-128,URI="../keys/key.bin",IV=0x000102030405060708090a0b0c0d0e0f
+#EXTINF:6.0,intro
+#EXT-X-BYTERANGE:1000@720
+segments.m4s
+#EXTINF:6.0,
+#EXT-X-BYTERANGE:1500
+segments.m4s
+#EXT-X-KEY:METHOD=NONE
+#EXT-X-DISCONTINUITY
+#EXTINF:4.5,
+https://other.example.com/last.m4s
+#EXT-X-ENDLIST
+'''
+
+class AttributeListTest(unittest.TestCase):
+    def test_quoted_values_keep_commas_and_equals(self):
+        self.assertEqual(
+            M3U8.parse_attribute_list(
+                'BANDWIDTH=1280000,CODECS="avc1.4d401f,mp4a.40.2",'
+                'URI="key?a=1&b=2",RESOLUTION=1280x720'
+            ),
+            {
+                'BANDWIDTH': '1280000',
+                'CODECS': 'avc1.4d401f,mp4a.40.2',
+                'URI': 'key?a=1&b=2',
+                'RESOLUTION': '1280x720',
+            },
+        )
+
+class MasterPlaylistTest(unittest.TestCase):
+    def test_variants_are_sorted_and_resolved(self):
+        master = M3U8.parse_master(MASTER, BASE_URL)
+        self.assertIsInstance(master, MasterPlaylist)
+        best = master.best_variant
+        self.assertEqual(best.bandwidth, 2560000)
+        self.assertEqual(best.average_bandwidth, 2000000)
+        self.assertEqual(best.codecs, ['avc1.4d401f', 'mp4a.40.2'])
+        self.assertEqual(best.resolution, (1280, 720))
+        self.assertEqual(best.frame_rate, 29.97)
+        self.assertEqual(
+            best.uri, 'https://cdn.example.com/vod/lecture1/720p/index.m3u8'
+        )
+        self.assertEqual(
+            master.variants[1].uri, 
+            'https://cdn.example.com/vod/lecture1/360p/index.m3u8',
+        )
+
+    def test_subtitles_are_linked_to_their_variant(self):
+        master = M3U8.parse_master(MASTER, BASE_URL)
+        subtitles = master.best_variant.subtitle_renditions
+        self.assertEqual(len(subtitles), 1)
+        self.assertEqual(subtitles[0].language, 'en')
+        self.assertTrue(subtitles[0].default)
+        self.assertEqual(
+            subtitles[0].uri, 
+            'https://cdn.example.com/vod/lecture1/subs/en.m3u8',
+        )
+        self.assertEqual(master.variants[1].subtitle_renditions, [])
+
+    def test_master_without_variants(self):
+        master = M3U8.parse_master(
+            '#EXTM3U\n'
+            '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="a",NAME="en",URI="a.m3u8"\n',
+            BASE_URL,
+        )
+        with self.assertRaisesRegex(ValueError, 'master.m3u8'):
+            master.best_variant
+
+class MediaPlaylistTest(unittest.TestCase):
+    def setUp(self):
+        self.media = M3U8.parse_media(MEDIA, BASE_URL)
+
+    def test_header(self):
+        self.assertIsInstance(self.media, MediaPlaylist)
+        self.assertEqual(self.media.version, 7)
+        self.assertEqual(self.media.target_duration, 6)
+        self.assertTrue(self.media.end_list)
+        self.assertEqual(self.media.duration, 16.5)
+
+    def test_segments(self):
+        segments = self.media.segments
+        self.assertEqual([x.sequence for x in segments], [100, 101, 102])
+        self.assertEqual(segments[0].title, 'intro')
+        self.assertEqual(
+            [x.uri for x in segments], 
+            [
+                'https://cdn.example.com/vod/lecture1/segments.m4s',
+                'https://cdn.example.com/vod/lecture1/segments.m4s',
+                'https://other.example.com/last.m4s',
+            ],
+        )
+        self.assertEqual(
+            [x.discontinuity for x in segments], [False, False, True]
+        )
+
+    def test_byterange_offset_carries_over(self):
+        segments = self.media.segments
+        self.assertEqual(segments[0].byterange, (1000, 720))
+        # continues where the previous range of the same file ended
+        self.assertEqual(segments[1].byterange, (1500, 1720))
+        self.assertIsNone(segments[2].byterange)
+
+    def test_init_section(self):
+        init_map = self.media.segments[0].map
+        self.assertEqual(
+            init_map.uri, 'https://cdn.example.com/vod/lecture1/init.mp4'
+        )
+        self.assertEqual(init_map.byterange, (720, 0))
+        self.assertIs(self.media.segments[2].map, init_map)
+
+    def test_key_applies_until_method_none(self):
+        segments = self.media.segments
+        key = segments[0].key
+        self.assertEqual(key.method, 'AES-128')
+        self.assertEqual(key.uri, 'https://cdn.example.com/vod/keys/key.bin')
+        self.assertEqual(key.iv, '0x000102030405060708090a0b0c0d0e0f')
+        self.assertIs(segments[1].key, key)
+        self.assertIsNone(segments[2].key)
+
+    def test_uri_without_extinf(self):
+        with self.assertRaises(ValueError):
+            M3U8.parse('#EXTM3U\n#EXT-X-TARGETDURATION:6\nsegment.ts\n')
+
+if __name__ == '__main__':
+    unittest.main()
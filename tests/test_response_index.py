@@ -0,0 +1,94 @@
+import json
+import time
+import threading
+import unittest
+from collections import deque
+
+from browser import ResponseIndex, NTULearnClient
+
+M3U8 = 'application/vnd.apple.mpegurl'
+
+def response(request_id, t, mimetype=M3U8):
+    return {'request_id': request_id, 'time': t, 'mimeType': mimetype}
+
+class ResponseIndexTest(unittest.TestCase):
+    def test_since(self):
+        index = ResponseIndex()
+        for i, t in enumerate([3, 1, 2]):
+            index.add(response(str(i), t))
+        index.add(response('other', 2, 'text/html'))
+        self.assertEqual(
+            [x['request_id'] for x in index.since([M3U8], 2)], ['2', '0'],
+        )
+
+    def test_wait_for_wakes_up_when_a_response_is_added(self):
+        index = ResponseIndex()
+        index.add(response('old', 1))
+        timer = threading.Timer(0.1, index.add, [response('new', 5)])
+        timer.start()
+        start = time.monotonic()
+        results = index.wait_for([M3U8], 0, timeout=5, exclude={'old'})
+        timer.join()
+        self.assertEqual([x['request_id'] for x in results], ['new'])
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_wait_for_times_out(self):
+        index = ResponseIndex()
+        self.assertEqual(index.wait_for([M3U8], 0, timeout=0.05), [])
+
+class FakeDriver:
+    '''
+    Returns each batch of log entries once, then stops the watcher
+    '''
+    def __init__(self, client, batches):
+        self.client = client
+        self.batches = list(batches)
+
+    def get_log(self, log_type):
+        if len(self.batches) == 0:
+            self.client.log_watcher_stop.set()
+            return []
+        return self.batches.pop(0)
+
+def log_entry(message, timestamp=5000):
+    return {'message': json.dumps({'message': message}), 'timestamp': timestamp}
+
+class LogWatcherTest(unittest.TestCase):
+    def test_bad_entry_is_skipped(self):
+        client = NTULearnClient.__new__(NTULearnClient)
+        client.link_history_lock = threading.Lock()
+        client.link_history = deque()
+        client.responses = ResponseIndex()
+        client.log_watcher_stop = threading.Event()
+        good = log_entry({
+            'method': 'Network.responseReceived',
+            'params': {
+                'requestId': '1',
+                'response': {
+                    'url': 'http://h/index.m3u8', 'status': 200, 
+                    'mimeType': M3U8,
+                },
+            },
+        })
+        client.driver = FakeDriver(client, [
+            [
+                # not JSON
+                {'message': '{"Network.responseReceived"', 'timestamp': 1},
+                # missing params
+                log_entry({'method': 'Network.responseReceived'}),
+                good,
+            ],
+            [good | {'timestamp': 6000}],
+        ])
+        with self.assertLogs('ntu-learn-downloader', 'ERROR') as logs:
+            client.log_watcher_loop()
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual(
+            [(x['request_id'], x['time']) for x in client.responses.since(
+                [M3U8], 0
+            )],
+            [('1', 5.0), ('1', 6.0)],
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,335 @@
+import os
+import hashlib
+import tempfile
+import threading
+import unittest
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from downloader import (
+    Downloader, DirectorySink, ZipSink, Checkpoint, PartialDownload, 
+    RetryPolicy,
+)
+
+BODY = bytes(range(256)) * 40
+
+class RangeHandler(BaseHTTPRequestHandler):
+    '''
+    Serves server.files with a strong ETag, honouring Range and If-Range.
+    The first server.drop_after[path] (or server.drop_after[Range]) bytes 
+    of a body are sent before the connection is dropped. 
+    Requests are recorded in server.requests
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        body = server.files.get(self.path)
+        if body is None:
+            with server.lock:
+                server.requests.append((self.path, None, None))
+            self.send_error(404)
+            return
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        with server.lock:
+            server.requests.append((self.path, range_header, if_range))
+        start, end = 0, len(body) - 1
+        partial = range_header is not None and if_range in (None, etag)
+        if partial:
+            first, _, last = range_header.split('=')[1].partition('-')
+            start = int(first)
+            if last:
+                end = int(last)
+        content = body[start:end + 1]
+        self.send_response(206 if partial else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        if partial:
+            self.send_header(
+                'Content-Range', f'bytes {start}-{end}/{len(body)}'
+            )
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        drop_after = server.drop_after.get(
+            self.path, server.drop_after.get(range_header)
+        )
+        try:
+            if drop_after is not None:
+                self.wfile.write(content[:drop_after])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client only wanted the start of the body
+            self.close_connection = True
+
+class RangeServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        self.server.files = {'/file.bin': BODY}
+        self.server.drop_after = {}
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.download_dir = os.path.join(self.tmpdir.name, 'out')
+        os.makedirs(self.download_dir)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def run_course(self, download_infos, **options):
+        '''
+        Downloads like download_files.py does for a course, 
+        resuming the checkpoint of the previous run if any
+        '''
+        checkpoint = Checkpoint.for_course(self.download_dir, 'C')
+        sink = checkpoint.reopen_sink('dir', DirectorySink)
+        if sink is None:
+            sink = DirectorySink.open(self.download_dir)
+        checkpoint.start('dir', sink)
+        options.setdefault(
+            'retry_policy', RetryPolicy(attempts=1, backoff=0),
+        )
+        downloader = Downloader(
+            download_dir=self.download_dir, temp_dir=self.tmpdir.name,
+            chunk_size=1024, **options,
+        )
+        try:
+            downloader.download_all(
+                iter(download_infos), sink, checkpoint=checkpoint,
+            )
+        finally:
+            downloader.close()
+        return checkpoint
+
+    def read(self, filepath):
+        with open(os.path.join(self.download_dir, filepath), 'rb') as f:
+            return f.read()
+
+    def download_info(self, name):
+        return {
+            'attachment': {'href': self.base + '/' + name}, 
+            'filepath': 'C/' + name,
+        }
+
+    def kept_bytes(self, checkpoint, name):
+        path, _ = checkpoint.claim_partial('C/' + name, self.base + '/' + name)
+        with open(path, 'rb') as f:
+            return f.read()
+
+class FailedRunTest(RangeServerTest):
+    def test_checkpoint_is_kept_when_a_file_fails(self):
+        self.server.files['/ok.bin'] = b'ok'
+        download_infos = [
+            self.download_info('file.bin'), self.download_info('ok.bin'),
+        ]
+        self.server.drop_after['/file.bin'] = 5000
+        checkpoint = self.run_course(download_infos)
+        self.assertTrue(os.path.exists(checkpoint.path))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.download_dir, 'C', 'file.bin')
+        ))
+        self.assertEqual(self.read('C/ok.bin'), b'ok')
+        kept = len(self.kept_bytes(checkpoint, 'file.bin'))
+        self.assertGreater(kept, 0)
+
+        # the next run continues from the bytes that were kept,
+        # and skips the file that was written
+        del self.server.drop_after['/file.bin']
+        self.server.requests.clear()
+        checkpoint = self.run_course(download_infos)
+        self.assertEqual(self.read('C/file.bin'), BODY)
+        self.assertEqual(
+            [x[:2] for x in self.server.requests], 
+            [('/file.bin', f'bytes={kept}-')],
+        )
+        self.assertFalse(os.path.exists(checkpoint.path))
+        self.assertFalse(os.path.exists(checkpoint.partial_dir))
+
+    def test_checkpoint_is_removed_when_a_file_fails_for_good(self):
+        self.server.files['/ok.bin'] = b'v1'
+        download_infos = [
+            self.download_info('missing.bin'), self.download_info('ok.bin'),
+        ]
+        checkpoint = self.run_course(download_infos)
+        self.assertFalse(os.path.exists(checkpoint.path))
+        self.assertEqual(self.read('C/ok.bin'), b'v1')
+
+        # the next run checks every file again instead of resuming
+        self.server.files['/ok.bin'] = b'v2'
+        self.server.requests.clear()
+        checkpoint = self.run_course(download_infos)
+        self.assertEqual(self.read('C/ok.bin'), b'v2')
+        self.assertEqual(
+            sorted(x[0] for x in self.server.requests), 
+            ['/missing.bin', '/ok.bin'],
+        )
+        self.assertFalse(os.path.exists(checkpoint.path))
+
+    def test_file_the_zip_failed_to_write_is_resumed(self):
+        self.server.files['/ok.bin'] = b'ok'
+        download_infos = [
+            self.download_info('file.bin'), self.download_info('ok.bin'),
+        ]
+
+        def run(fail):
+            checkpoint = Checkpoint.for_course(self.download_dir, 'C')
+            sink = checkpoint.reopen_sink('zip', ZipSink)
+            if sink is None:
+                sink = ZipSink.open(self.download_dir, prefix='C-')
+            if fail:
+                write = sink.zf.write_compressed_with_lock
+                def fail_file_bin(zinfo, *args, **kwargs):
+                    if zinfo.filename == 'C/file.bin':
+                        raise OSError('disk full')
+                    return write(zinfo, *args, **kwargs)
+                sink.zf.write_compressed_with_lock = fail_file_bin
+            checkpoint.start('zip', sink)
+            downloader = Downloader(
+                download_dir=self.download_dir, temp_dir=self.tmpdir.name,
+                retry_policy=RetryPolicy(attempts=1, backoff=0),
+            )
+            try:
+                downloader.download_all(
+                    iter(download_infos), sink, checkpoint=checkpoint,
+                )
+            finally:
+                downloader.close()
+            return checkpoint, sink
+
+        with self.assertLogs('ntu-learn-downloader', 'ERROR') as logs:
+            checkpoint, sink = run(fail=True)
+        self.assertTrue(
+            any('1 files could not be written' in x for x in logs.output)
+        )
+        self.assertTrue(os.path.exists(checkpoint.path))
+        self.assertTrue(os.path.exists(sink.path))
+
+        # the same .zip file is reopened and only the missing file is added
+        self.server.requests.clear()
+        checkpoint, resumed = run(fail=False)
+        self.assertEqual(resumed.path, sink.path)
+        self.assertEqual(
+            [x[0] for x in self.server.requests], ['/file.bin'],
+        )
+        self.assertFalse(os.path.exists(checkpoint.path))
+        with zipfile.ZipFile(sink.path) as zf:
+            self.assertEqual(zf.read('C/file.bin'), BODY)
+            self.assertEqual(zf.read('C/ok.bin'), b'ok')
+
+    def test_changed_file_is_downloaded_from_the_start(self):
+        download_infos = [self.download_info('file.bin')]
+        self.server.drop_after['/file.bin'] = 5000
+        checkpoint = self.run_course(download_infos)
+        old_etag = '"%s"' % hashlib.md5(BODY).hexdigest()
+        self.assertEqual(checkpoint.partials['C/file.bin']['validator'], 
+                         old_etag)
+        kept = len(self.kept_bytes(checkpoint, 'file.bin'))
+
+        # If-Range no longer matches, the whole new file is sent
+        changed = BODY[::-1]
+        self.server.files['/file.bin'] = changed
+        del self.server.drop_after['/file.bin']
+        self.server.requests.clear()
+        self.run_course(download_infos)
+        self.assertEqual(self.read('C/file.bin'), changed)
+        self.assertEqual(self.server.requests, [
+            ('/file.bin', f'bytes={kept}-', old_etag),
+        ])
+
+class SegmentedTest(RangeServerTest):
+    OPTIONS = dict(segmented_connections=4, segmented_min_size=1)
+
+    def test_file_is_fetched_in_ranges(self):
+        self.run_course([self.download_info('file.bin')], **self.OPTIONS)
+        self.assertEqual(self.read('C/file.bin'), BODY)
+        # the first response is cut short after the first quarter
+        self.assertEqual(sorted(
+            x[1] or '' for x in self.server.requests
+        ), ['', 'bytes=2560-5119', 'bytes=5120-7679', 'bytes=7680-10239'])
+
+    def test_failed_range_keeps_the_contiguous_start(self):
+        self.server.drop_after['bytes=5120-7679'] = 100
+        checkpoint = self.run_course(
+            [self.download_info('file.bin')], **self.OPTIONS,
+        )
+        kept = self.kept_bytes(checkpoint, 'file.bin')
+        # the first two ranges are complete, the third was cut short 
+        # and the fourth is after a gap
+        self.assertTrue(5120 <= len(kept) <= 5220, len(kept))
+        self.assertEqual(kept, BODY[:len(kept)])
+        etag = '"%s"' % hashlib.md5(BODY).hexdigest()
+        self.assertEqual(checkpoint.partials['C/file.bin']['validator'], 
+                         etag)
+
+        del self.server.drop_after['bytes=5120-7679']
+        self.server.requests.clear()
+        self.run_course([self.download_info('file.bin')], **self.OPTIONS)
+        self.assertEqual(self.read('C/file.bin'), BODY)
+        self.assertEqual(
+            self.server.requests[0], 
+            ('/file.bin', f'bytes={len(kept)}-', etag),
+        )
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'C.checkpoint.jsonl')
+        self.partial_dir = os.path.join(self.tmpdir.name, 'C.partial')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_reopened_checkpoint_claims_partials(self):
+        checkpoint = Checkpoint(self.path, self.partial_dir)
+        checkpoint.start('dir', DirectorySink(self.tmpdir.name))
+        checkpoint.record_partial('C/a.pdf', 'http://h/a.pdf', '"v1"')
+        checkpoint.record_done('C/b.pdf')
+        path, validator = checkpoint.claim_partial('C/a.pdf', 'http://h/a.pdf')
+        os.makedirs(self.partial_dir)
+        with open(path, 'wb') as f:
+            f.write(b'start of a')
+        checkpoint.close()
+
+        checkpoint = Checkpoint(self.path, self.partial_dir)
+        self.assertTrue(checkpoint.is_done('C/b.pdf'))
+        self.assertFalse(checkpoint.is_done('C/a.pdf'))
+        partial = PartialDownload.open(checkpoint, 'C/a.pdf', 'http://h/a.pdf')
+        try:
+            self.assertEqual(partial.path, path)
+            self.assertEqual(partial.size, len(b'start of a'))
+            self.assertEqual(partial.range_headers(), {
+                'Range': 'bytes=10-', 'If-Range': '"v1"',
+            })
+            # already claimed by another worker
+            self.assertEqual(
+                checkpoint.claim_partial('C/a.pdf', 'http://h/a.pdf'), 
+                (None, None),
+            )
+        finally:
+            partial.close()
+            checkpoint.release_partial('C/a.pdf')
+
+    def test_partial_of_another_link_is_not_resumed(self):
+        checkpoint = Checkpoint(self.path, self.partial_dir)
+        checkpoint.start('dir', DirectorySink(self.tmpdir.name))
+        checkpoint.record_partial('C/a.pdf', 'http://h/old.pdf', '"v1"')
+        checkpoint.close()
+
+        checkpoint = Checkpoint(self.path, self.partial_dir)
+        path, validator = checkpoint.claim_partial('C/a.pdf', 'http://h/a.pdf')
+        self.assertIsNotNone(path)
+        self.assertIsNone(validator)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import threading
+import unittest
+
+from requests import exceptions as requests_exceptions
+
+from downloader import RetryPolicy, DownloadInterrupted
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_on_retry_is_called_before_each_retry(self):
+        policy = RetryPolicy(attempts=3, backoff=0, max_backoff=0)
+        errors = [requests_exceptions.ConnectionError('dropped')] * 2
+        def flaky():
+            if errors:
+                raise errors.pop()
+            return 'done'
+        retries = []
+        result = policy.call(
+            flaky, on_retry=lambda e, attempt, delay: retries.append(attempt),
+        )
+        self.assertEqual(result, 'done')
+        self.assertEqual(retries, [2, 3])
+
+    def test_errors_that_are_not_retryable_are_raised(self):
+        policy = RetryPolicy(attempts=3, backoff=0, max_backoff=0)
+        def fail():
+            raise ValueError('bad')
+        with self.assertRaises(ValueError):
+            policy.call(fail)
+
+    def test_stopping_interrupts_the_wait(self):
+        policy = RetryPolicy(attempts=3, backoff=60, max_backoff=60)
+        stopping = threading.Event()
+        stopping.set()
+        def fail():
+            raise requests_exceptions.Timeout()
+        with self.assertRaises(DownloadInterrupted):
+            policy.call(fail, stopping=stopping)
+
+if __name__ == '__main__':
+    unittest.main()
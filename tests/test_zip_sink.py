@@ -0,0 +1,94 @@
+import os
+import tempfile
+import threading
+import unittest
+import zipfile
+
+from downloader import ZipSink
+
+TEXT = 'lecture notes\n' * 1000
+
+class ZipSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'out.zip')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def assert_entries(self, names):
+        with zipfile.ZipFile(self.path) as zf:
+            self.assertEqual(sorted(zf.namelist()), sorted(names))
+            for name in names:
+                info = zf.getinfo(name)
+                self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(zf.read(name).decode('utf-8'), TEXT)
+
+    def test_compressed_entries(self):
+        sink = ZipSink(self.path, queue_size=1, compression_workers=2)
+        names = [f'C/{i}.txt' for i in range(8)]
+        for name in names:
+            sink.writestr(name, TEXT)
+        sink.close()
+        self.assert_entries(names)
+
+    def test_compressed_under_lock_without_zipfile_internals(self):
+        sink = ZipSink(self.path)
+        sink.zf.supports_precompressed = False
+        sink.writestr('C/a.txt', TEXT)
+        sink.close()
+        self.assert_entries(['C/a.txt'])
+
+    def test_pending_compressions_are_bounded(self):
+        sink = ZipSink(self.path, queue_size=2, compression_workers=1)
+        release = threading.Event()
+        compress = sink.compress_then_put_entry
+        def slow_compress(*args):
+            release.wait()
+            compress(*args)
+        sink.compress_then_put_entry = slow_compress
+
+        sink.writestr('C/0.txt', TEXT)
+        sink.writestr('C/1.txt', TEXT)
+        blocked = threading.Thread(
+            target=sink.writestr, args=('C/2.txt', TEXT)
+        )
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+        release.set()
+        blocked.join(5)
+        self.assertFalse(blocked.is_alive())
+        sink.close()
+        self.assert_entries(['C/0.txt', 'C/1.txt', 'C/2.txt'])
+
+    def test_failed_entries_are_recorded(self):
+        sink = ZipSink(self.path, compression_workers=2)
+        def fail(*args, **kwargs):
+            raise OSError('disk full')
+        sink.zf.write_compressed_with_lock = fail
+        sink.zf.writestr_with_lock = fail
+        written = []
+        with self.assertLogs('ntu-learn-downloader', 'ERROR'):
+            sink.writestr('C/a.txt', TEXT, lambda: written.append('a'))
+            sink.writestr('C/b.pdf', TEXT, lambda: written.append('b'))
+            sink.drain()
+        self.assertEqual(sink.failed, {'C/a.txt', 'C/b.pdf'})
+        self.assertEqual(written, [])
+        sink.close()
+
+    def test_empty_archive_is_removed(self):
+        sink = ZipSink(self.path)
+        sink.close()
+        self.assertTrue(sink.removed)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_empty_archive_is_kept_when_interrupted(self):
+        # an interrupted run is continued in the same file
+        sink = ZipSink(self.path)
+        sink.close(final=False)
+        self.assertFalse(sink.removed)
+        self.assertTrue(zipfile.is_zipfile(self.path))
+
+if __name__ == '__main__':
+    unittest.main()